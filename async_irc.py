@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from irc import OsuIrc, build_bot, get_config, setup_logging
+from metrics import start_metrics
+from reload import ConfigWatcher
+
+logger = logging.getLogger("irc.py")
+
+
+class AsyncOsuIrc(OsuIrc):
+    # same handlers as OsuIrc, driven by an asyncio loop so reads and paced
+    # sends never wait on each other
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.loop = None
+        self.reader = None
+        self.writer = None
+        self.wakeup = None
+        self.outbound.on_put = self.wake
+
+    async def connect(self, timeout=5.0) -> bool:
+        self.connection.connecting()
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        # drop lines queued for the old connection
+        self.outbound.clear()
+
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), timeout
+            )
+        except asyncio.TimeoutError:
+            logger.critical("~ Timeout Error!")
+            return False
+        except OSError as err:
+            logger.critical(f"~ No Internet Connection! | {err}")
+            return False
+
+        self.send(f"PASS {self.password}")
+        self.send(f"NICK {self.username}")
+        logger.info(
+            f"~ Connected to {self.host}:{self.port} | username: {self.username}"
+        )
+        return True
+
+    def disconnect(self) -> None:
+        self.stop = True
+
+        if self.writer:
+            self.writer.close()
+
+    def wake_calls(self) -> None:
+        # run on the loop right away, not after the next line read
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.run_calls)
+
+    def wake(self) -> None:
+        # called by the scheduler on put, possibly from an http pool thread
+        self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def close_connection(self) -> None:
+        self.writer.close()
+
+    def on_disconnected(self, reason=""):
+        self.reconnects.inc()
+
+        for room in self.rooms:
+            room["connected"] = False
+
+        self.connection.disconnected(str(reason))
+
+    async def write_loop(self) -> None:
+        while True:
+            self.wakeup.clear()
+            message, wait = self.outbound.pop()
+
+            if not message:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # every line the bucket allows right now goes out in one drain
+            while message:
+                self.writer.write(f"{message}\r\n".encode())
+                message, _ = self.outbound.pop()
+
+            await self.writer.drain()
+
+    async def read_loop(self) -> None:
+        while not self.stop:
+            self.run_calls()
+            self.check_rooms()
+            self.report_stats()
+            self.check_keepalive()
+
+            try:
+                line = await asyncio.wait_for(self.reader.readline(), timeout=5.0)
+            except asyncio.TimeoutError:
+                # the keepalive decides when the link is dead
+                continue
+            except ValueError as err:
+                # past the stream limit, what follows can't be framed anymore
+                raise ConnectionError(f"Line too long | {err}") from err
+
+            if not line:
+                raise ConnectionError("Disconnected from server")
+
+            self.connection.on_data()
+            self.inbound_lines.inc()
+
+            try:
+                self.on_receive(
+                    self.message_parser(line.decode(errors="replace").rstrip("\r\n"))
+                )
+            except Exception as err:
+                logger.exception(f"~ Handler error: {err}")
+
+    async def start(self):
+        while not self.stop:
+            await asyncio.sleep(self.connection.retry_in())
+
+            if not await self.connect():
+                self.connection.disconnected("connect failed")
+                continue
+
+            # a failed write ends the connection just like a failed read
+            tasks = {
+                asyncio.create_task(self.read_loop()),
+                asyncio.create_task(self.write_loop()),
+            }
+            reason = ""
+
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+                self.writer.close()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+            for task in done:
+                err = task.exception()
+
+                if isinstance(err, OSError):
+                    logger.error(f"~ Connection lost: {err}")
+                    reason = err
+                elif err:
+                    logger.error(f"~ Connection task failed: {err!r}", exc_info=err)
+                    reason = err
+
+            self.on_disconnected(reason)
+
+        logger.info("~ Program exited")
+
+
+if __name__ == "__main__":
+    config = get_config()
+    setup_logging(config.get("logging"))
+    irc = build_bot(config, engine=AsyncOsuIrc)
+    start_metrics(irc.metrics, config.get("metrics", {}))
+
+    if config.get("reload", {}).get("interval", 2):
+        # "reload": {"interval": 2}, 0 turns it off
+        ConfigWatcher(irc, **config.get("reload", {})).start()
+    asyncio.run(irc.start())
@@ -1,17 +1,9 @@
-import json
+from catalog import load_catalog
 
 
-def filter_map_by_ratings(min: int, max: int) -> list:
-    result = data = []
-
-    with open("beatmapset.json", "r") as file:
-        data = json.loads(file.read())
-
-    for item in data:
-        if min <= item.get("d") and max >= item.get("d"):
-            result.append(item)
-
-    return result
+def filter_map_by_ratings(min: float, max: float, filename="beatmapset.json") -> list:
+    catalog = load_catalog(filename)
+    return [catalog.pool[row].to_dict() for row in catalog.query(difficulty=(min, max))]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,468 @@
+# offline stand-in for irc.ppy.sh:6667 with simulated players, for end to end
+# load tests. speaks enough of Bancho for OsuIrc.connect() and start() to run
+# unchanged and measures the time from "The match has finished!" to the next
+# !mp map of the room.
+#
+# run from the repo root, the bot is optional:
+#   python benchmarks/fake_bancho.py --port 6667
+#   python benchmarks/fake_bancho.py --bot-rooms 200 --duration 120
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+from time import monotonic
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from outbound import TokenBucket  # noqa: E402
+
+logger = logging.getLogger("fake_bancho")
+bancho = ":BanchoBot!cho@ppy.sh PRIVMSG"
+
+
+def percentile(values: list, percent: float) -> float:
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+class Connection:
+    def __init__(self, server, writer: asyncio.StreamWriter, rate: tuple) -> None:
+        self.server = server
+        self.writer = writer
+        self.bucket = TokenBucket(*rate)
+        self.nick = None
+        self.channels = set()
+
+    def write(self, line: str) -> None:
+        self.server.lines_out += 1
+        self.writer.write(f"{line}\r\n".encode())
+
+
+class Room:
+    def __init__(self, room_id: int, name: str) -> None:
+        self.room_id = room_id
+        self.channel = f"#mp_{room_id}"
+        self.name = name
+        self.players = {}  # slot -> username
+        self.host = None
+        self.beatmap_id = 0
+        self.map_changed = asyncio.Event()
+        self.started = asyncio.Event()
+        self.start_timer = None
+        self.finished_at = None
+        self.open = True
+        self.task = None
+
+
+class FakeBancho:
+    def __init__(
+        self,
+        rate=(10, 5.0),
+        players=(4, 12),
+        join_chance=0.5,
+        leave_chance=0.05,
+        chat_chance=0.1,
+        map_timeout=5.0,
+        ready_delay=(0.5, 2.0),
+        match_seconds=(5.0, 10.0),
+    ) -> None:
+        self.rate = rate
+        self.players = players
+        self.join_chance = join_chance
+        self.leave_chance = leave_chance
+        self.chat_chance = chat_chance
+        self.map_timeout = map_timeout
+        self.ready_delay = ready_delay
+        self.match_seconds = match_seconds
+        self.connections = set()
+        self.rooms = {}  # channel -> Room
+        self.next_room_id = 100000
+        self.next_user_id = 1
+        self.lines_in = self.lines_out = self.dropped = 0
+        self.matches = 0
+        self.latencies = []  # seconds from match finish to the next !mp map
+
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        server = await asyncio.start_server(self.on_connection, host, port)
+        logger.info(f"~ Fake Bancho listening on {host}:{port}")
+        return server
+
+    async def on_connection(self, reader, writer) -> None:
+        connection = Connection(self, writer, self.rate)
+        self.connections.add(connection)
+
+        try:
+            while True:
+                line = await reader.readline()
+
+                if not line:
+                    break
+
+                self.lines_in += 1
+
+                # Bancho drops whatever goes over the limit
+                if not connection.bucket.take():
+                    self.dropped += 1
+                    continue
+
+                self.on_line(connection, line.decode(errors="replace").rstrip("\r\n"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.discard(connection)
+            writer.close()
+            logger.info(f"~ {connection.nick} disconnected")
+
+    def on_line(self, connection: Connection, line: str) -> None:
+        command, _, rest = line.partition(" ")
+
+        if command == "NICK":
+            connection.nick = rest.strip()
+            connection.write(
+                f":cho.ppy.sh 001 {connection.nick} :Welcome to osu!Bancho."
+            )
+        elif command == "JOIN":
+            for channel in rest.lstrip(":").split(","):
+                self.join(connection, channel.strip())
+        elif command == "PING":
+            connection.write(f":cho.ppy.sh PONG {rest}")
+        elif command == "PRIVMSG":
+            target, _, text = rest.partition(" :")
+            text = text.strip()
+
+            if target == "BanchoBot" and text.startswith("mp make "):
+                self.make_room(connection, text[8:].strip())
+            elif target in self.rooms and text.startswith("!mp "):
+                self.on_mp(self.rooms[target], text[4:])
+
+    def join(self, connection: Connection, channel: str) -> None:
+        room = self.rooms.get(channel)
+
+        if not room:
+            connection.write(
+                f":cho.ppy.sh 403 {connection.nick} {channel} :No such channel"
+            )
+            return
+
+        connection.channels.add(channel)
+        connection.write(f":{connection.nick}!cho@ppy.sh JOIN :{channel}")
+
+    def make_room(self, connection: Connection, name: str) -> None:
+        room = Room(self.next_room_id, name)
+        self.next_room_id += 1
+        self.rooms[room.channel] = room
+        connection.channels.add(room.channel)
+        connection.write(
+            f"{bancho} {connection.nick} :Created the tournament match"
+            f" https://osu.ppy.sh/mp/{room.room_id} {name}"
+        )
+        room.task = asyncio.create_task(self.simulate(room))
+
+    def say(self, room: Room, message: str, sender="BanchoBot") -> None:
+        for connection in list(self.connections):
+            if room.channel in connection.channels:
+                connection.write(
+                    f":{sender}!cho@ppy.sh PRIVMSG {room.channel} :{message}"
+                )
+
+    def on_mp(self, room: Room, text: str) -> None:
+        command, _, args = text.partition(" ")
+        # "!mp settings | Queue: ..." carries chat after the command
+        args = args.split(" | ")[0].strip()
+
+        if command == "map":
+            beatmap_id = args.split()[0] if args else "0"
+
+            if room.finished_at is not None:
+                self.latencies.append(monotonic() - room.finished_at)
+                room.finished_at = None
+
+            room.beatmap_id = int(beatmap_id) if beatmap_id.isdigit() else 0
+            self.say(
+                room,
+                f"Changed beatmap to https://osu.ppy.sh/b/{room.beatmap_id}"
+                " Artist - Title",
+            )
+            room.map_changed.set()
+        elif command == "host":
+            if args in room.players.values():
+                room.host = args
+                self.say(room, f"{args} became the host.")
+            else:
+                self.say(room, "User not found")
+        elif command == "start":
+            if args.isdigit():
+                self.say(room, f"Queued the match to start in {args} seconds")
+                room.start_timer = asyncio.get_running_loop().call_later(
+                    int(args), self.start_match, room
+                )
+            else:
+                self.start_match(room)
+        elif command == "aborttimer":
+            if room.start_timer:
+                room.start_timer.cancel()
+                room.start_timer = None
+            self.say(room, "Countdown aborted")
+        elif command == "settings":
+            self.settings(room)
+        elif command == "name":
+            room.name = args
+            self.say(room, "Room name updated")
+        elif command == "password":
+            self.say(room, "Changed the match password")
+        elif command == "set":
+            self.say(room, "Changed match settings")
+        elif command == "mods":
+            self.say(room, "Enabled FreeMod, disabled NoMod")
+        elif command == "close":
+            self.say(room, "Closed the match")
+            self.close(room)
+
+    def start_match(self, room: Room) -> None:
+        room.start_timer = None
+
+        if room.players and not room.started.is_set():
+            self.say(room, "The match has started!")
+            room.started.set()
+
+    def settings(self, room: Room) -> None:
+        self.say(
+            room,
+            f"Room name: {room.name}, History: https://osu.ppy.sh/mp/{room.room_id}",
+        )
+        self.say(
+            room, f"Beatmap: https://osu.ppy.sh/b/{room.beatmap_id} Artist - Title"
+        )
+        self.say(room, "Team mode: HeadToHead, Win condition: Score")
+        self.say(room, "Active mods: Freemod")
+        self.say(room, f"Players: {len(room.players)}")
+
+        for slot, user in sorted(room.players.items()):
+            roles = " [Host]" if user == room.host else ""
+            self.say(
+                room,
+                f"Slot {slot}  Not Ready https://osu.ppy.sh/u/{slot} {user:<15}{roles}",
+            )
+
+    def close(self, room: Room) -> None:
+        room.open = False
+        self.rooms.pop(room.channel, None)
+
+        for connection in self.connections:
+            connection.channels.discard(room.channel)
+
+    def churn(self, room: Room) -> None:
+        for slot, user in list(room.players.items()):
+            if random.random() < self.leave_chance:
+                del room.players[slot]
+                self.say(room, f"{user} left the game.")
+
+                if user == room.host:
+                    room.host = None
+
+        target = random.randint(*self.players)
+
+        while (
+            len(room.players) < min(target, 16) and random.random() < self.join_chance
+        ):
+            slot = min(set(range(1, 17)) - room.players.keys())
+            user = f"player_{self.next_user_id}"
+            self.next_user_id += 1
+            room.players[slot] = user
+            self.say(room, f"{user} joined in slot {slot}.")
+
+    async def simulate(self, room: Room) -> None:
+        # one match cycle at a time: players come and go, a map is picked by the bot
+        # or the host, everyone readies up, the match runs and finishes
+        while room.open:
+            self.churn(room)
+
+            if not room.players:
+                await asyncio.sleep(1)
+                continue
+
+            if random.random() < self.chat_chance:
+                user = random.choice(list(room.players.values()))
+                self.say(room, random.choice(["!queue", "!skip", "!users"]), user)
+
+            try:
+                await asyncio.wait_for(room.map_changed.wait(), self.map_timeout)
+            except asyncio.TimeoutError:
+                if not room.host:
+                    continue
+
+                # autohost room, the host picks something
+                room.beatmap_id = random.randint(1, 4000000)
+                self.say(
+                    room,
+                    f"Beatmap changed to: Artist - Title [Insane]"
+                    f" (https://osu.ppy.sh/b/{room.beatmap_id})",
+                )
+
+            room.map_changed.clear()
+            await asyncio.sleep(random.uniform(*self.ready_delay))
+            room.started.clear()
+            self.say(room, "All players are ready")
+
+            try:
+                await asyncio.wait_for(room.started.wait(), self.map_timeout)
+            except asyncio.TimeoutError:
+                continue
+
+            await asyncio.sleep(random.uniform(*self.match_seconds))
+
+            if not room.open:
+                return
+
+            room.started.clear()
+            self.matches += 1
+            self.say(room, "The match has finished!")
+            room.finished_at = monotonic()
+
+    async def close(self) -> None:
+        for room in list(self.rooms.values()):
+            room.open = False
+            room.task.cancel()
+
+        for connection in list(self.connections):
+            connection.writer.close()
+
+        # let the connection handlers see their eof
+        await asyncio.sleep(0.1)
+
+    def stats(self) -> dict:
+        latencies = self.latencies
+        return {
+            "connections": len(self.connections),
+            "rooms": len(self.rooms),
+            "players": sum(len(room.players) for room in self.rooms.values()),
+            "matches": self.matches,
+            "lines_in": self.lines_in,
+            "lines_out": self.lines_out,
+            "dropped": self.dropped,
+            "finish_to_map": {
+                "count": len(latencies),
+                "p50": round(percentile(latencies, 50), 4),
+                "p95": round(percentile(latencies, 95), 4),
+                "p99": round(percentile(latencies, 99), 4),
+                "max": round(max(latencies, default=0.0), 4),
+            },
+        }
+
+
+def run_bot(port: int, rooms: int, engine: str, rate: tuple) -> None:
+    # the real bot against the fake server, no http
+    from cache import BeatmapCache
+    from irc import OsuIrc
+    from replay_bench import StubFetcher
+
+    kwargs = {
+        "username": "bot",
+        "password": "password",
+        "rooms": [
+            {
+                "name": f"load room {index}",
+                "password": "",
+                "min": 5.0,
+                "max": 6.0,
+                "play_mode": 0,
+                "team_mode": 0,
+                "score_mode": 0,
+                "bot_mode": 1 if index % 2 == 0 else 0,
+                "beatmapset_filename": "std-5to6star-9ar-3to7mins.json",
+            }
+            for index in range(rooms)
+        ],
+        "host": "127.0.0.1",
+        "port": port,
+        "rate_limit": {"messages": rate[0], "seconds": rate[1]},
+        "cache": BeatmapCache(path=None),
+        "fetcher": StubFetcher(),
+    }
+    os.chdir(root)
+    logging.getLogger("irc.py").setLevel(logging.WARNING)
+
+    if engine == "async":
+        from async_irc import AsyncOsuIrc
+
+        asyncio.run(AsyncOsuIrc(**kwargs).start())
+        return
+
+    irc = OsuIrc(**kwargs)
+
+    if irc.connect():
+        irc.start()
+
+
+async def main(args) -> None:
+    fake = FakeBancho(
+        rate=(args.rate, args.per),
+        players=(args.min_players, args.max_players),
+        map_timeout=args.map_timeout,
+        match_seconds=(args.match_min, args.match_max),
+    )
+    server = await fake.serve(args.host, args.port)
+    bot = None
+
+    if args.bot_rooms:
+        port = server.sockets[0].getsockname()[1]
+        bot = multiprocessing.Process(
+            target=run_bot,
+            args=(port, args.bot_rooms, args.engine, (args.rate, args.per)),
+            daemon=True,
+        )
+        bot.start()
+
+    started = monotonic()
+
+    try:
+        while not args.duration or monotonic() - started < args.duration:
+            await asyncio.sleep(args.interval)
+            logger.info(f"~ {json.dumps(fake.stats())}")
+    finally:
+        if bot:
+            bot.terminate()
+
+        server.close()
+        await fake.close()
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(fake.stats(), f, indent=2)
+
+            logger.info(f"~ saved {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6667)
+    parser.add_argument("--rate", type=int, default=10, help="messages per --per")
+    parser.add_argument("--per", type=float, default=5.0)
+    parser.add_argument("--min-players", type=int, default=4)
+    parser.add_argument("--max-players", type=int, default=12)
+    parser.add_argument("--match-min", type=float, default=5.0)
+    parser.add_argument("--match-max", type=float, default=10.0)
+    parser.add_argument("--map-timeout", type=float, default=5.0)
+    parser.add_argument("--bot-rooms", type=int, default=0)
+    parser.add_argument("--engine", choices=["sync", "async"], default="sync")
+    parser.add_argument("--duration", type=float, default=0, help="0 runs forever")
+    parser.add_argument("--interval", type=float, default=10.0)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,199 @@
+# lines/sec of the inbound parser, the old dict + if/elif parsing against parser.py
+# run from the repo root: python benchmarks/parser_bench.py
+import os
+import re
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import parse, valid_roles  # noqa: E402
+
+bancho = ":BanchoBot!cho@ppy.sh PRIVMSG #mp_100 :"
+lines = [
+    bancho + "Room name: 5.0 - 6.0 | NoHost, History: https://osu.ppy.sh/mp/100",
+    bancho + "Beatmap: https://osu.ppy.sh/b/553131 UNDEAD CORPORATION - Everything",
+    bancho + "Team mode: HeadToHead, Win condition: Score",
+    bancho + "Active mods: Freemod",
+    bancho + "Players: 8",
+    *(
+        bancho
+        + f"Slot {slot}  Not Ready https://osu.ppy.sh/u/{slot} player {slot}"
+        + "         [Host / Hidden, HardRock]"
+        for slot in range(1, 9)
+    ),
+    bancho + "player_9 joined in slot 9.",
+    bancho + "player_9 left the game.",
+    bancho + "player_2 became the host.",
+    bancho + "The match has started!",
+    bancho + "The match has finished!",
+    bancho
+    + "Beatmap changed to: A - Song [TV Size] [Insane] (https://osu.ppy.sh/b/55)",
+    bancho + "Changed beatmap to https://osu.ppy.sh/b/55 A - Song",
+    ":player_1!cho@ppy.sh PRIVMSG #mp_100 :!queue",
+    ":cho.ppy.sh 353 bot = #mp_100 :@BanchoBot +bot",
+]
+
+
+class Legacy:
+    # message_parser and the parsing half of on_receive before parser.py,
+    # handlers, room lookups and logging left out
+
+    def username_parser(self, username: str) -> str:
+        return username.strip().replace(" ", "_")
+
+    def message_parser(self, message: str) -> dict:
+        if message.startswith(":cho.ppy.sh"):
+            return {
+                "type": "server",
+                "sender": "cho.ppy.sh",
+                "message": message,
+                "room_id": None,
+            }
+
+        if "PRIVMSG" in message:
+            split_message = message.split(" :")
+            sender = self.username_parser(
+                split_message[0][1 : split_message[0].rfind("!")]
+            )
+            sender_message = " :".join(split_message[1:])
+
+            if "PRIVMSG #mp_" in message:
+                room_id_index = split_message[0].rfind("#mp_")
+                room_id = split_message[0][room_id_index:]
+                return {
+                    "type": "room",
+                    "sender": sender,
+                    "message": sender_message,
+                    "room_id": room_id,
+                }
+            else:
+                return {
+                    "type": "private",
+                    "sender": sender,
+                    "message": sender_message,
+                    "room_id": None,
+                }
+
+        return {"type": None, "sender": None, "message": message, "room_id": None}
+
+    def on_receive(self, data: dict):
+        type, message = data.get("type"), data.get("message")
+
+        if type == "private":
+            if data.get("sender") == "BanchoBot":
+                if message.startswith("Created the tournament match"):
+                    search_id_name = re.search(
+                        r"https://osu.ppy.sh/mp/(\d*)? (.*)", message
+                    )
+                    return search_id_name.group(2), "#mp_" + search_id_name.group(1)
+        elif type == "room":
+            room_id = data.get("room_id")
+            sender = data.get("sender")
+
+            if not room_id and not data.get("sender"):
+                return
+
+            if sender != "BanchoBot":
+                return room_id, sender, message
+
+            if message == "Closed the match":
+                return room_id
+            elif "joined in slot" in message:
+                return self.username_parser(message.split(" joined in slot")[0])
+            elif message.endswith("left the game."):
+                return self.username_parser(message.split(" left the game.")[0])
+            elif message.endswith(" became the host."):
+                return self.username_parser(message.split(" became the host.")[0])
+            elif message == "The match has started!":
+                return room_id
+            elif message == "The match has finished!":
+                return room_id
+            elif message == "All players are ready":
+                return room_id
+            elif message.startswith("Beatmap changed to: "):
+                search = re.search(r"Beatmap.*?: (.*)? \[(.*?)\] \((.*)?\)", message)
+                return (
+                    search.group(2),
+                    search.group(1),
+                    search.group(3),
+                    int(search.group(3).split("/")[-1]),
+                )
+            elif message.startswith("Changed beatmap to "):
+                message_split = message.split(" ")
+                url = message_split[3]
+                url_split = url.split("/")
+                return url, url_split[-1], "".join(message_split[4:])
+            elif message.startswith("Slot "):
+                words = message.split()
+                slot = words[1]
+
+                if words[2] != "Ready":
+                    status = " ".join(words[2:4])
+                    url = words[4]
+                    user_and_roles = " ".join(words[5:])
+                else:
+                    status = words[2]
+                    url = words[3]
+                    user_and_roles = " ".join(words[4:])
+
+                username = user_and_roles
+                roles = None
+                start_roles_index = user_and_roles.rfind("[")
+
+                if user_and_roles[-1] == "]" and start_roles_index != -1:
+                    username = user_and_roles[0 : start_roles_index - 1]
+                    roles = (
+                        user_and_roles[start_roles_index + 1 : -1]
+                        .replace(" ", "")
+                        .split("/")
+                    )
+                    roles = roles[0:-1] + roles[-1].split(",")
+
+                    for role in roles:
+                        if role.strip() not in valid_roles:
+                            username = user_and_roles
+                            roles = None
+                            break
+
+                username = username.strip().replace(" ", "_")
+                user_id = url.split("/")[-1]
+                return (
+                    status,
+                    int(slot) if slot.isdigit() else 0,
+                    int(user_id) if user_id.isdigit() else 0,
+                    self.username_parser(username),
+                    roles,
+                )
+            elif message.startswith("Players: "):
+                return int(message.split(" ")[-1])
+
+
+legacy = Legacy()
+
+
+def legacy_parse(line: str):
+    return legacy.on_receive(legacy.message_parser(line))
+
+
+def run(parser, rounds: int) -> float:
+    start = perf_counter()
+
+    for _ in range(rounds):
+        for line in lines:
+            parser(line)
+
+    return rounds * len(lines) / (perf_counter() - start)
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    # best of 3, interleaved so both see the same machine noise
+    before = after = 0.0
+
+    for _ in range(3):
+        before = max(before, run(legacy_parse, rounds))
+        after = max(after, run(parse, rounds))
+    print(f"lines: {rounds * len(lines)}")
+    print(f"before: {before:,.0f} lines/sec")
+    print(f"after:  {after:,.0f} lines/sec ({after / before:.2f}x)")
@@ -0,0 +1,353 @@
+# replays synthetic Bancho traffic through message_parser -> on_receive -> on_*
+# handlers with send and http stubbed and a fake clock, for 1/10/100 rooms over
+# pools of 3k/100k/1M maps. results are saved as json for regression checks.
+#
+# run from the repo root:
+#   python benchmarks/replay_bench.py
+#   python benchmarks/replay_bench.py --rooms 10 --pools 3000 --compare old.json
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import tracemalloc
+from array import array
+from datetime import datetime
+from time import perf_counter
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import irc  # noqa: E402
+import pool  # noqa: E402
+from cache import BeatmapCache  # noqa: E402
+from history import MatchHistory  # noqa: E402
+
+sample_pool = os.path.join(root, "beatmapsets", "std-5to6star-9ar-3to7mins.json")
+bancho = ":BanchoBot!cho@ppy.sh PRIVMSG "
+players = 8
+
+
+class FakeClock:
+    # time only moves when the replay says so
+    def __init__(self, now=1000.0) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class StubFetcher:
+    # no http, lookups run inline and return a canned beatmapset
+    def __init__(self) -> None:
+        self.fetches = 0
+
+    def submit(self, handler, **kwargs):
+        return handler(**kwargs)
+
+    def fetch_beatmapset(self, url: str, deadline: float = None) -> dict:
+        self.fetches += 1
+        beatmap_id = int(url.rstrip("/").split("/")[-1])
+        return {
+            "id": beatmap_id,
+            "artist": "Artist",
+            "title": "Title",
+            "creator": "mapper",
+            "status": "ranked",
+            "availability": {"download_disabled": False},
+            "beatmaps": [
+                {
+                    "id": beatmap_id,
+                    "version": "Insane",
+                    "difficulty_rating": 5.5,
+                    "status": "ranked",
+                    "cs": 4,
+                    "ar": 9,
+                    "url": f"https://osu.ppy.sh/beatmaps/{beatmap_id}",
+                }
+            ],
+        }
+
+    def close(self) -> None:
+        pass
+
+
+class ReplayIrc(irc.OsuIrc):
+    def send(self, message: str) -> None:
+        self.sent += 1
+
+
+def synthetic_pool(size: int) -> pool.BeatmapPool:
+    # the sample pool repeated up to size, with unique beatmap ids
+    sample = pool.load_pool(sample_pool)
+    repeats = -(-size // len(sample))
+    synthetic = pool.BeatmapPool(filename=f"replay-{size}.json")
+
+    for key, column in sample.columns.items():
+        synthetic.columns[key] = (column * repeats)[:size]
+
+    synthetic.columns["beatmap_id"] = array("q", range(1, size + 1))
+    synthetic.size = size
+    return synthetic
+
+
+def room_config(index: int, filename: str) -> dict:
+    return {
+        "name": f"replay room {index}",
+        "password": "",
+        "min": 5.0,
+        "max": 6.0,
+        "play_mode": 0,
+        "team_mode": 0,
+        "score_mode": 0,
+        # every other room picks maps from the pool
+        "bot_mode": 1 if index % 2 == 0 else 0,
+        "beatmapset_filename": filename,
+    }
+
+
+def traffic(rooms: int, rounds: int, size: int) -> list:
+    # one match cycle per round, the rooms interleaved like on a busy connection
+    lines = [
+        f"{bancho}bot :Created the tournament match https://osu.ppy.sh/mp/{1000 + room}"
+        f" replay room {room}"
+        for room in range(rooms)
+    ]
+
+    for round in range(rounds):
+        for step in range(11):
+            for room in range(rooms):
+                channel = f"#mp_{1000 + room}"
+                prefix = f"{bancho}{channel} :"
+                users = [f"player {room} {slot}" for slot in range(1, players + 1)]
+                beatmap_id = (round * rooms + room) % size + 1
+
+                if step == 0:
+                    lines += [
+                        f"{prefix}{user} joined in slot {slot}."
+                        for slot, user in enumerate(users, 1)
+                    ]
+                elif step == 1:
+                    lines.append(f"{prefix}Room name: replay room {room}")
+                    lines.append(f"{prefix}Players: {players}")
+                    lines += [
+                        f"{prefix}Slot {slot}  Not Ready https://osu.ppy.sh/u/{slot}"
+                        f" {user:<15} [{'Host / ' if slot == 1 else ''}Hidden]"
+                        for slot, user in enumerate(users, 1)
+                    ]
+                elif step == 2:
+                    lines.append(f"{prefix}{users[round % players]} became the host.")
+                elif step == 3:
+                    # one short of a skip majority, the vote lines are throttled
+                    for user in users[1 : players // 2]:
+                        sender = user.replace(" ", "_")
+                        lines.append(f":{sender}!cho@ppy.sh PRIVMSG {channel} :!queue")
+                        lines.append(f":{sender}!cho@ppy.sh PRIVMSG {channel} :!skip")
+                elif step == 4:
+                    lines.append(
+                        f"{prefix}Beatmap changed to: Artist - Title [Insane]"
+                        f" (https://osu.ppy.sh/b/{beatmap_id})"
+                    )
+                elif step == 5:
+                    lines.append(
+                        f"{prefix}Changed beatmap to https://osu.ppy.sh/b/{beatmap_id}"
+                        " Artist - Title"
+                    )
+                elif step == 6:
+                    lines.append(f"{prefix}All players are ready")
+                elif step == 7:
+                    lines.append(f"{prefix}The match has started!")
+                elif step == 8:
+                    lines.append(f"{prefix}The match has finished!")
+                elif step == 9:
+                    lines.append(f"{prefix}{users[-1]} left the game.")
+                    lines.append(f"{prefix}{users[-2]} left the game.")
+                else:
+                    lines.append(f":cho.ppy.sh 353 bot = {channel} :@BanchoBot +bot")
+
+    return lines
+
+
+def instrument(bot: irc.OsuIrc, timings: dict, allocations: bool) -> None:
+    # wrap the entry handlers on the instance, nested calls count to their caller
+    names = {"on_room_created", *irc.room_handlers.values()}
+
+    for name in names:
+        timings[name] = {"calls": 0, "seconds": 0.0, "bytes": 0}
+        setattr(bot, name, timed(getattr(bot, name), timings[name], allocations))
+
+
+def timed(handler, timing: dict, allocations: bool):
+    def wrapper(*args, **kwargs):
+        if allocations:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+        start = perf_counter()
+        result = handler(*args, **kwargs)
+        timing["seconds"] += perf_counter() - start
+        timing["calls"] += 1
+
+        if allocations:
+            timing["bytes"] += tracemalloc.get_traced_memory()[1] - before
+
+        return result
+
+    return wrapper
+
+
+def replay(bot: irc.OsuIrc, lines: list, clock: FakeClock) -> float:
+    start = perf_counter()
+
+    for line in lines:
+        clock.sleep(0.01)
+        # as the bot loop does, results from the http pool come back here
+        bot.run_calls()
+        bot.on_receive(bot.message_parser(line))
+
+    return perf_counter() - start
+
+
+def run(rooms: int, size: int, rounds: int) -> dict:
+    clock = FakeClock()
+    irc.monotonic = clock
+    filename = f"replay-{size}.json"
+    pool.pools["beatmapsets/" + filename] = synthetic_pool(size)
+    lines = traffic(rooms, rounds, size)
+    result = {"rooms": rooms, "pool": size, "lines": len(lines)}
+    # match history on a real sqlite file, written by its own thread
+    directory = tempfile.TemporaryDirectory()
+
+    for allocations in (False, True):
+        timings = {}
+        start = perf_counter()
+        bot = ReplayIrc(
+            "bot",
+            "password",
+            rooms=[room_config(index, filename) for index in range(rooms)],
+            cache=BeatmapCache(path=None, clock=clock),
+            fetcher=StubFetcher(),
+            history=MatchHistory(
+                path=os.path.join(directory.name, f"{allocations}.db")
+            ),
+        )
+        bot.sent = 0
+        bot.cooldowns.clock = clock
+        setup = perf_counter() - start
+        instrument(bot, timings, allocations)
+
+        if not allocations:
+            elapsed = replay(bot, lines, clock)
+            bot.history.close()
+            result["setup_sec"] = round(setup, 4)
+            result["lines_per_sec"] = round(len(lines) / elapsed)
+            result["sent"] = bot.sent
+            result["blocked"] = bot.cooldowns.blocked
+            result["handlers"] = {
+                name: {
+                    "calls": timing["calls"],
+                    "total_ms": round(timing["seconds"] * 1000, 3),
+                    "avg_us": round(timing["seconds"] * 1e6 / timing["calls"], 2),
+                }
+                for name, timing in sorted(timings.items())
+                if timing["calls"]
+            }
+            handled = sum(timing["seconds"] for timing in timings.values())
+            result["parse_dispatch_ms"] = round((elapsed - handled) * 1000, 3)
+            continue
+
+        # a second pass under tracemalloc, too slow to time
+        tracemalloc.start()
+        replay(bot, lines, clock)
+        bot.history.close()
+        result["peak_kib"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        tracemalloc.stop()
+
+        for name, timing in timings.items():
+            if timing["calls"]:
+                result["handlers"][name]["alloc_avg_bytes"] = round(
+                    timing["bytes"] / timing["calls"]
+                )
+
+    directory.cleanup()
+    del pool.pools["beatmapsets/" + filename]
+    return result
+
+
+def compare(results: list, filename: str) -> None:
+    with open(filename, "r") as f:
+        previous = {
+            (result["rooms"], result["pool"]): result
+            for result in json.load(f)["results"]
+        }
+
+    for result in results:
+        old = previous.get((result["rooms"], result["pool"]))
+
+        if not old:
+            continue
+
+        print(
+            f"rooms {result['rooms']:>3} | pool {result['pool']:>7}"
+            f" | {old['lines_per_sec']:>9,} -> {result['lines_per_sec']:>9,} lines/sec"
+            f" ({result['lines_per_sec'] / old['lines_per_sec']:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rooms", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument(
+        "--pools", type=int, nargs="+", default=[3000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None)
+    args = parser.parse_args()
+
+    results = []
+
+    for size in args.pools:
+        for rooms in args.rooms:
+            result = run(rooms, size, args.rounds)
+            results.append(result)
+            print(
+                f"rooms {rooms:>3} | pool {size:>7} | {result['lines']:>6} lines"
+                f" | {result['lines_per_sec']:>9,} lines/sec"
+                f" | setup {result['setup_sec']:.3f}s | peak {result['peak_kib']} KiB"
+            )
+
+            for name, handler in result["handlers"].items():
+                print(
+                    f"    {name:<22} {handler['calls']:>6} calls"
+                    f" {handler['avg_us']:>9.2f} us {handler['alloc_avg_bytes']:>7} B"
+                )
+
+    output = args.output or os.path.join(
+        root,
+        "benchmarks",
+        "results",
+        f"replay-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json",
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "rounds": args.rounds,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+
+    print(f"saved {output}")
+
+    if args.compare:
+        compare(results, args.compare)
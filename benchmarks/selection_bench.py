@@ -0,0 +1,90 @@
+# build and pick times of the weighted selection over pools of 3k/100k/1M maps,
+# against the shuffled PoolCursor order. checks the repeat windows on the way.
+#
+# run from the repo root:
+#   python benchmarks/selection_bench.py
+#   python benchmarks/selection_bench.py --pools 100000 --picks 5000
+import argparse
+import os
+import sys
+from time import perf_counter
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from pool import PoolCursor  # noqa: E402
+from replay_bench import synthetic_pool  # noqa: E402
+from selection import WeightedCursor  # noqa: E402
+
+selection = {
+    "weights": {"play_count": 1.0, "favorites": 0.5, "stars": 2.0},
+    "window": {"beatmap_id": 100, "beatmapset_id": 30, "mapper": 3, "artist": 3},
+}
+
+
+def check_windows(cursor: WeightedCursor, picks: list) -> int:
+    # return: picks that repeated a value inside its window
+    columns = cursor.pool.columns
+    repeats = 0
+
+    for column, size in cursor.window.items():
+        if column not in cursor.groups:
+            continue
+
+        values = [columns[column][cursor.indices[p]] for p in picks]
+
+        for i, value in enumerate(values):
+            if value is not None and value in values[max(0, i - size) : i]:
+                repeats += 1
+
+    return repeats
+
+
+def run(size: int, picks: int) -> None:
+    pool = synthetic_pool(size)
+    # distinct sets and mappers, the synthetic pool repeats the sample rows
+    pool.columns["beatmapset_id"] = pool.columns["beatmap_id"]
+
+    start = perf_counter()
+    shuffled = PoolCursor(pool)
+    shuffle_build = perf_counter() - start
+    start = perf_counter()
+
+    for _ in range(picks):
+        shuffled.current()
+        shuffled.advance()
+
+    shuffle_pick = (perf_counter() - start) / picks
+
+    start = perf_counter()
+    cursor = WeightedCursor(pool, stars=(5.0, 6.0), **selection)
+    build = perf_counter() - start
+    chosen = []
+    start = perf_counter()
+
+    for i in range(picks):
+        cursor.current()
+        cursor.advance()
+        chosen.append(cursor.playing)
+
+        if i % 10 == 0:
+            cursor.penalize()
+
+    pick = (perf_counter() - start) / picks
+    print(
+        f"{size:>9} maps | shuffle build {shuffle_build * 1000:8.1f} ms"
+        f" pick {shuffle_pick * 1e6:6.2f} us | weighted build {build * 1000:8.1f} ms"
+        f" pick {pick * 1e6:6.2f} us | repeats {check_windows(cursor, chosen)}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--pools", type=int, nargs="+", default=[3000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--picks", type=int, default=2000)
+    args = parser.parse_args()
+
+    for size in args.pools:
+        run(size, args.picks)
@@ -0,0 +1,200 @@
+import json
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from time import time
+
+logger = logging.getLogger("irc.py")
+
+# keys kept from the beatmapset json embedded in the osu! page
+beatmapset_keys = ("id", "artist", "title", "creator", "status", "availability")
+beatmap_keys = (
+    "id",
+    "version",
+    "difficulty_rating",
+    "status",
+    "mode",
+    "cs",
+    "ar",
+    "accuracy",
+    "drain",
+    "bpm",
+    "total_length",
+    "url",
+)
+
+
+def compact(beatmapset: dict) -> dict:
+    data = {key: beatmapset.get(key) for key in beatmapset_keys}
+    data["beatmaps"] = [
+        {key: beatmap.get(key) for key in beatmap_keys}
+        for beatmap in beatmapset.get("beatmaps") or []
+    ]
+    return data
+
+
+class BeatmapCache:
+    # beatmapset metadata by beatmap id: in-memory LRU with ttl in front of a sqlite
+    # store that survives restarts. concurrent lookups of one id share one fetch.
+
+    def __init__(
+        self,
+        path="beatmaps_cache.db",
+        size=2048,
+        ttl=6 * 60 * 60,
+        clock=time,
+        timeout=10.0,
+    ) -> None:
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.beatmapsets = OrderedDict()  # beatmapset id -> (fetched, data)
+        self.beatmaps = {}  # beatmap id -> beatmapset id
+        self.inflight = {}  # beatmap id -> Future
+        self.hits = self.disk_hits = self.misses = self.shared = self.errors = 0
+        self.db = None
+
+        if path:
+            # shared by the shard processes: WAL, and writers wait for the lock
+            self.db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+            self.db.executescript("""
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                CREATE TABLE IF NOT EXISTS beatmapsets (
+                    id INTEGER PRIMARY KEY, fetched REAL, data TEXT
+                );
+                CREATE TABLE IF NOT EXISTS beatmaps (
+                    id INTEGER PRIMARY KEY, beatmapset_id INTEGER
+                );
+                """)
+
+    def fresh(self, fetched: float) -> bool:
+        return self.clock() - fetched < self.ttl
+
+    def remember(self, beatmapset_id: int, fetched: float, data: dict) -> None:
+        # lock held
+        self.beatmapsets[beatmapset_id] = (fetched, data)
+        self.beatmapsets.move_to_end(beatmapset_id)
+
+        for beatmap in data.get("beatmaps"):
+            self.beatmaps[beatmap.get("id")] = beatmapset_id
+
+        while len(self.beatmapsets) > self.size:
+            _, (_, evicted) = self.beatmapsets.popitem(last=False)
+
+            for beatmap in evicted.get("beatmaps"):
+                self.beatmaps.pop(beatmap.get("id"), None)
+
+    def lookup(self, beatmap_id: int) -> dict | None:
+        # lock held
+        beatmapset_id = self.beatmaps.get(beatmap_id)
+        entry = self.beatmapsets.get(beatmapset_id)
+
+        if entry and self.fresh(entry[0]):
+            self.beatmapsets.move_to_end(beatmapset_id)
+            self.hits += 1
+            return entry[1]
+
+        if not self.db:
+            return None
+
+        try:
+            row = self.db.execute(
+                "SELECT s.id, s.fetched, s.data FROM beatmaps b"
+                " JOIN beatmapsets s ON s.id = b.beatmapset_id WHERE b.id = ?",
+                (beatmap_id,),
+            ).fetchone()
+        except sqlite3.Error as err:
+            # a locked or broken file reads as a miss
+            logger.error(f"~ Beatmap cache not read {beatmap_id} | {err}")
+            return None
+
+        if row and self.fresh(row[1]):
+            data = json.loads(row[2])
+            self.remember(row[0], row[1], data)
+            self.disk_hits += 1
+            return data
+
+    def store(self, data: dict) -> None:
+        # lock held
+        fetched = self.clock()
+        self.remember(data.get("id"), fetched, data)
+
+        if not self.db:
+            return
+
+        try:
+            with self.db:
+                self.db.execute(
+                    "REPLACE INTO beatmapsets (id, fetched, data) VALUES (?, ?, ?)",
+                    (data.get("id"), fetched, json.dumps(data)),
+                )
+                self.db.executemany(
+                    "REPLACE INTO beatmaps (id, beatmapset_id) VALUES (?, ?)",
+                    [
+                        (beatmap.get("id"), data.get("id"))
+                        for beatmap in data["beatmaps"]
+                    ],
+                )
+        except sqlite3.Error as err:
+            # still cached in memory, only the copy for the next start is missing
+            logger.error(f"~ Beatmap cache not written {data.get('id')} | {err}")
+
+    def get(self, beatmap_id: int, loader) -> dict:
+        # loader() returns the beatmapset json or raises, errors are not cached
+        with self.lock:
+            data = self.lookup(beatmap_id)
+
+            if data:
+                return data
+
+            future = self.inflight.get(beatmap_id)
+            owner = future is None
+
+            if owner:
+                future = self.inflight[beatmap_id] = Future()
+                self.misses += 1
+            else:
+                self.shared += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            data = compact(loader())
+
+            with self.lock:
+                self.store(data)
+                # the page of a beatmap id always holds its beatmapset
+                self.beatmaps.setdefault(beatmap_id, data.get("id"))
+        except BaseException as err:
+            with self.lock:
+                self.errors += 1
+
+            future.set_exception(err)
+            raise
+        finally:
+            # the waiters are woken either way, later lookups start over
+            with self.lock:
+                self.inflight.pop(beatmap_id, None)
+
+        future.set_result(data)
+        return data
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "errors": self.errors,
+                "size": len(self.beatmapsets),
+            }
+
+    def readout(self) -> str:
+        stats = self.stats()
+        return " | ".join(f"{key} {value}" for key, value in stats.items())
@@ -0,0 +1,127 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from pool import BeatmapPool, load_pool
+
+indexed_attributes = (
+    "difficulty",
+    "difficulty_ar",
+    "play_length",
+    "bpm",
+    "gamemode",
+    "beatmap_status",
+    "beatmap_id",
+    "beatmapset_id",
+)
+
+catalogs = {}
+catalogs_lock = threading.Lock()
+
+
+def parse_filter(value) -> tuple:
+    # 5.5 -> (5.5, 5.5) | [5, 6] -> (5, 6) | [null, 6] -> (None, 6)
+    if isinstance(value, (list, tuple)):
+        low, high = value
+        return low, high
+
+    return value, value
+
+
+class SortedIndex:
+    # row ids of one column sorted by value, range lookups with bisect
+
+    def __init__(self, column) -> None:
+        self.rows = array("I", sorted(range(len(column)), key=column.__getitem__))
+        self.values = [column[row] for row in self.rows]
+
+    def span(self, low=None, high=None) -> tuple:
+        start = 0 if low is None else bisect_left(self.values, low)
+        end = len(self.values) if high is None else bisect_right(self.values, high)
+        return start, max(start, end)
+
+
+class BeatmapCatalog:
+    # multi attribute range queries over a beatmap dump, built on a shared pool
+
+    def __init__(self, pool: BeatmapPool, attributes=indexed_attributes) -> None:
+        self.pool = pool
+        self.attributes = attributes
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def index(self, attribute: str) -> SortedIndex | None:
+        # built on first use, None values can't be sorted so such columns are scanned
+        if attribute not in self.attributes:
+            return None
+
+        with self.lock:
+            if attribute not in self.indexes:
+                column = self.pool.columns.get(attribute, [])
+
+                if None in column:
+                    self.indexes[attribute] = None
+                else:
+                    self.indexes[attribute] = SortedIndex(column)
+
+            return self.indexes[attribute]
+
+    def query(self, **filters) -> array:
+        # return: sorted row ids matching every filter, see parse_filter
+        ranges = {key: parse_filter(value) for key, value in filters.items()}
+
+        for key in ranges:
+            if key not in self.pool.columns:
+                return array("I")
+
+        # walk the narrowest indexed range, check the others per row
+        best = None
+
+        for key, (low, high) in ranges.items():
+            index = self.index(key)
+
+            if index:
+                start, end = index.span(low, high)
+
+                if best is None or end - start < best[2] - best[1]:
+                    best = (key, start, end)
+
+        if best:
+            key, start, end = best
+            rows = self.indexes[key].rows[start:end]
+            del ranges[key]
+        else:
+            rows = range(len(self.pool))
+
+        checks = [
+            (self.pool.columns[key], low, high) for key, (low, high) in ranges.items()
+        ]
+        result = array(
+            "I",
+            (
+                row
+                for row in rows
+                if all(
+                    column[row] is not None
+                    and (low is None or column[row] >= low)
+                    and (high is None or column[row] <= high)
+                    for column, low, high in checks
+                )
+            ),
+        )
+        return array("I", sorted(result))
+
+    def count(self, **filters) -> int:
+        return len(self.query(**filters))
+
+
+def replace_catalog(filename: str, catalog: BeatmapCatalog) -> None:
+    with catalogs_lock:
+        catalogs[filename] = catalog
+
+
+def load_catalog(filename: str) -> BeatmapCatalog:
+    with catalogs_lock:
+        if filename not in catalogs:
+            catalogs[filename] = BeatmapCatalog(load_pool(filename))
+
+        return catalogs[filename]
@@ -0,0 +1,128 @@
+import logging
+import random
+from time import monotonic
+
+logger = logging.getLogger("irc.py")
+
+DISCONNECTED = "disconnected"
+CONNECTING = "connecting"
+AUTHENTICATED = "authenticated"  # the server sent 001, rooms can be joined
+JOINED = "joined"  # every room is joined or being made
+
+# bytes left for channel names in a "JOIN a,b,c" line, irc lines are 512 max
+join_line_size = 500
+
+
+def join_lines(channels: list) -> list:
+    lines = []
+    line = ""
+
+    for channel in channels:
+        if line and len(line) + len(channel) + 1 > join_line_size:
+            lines.append(f"JOIN {line}")
+            line = ""
+
+        line = f"{line},{channel}" if line else channel
+
+    if line:
+        lines.append(f"JOIN {line}")
+
+    return lines
+
+
+class Backoff:
+    # exponential with full jitter, reset once a connection got authenticated
+
+    def __init__(self, base=1.0, cap=60.0) -> None:
+        self.base = base
+        self.cap = cap
+        self.attempts = 0
+
+    def next(self) -> float:
+        delay = random.uniform(0, min(self.cap, self.base * 2**self.attempts))
+        self.attempts += 1
+        return delay
+
+    def reset(self) -> None:
+        self.attempts = 0
+
+
+class ConnectionManager:
+    # connection state and keepalive for one server connection. any inbound line
+    # proves the link alive, a silent link is pinged and dropped if the ping
+    # goes unanswered.
+
+    def __init__(
+        self,
+        ping_interval=60.0,
+        ping_timeout=30.0,
+        backoff_base=1.0,
+        backoff_cap=60.0,
+        clock=monotonic,
+    ) -> None:
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.backoff = Backoff(backoff_base, backoff_cap)
+        self.clock = clock
+        self.state = DISCONNECTED
+        self.changed = clock()
+        self.received = clock()
+        self.pinged = None
+        self.retry_at = 0.0
+
+    def transition(self, state: str, reason="") -> None:
+        if state == self.state:
+            return
+
+        elapsed = self.clock() - self.changed
+        logger.info(
+            f"~ Connection {self.state} -> {state} after {elapsed:.1f}s"
+            + (f" | {reason}" if reason else "")
+        )
+        self.state = state
+        self.changed = self.clock()
+
+    def connecting(self) -> None:
+        self.transition(CONNECTING)
+        self.received = self.clock()
+        self.pinged = None
+
+    def authenticated(self) -> None:
+        self.backoff.reset()
+        self.transition(AUTHENTICATED)
+
+    def joined(self) -> None:
+        self.transition(JOINED)
+
+    def disconnected(self, reason="") -> float:
+        # return: seconds to wait before the next attempt
+        delay = self.backoff.next()
+        self.retry_at = self.clock() + delay
+        self.transition(DISCONNECTED, f"{reason} | retry in {delay:.1f}s")
+        return delay
+
+    def retry_in(self) -> float:
+        return max(0.0, self.retry_at - self.clock())
+
+    def on_data(self) -> None:
+        self.received = self.clock()
+        self.pinged = None
+
+    def keepalive(self) -> str | None:
+        # return: "ping" if a PING should be sent, "dead" if the link timed out
+        idle = self.clock() - self.received
+
+        if self.pinged is not None:
+            if self.clock() - self.pinged >= self.ping_timeout:
+                return "dead"
+            return None
+
+        if idle >= self.ping_interval:
+            self.pinged = self.clock()
+            return "ping"
+
+        return None
+
+    @property
+    def ready(self) -> bool:
+        return self.state in (AUTHENTICATED, JOINED)
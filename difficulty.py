@@ -0,0 +1,375 @@
+# osu!standard star rating from .osu files, the aim/speed strain model of the
+# legacy pp system. it reads a little different from the website's current
+# numbers, but tracks them closely enough to keep picks inside a room's range.
+#
+# precompute mod ratings into a pool file, from the repo root:
+#   python difficulty.py beatmapsets/std-5to6star-9ar-3to7mins.json --mods HR DT
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+from collections import OrderedDict
+from fetcher import BeatmapError
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger("irc.py")
+
+# the mods that change the star rating, in the order of a key like "HRDT"
+rating_mods = ("EZ", "HT", "HR", "DT")
+mod_aliases = {
+    "NC": "DT",
+    "Nightcore": "DT",
+    "DoubleTime": "DT",
+    "HalfTime": "HT",
+    "HardRock": "HR",
+    "Easy": "EZ",
+}
+
+# speed, aim
+decay_base = (0.3, 0.15)
+weight_scaling = (1400.0, 26.25)
+strain_step = 400.0
+decay_weight = 0.9
+star_scaling = 0.0675
+extreme_scaling = 0.5
+playfield_width = 512.0
+circle_size_buff = 30.0
+single_spacing = 125.0
+stream_spacing = 110.0
+almost_diameter = 90.0
+
+# what rating() raises for a map it can't rate, counted in errors
+rating_errors = (OSError, ValueError, BeatmapError)
+
+
+def mod_key(mods) -> str:
+    # "HDDT", ["HardRock", "Hidden"] or ("HR", "DT") -> "DT", "HR", "HRDT"; "NM"
+    if isinstance(mods, str):
+        mods = [mods[i : i + 2] for i in range(0, len(mods), 2)]
+
+    names = {mod_aliases.get(mod, mod) for mod in mods}
+    return "".join(mod for mod in rating_mods if mod in names) or "NM"
+
+
+def mod_settings(key: str) -> tuple:
+    # return: (clock rate, circle size multiplier)
+    rate = 1.5 if "DT" in key else 0.75 if "HT" in key else 1.0
+    size = 1.3 if "HR" in key else 0.5 if "EZ" in key else 1.0
+    return rate, size
+
+
+def parse_osu(text: str) -> dict:
+    # only what the rating needs: circle size and the hit objects
+    section = None
+    circle_size = 5.0
+    mode = 0
+    objects = []  # (x, y, time, spinner)
+
+    for line in text.splitlines():
+        line = line.strip()
+
+        if not line or line.startswith("//"):
+            continue
+
+        if line.startswith("[") and line.endswith("]"):
+            section = line[1:-1]
+            continue
+
+        if section == "General" and line.startswith("Mode"):
+            mode = int(line.partition(":")[2])
+        elif section == "Difficulty" and line.startswith("CircleSize"):
+            circle_size = float(line.partition(":")[2])
+        elif section == "HitObjects":
+            fields = line.split(",")
+            kind = int(fields[3])
+            objects.append(
+                (float(fields[0]), float(fields[1]), float(fields[2]), bool(kind & 8))
+            )
+
+    if mode != 0:
+        raise ValueError(f"not an osu!standard beatmap (mode {mode})")
+
+    return {"circle_size": circle_size, "objects": objects}
+
+
+def scale(circle_size: float) -> float:
+    radius = (playfield_width / 16) * (1 - 0.7 * (circle_size - 5) / 5)
+    factor = 52 / radius
+
+    if radius < circle_size_buff:
+        factor *= 1 + min(circle_size_buff - radius, 5) / 50
+
+    return factor
+
+
+def speed_weight(distance: float) -> float:
+    if distance > single_spacing:
+        return 2.5
+    if distance > stream_spacing:
+        return 1.6 + 0.9 * (distance - stream_spacing) / (
+            single_spacing - stream_spacing
+        )
+    if distance > almost_diameter:
+        return 1.2 + 0.4 * (distance - almost_diameter) / (
+            stream_spacing - almost_diameter
+        )
+    if distance > almost_diameter / 2:
+        return 0.95 + 0.25 * (distance - almost_diameter / 2) / (almost_diameter / 2)
+    return 0.95
+
+
+def weigh(peaks: list) -> float:
+    return sum(
+        peak * decay_weight**i for i, peak in enumerate(sorted(peaks, reverse=True))
+    )
+
+
+def strains(times: list, distances: list, spinners: list) -> tuple:
+    # one object at a time, without numpy. return: (speed, aim) difficulty
+    result = []
+
+    for kind in (0, 1):
+        strain = previous = 0.0
+        peaks = []
+        interval_end = math.ceil(times[0] / strain_step) * strain_step
+        highest = 0.0
+
+        for i, time in enumerate(times):
+            while time > interval_end:
+                peaks.append(highest)
+                highest = (
+                    previous
+                    * decay_base[kind] ** ((interval_end - times[i - 1]) / 1000)
+                    if i
+                    else 0.0
+                )
+                interval_end += strain_step
+
+            if i:
+                elapsed = time - times[i - 1]
+                value = 0.0
+
+                if not spinners[i]:
+                    distance = distances[i]
+                    value = (
+                        speed_weight(distance) if kind == 0 else distance**0.99
+                    ) * weight_scaling[kind]
+
+                strain = previous * decay_base[kind] ** (elapsed / 1000) + value / max(
+                    elapsed, 50
+                )
+
+            previous = strain
+            highest = max(highest, strain)
+
+        peaks.append(highest)
+        result.append(weigh(peaks))
+
+    return tuple(result)
+
+
+def vector_strains(times, distances, spinners) -> tuple:
+    # the same over numpy arrays. strain[i] = strain[i - 1] * decay[i] + value[i]
+    # is an affine recurrence, solved by a log2(n) step prefix scan.
+    elapsed = np.diff(times, prepend=times[0])
+    # speed_weight is piecewise linear between these spacings
+    speed = np.interp(
+        distances,
+        (almost_diameter / 2, almost_diameter, stream_spacing, single_spacing),
+        (0.95, 1.2, 1.6, 2.5),
+    )
+    values = (speed, distances**0.99)
+    start = math.ceil(times[0] / strain_step) * strain_step
+    ends = start + strain_step * np.arange(
+        max(int(math.ceil((times[-1] - start) / strain_step)), 0) + 1
+    )
+    # section of every object, and the last object before every section start
+    sections = np.searchsorted(ends, times, side="left")
+    before = np.searchsorted(times, ends[:-1], side="right") - 1
+    result = []
+
+    for kind in (0, 1):
+        decay = decay_base[kind] ** (elapsed / 1000)
+        strain = values[kind] * weight_scaling[kind] / np.maximum(elapsed, 50)
+        strain[spinners] = 0.0
+        strain[0] = decay[0] = 0.0
+        step = 1
+
+        while step < len(strain):
+            strain[step:] = decay[step:] * strain[:-step] + strain[step:]
+            decay[step:] = decay[step:] * decay[:-step]
+            step *= 2
+
+        peaks = np.zeros(len(ends))
+        # strain carried into a section, decayed to its start
+        peaks[1:] = strain[before] * decay_base[kind] ** (
+            (ends[:-1] - times[before]) / 1000
+        )
+        np.maximum.at(peaks, sections, strain)
+        result.append(
+            float(np.sort(peaks)[::-1] @ decay_weight ** np.arange(len(peaks)))
+        )
+
+    return tuple(result)
+
+
+def star_rating(beatmap: dict, mods="NM") -> float:
+    objects = beatmap.get("objects")
+
+    if len(objects) < 2:
+        return 0.0
+
+    rate, size = mod_settings(mod_key(mods))
+    factor = scale(min(beatmap.get("circle_size") * size, 10))
+
+    if np is not None:
+        data = np.array(objects, dtype=float)
+        times = data[:, 2] / rate
+        points = data[:, :2] * factor
+        distances = np.zeros(len(times))
+        distances[1:] = np.hypot(*(points[1:] - points[:-1]).T)
+        speed, aim = vector_strains(times, distances, data[:, 3].astype(bool))
+    else:
+        times = [time / rate for _, _, time, _ in objects]
+        distances = [0.0] + [
+            math.hypot(x - px, y - py) * factor
+            for (x, y, _, _), (px, py, _, _) in zip(objects[1:], objects)
+        ]
+        speed, aim = strains(times, distances, [spinner for *_, spinner in objects])
+
+    aim = math.sqrt(aim) * star_scaling
+    speed = math.sqrt(speed) * star_scaling
+    return aim + speed + abs(speed - aim) * extreme_scaling
+
+
+class DifficultyCalculator:
+    # star ratings per (beatmap id, mods), memoized. .osu files are read from
+    # path, downloaded once through the fetcher if missing.
+
+    def __init__(self, path="osu_files", size=4096, fetcher=None) -> None:
+        self.path = path
+        self.size = size
+        self.fetcher = fetcher
+        self.lock = threading.Lock()
+        self.ratings = OrderedDict()  # (beatmap id, mod key) -> stars
+        self.hits = self.computed = self.downloads = self.errors = 0
+
+    def osu_file(self, beatmap_id: int) -> str:
+        filename = os.path.join(self.path, f"{beatmap_id}.osu")
+
+        if os.path.exists(filename):
+            with open(filename, "r", encoding="utf-8") as f:
+                return f.read()
+
+        if not self.fetcher:
+            raise FileNotFoundError(filename)
+
+        response = self.fetcher.request("GET", f"https://osu.ppy.sh/osu/{beatmap_id}")
+
+        if not response.ok:
+            raise BeatmapError(
+                f".osu file not downloaded ({response.status_code})", "HttpError"
+            )
+
+        if not response.text.strip():
+            raise FileNotFoundError(filename)
+
+        os.makedirs(self.path, exist_ok=True)
+
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(response.text)
+
+        with self.lock:
+            self.downloads += 1
+
+        return response.text
+
+    def rating(self, beatmap_id: int, mods="NM") -> float:
+        key = (beatmap_id, mod_key(mods))
+
+        with self.lock:
+            if key in self.ratings:
+                self.hits += 1
+                self.ratings.move_to_end(key)
+                return self.ratings[key]
+
+        try:
+            stars = round(star_rating(parse_osu(self.osu_file(beatmap_id)), key[1]), 2)
+        except rating_errors:
+            with self.lock:
+                self.errors += 1
+            raise
+
+        with self.lock:
+            self.computed += 1
+            self.ratings[key] = stars
+
+            while len(self.ratings) > self.size:
+                self.ratings.popitem(last=False)
+
+        return stars
+
+    def readout(self) -> str:
+        return (
+            f"hits {self.hits} | computed {self.computed}"
+            f" | downloads {self.downloads} | errors {self.errors}"
+        )
+
+
+def precompute(filename: str, mods: list, calculator: DifficultyCalculator) -> int:
+    # adds difficulty_<mods> to every map of a pool file, written in place so a
+    # running bot reloads it. return: maps rated
+    from pool import iter_json_array
+
+    # difficulty_NM too, the bot scales the others by the website's NM over it
+    keys = list(dict.fromkeys(["NM", *(mod_key(combo) for combo in mods)]))
+    rated = 0
+    temporary = f"{filename}.tmp"
+
+    with open(filename, "r", encoding="utf-8") as source, open(
+        temporary, "w", encoding="utf-8"
+    ) as target:
+        target.write("[")
+
+        for i, item in enumerate(iter_json_array(source)):
+            try:
+                for key in keys:
+                    item[f"difficulty_{key}"] = calculator.rating(
+                        item.get("beatmap_id"), key
+                    )
+                rated += 1
+            except rating_errors as err:
+                logger.warning(f"~ No rating for {item.get('beatmap_id')} | {err}")
+
+            target.write(("," if i else "") + json.dumps(item))
+
+        target.write("]")
+
+    os.replace(temporary, filename)
+    return rated
+
+
+if __name__ == "__main__":
+    from fetcher import BeatmapFetcher
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pools", nargs="+")
+    parser.add_argument("--mods", nargs="+", default=["HR", "DT"])
+    parser.add_argument("--osu-files", default="osu_files")
+    parser.add_argument("--download", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    calculator = DifficultyCalculator(
+        path=args.osu_files, fetcher=BeatmapFetcher() if args.download else None
+    )
+
+    for filename in args.pools:
+        rated = precompute(filename, args.mods, calculator)
+        logger.info(f"~ {filename} | {rated} maps rated | {calculator.readout()}")
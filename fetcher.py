@@ -0,0 +1,189 @@
+import json
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("irc.py")
+
+beatmap_json_start = b'{"artist"'
+retry_status = {429, 500, 502, 503, 504}
+
+
+class BeatmapError(Exception):
+    def __init__(self, message: str, error="NotFound") -> None:
+        super().__init__(message)
+        self.message = message
+        self.error = error
+
+
+class RetryableError(Exception):
+    pass
+
+
+class BeatmapFetcher:
+    # keep-alive session shared by a bounded worker pool. every lookup is limited
+    # per host, retried with jittered backoff and bounded by an overall deadline.
+
+    def __init__(
+        self,
+        workers=8,
+        per_host=4,
+        retries=2,
+        backoff=0.5,
+        timeout=10.0,
+        deadline=15.0,
+        chunk_size=16 * 1024,
+    ) -> None:
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.deadline = deadline
+        self.chunk_size = chunk_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["User-Agent"] = "testbot (osu! multiplayer auto host)"
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="osu-http"
+        )
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def submit(self, handler, **kwargs):
+        future = self.executor.submit(handler, **kwargs)
+        future.add_done_callback(self.on_done)
+        return future
+
+    def on_done(self, future) -> None:
+        if not future.cancelled() and future.exception():
+            logger.error(f"~ Handler error: {future.exception()}")
+
+    def host_limit(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self.hosts[host]
+
+    def read_beatmap_json(self, response, until: float) -> bytes | None:
+        # stop downloading as soon as the embedded json line is complete
+        buffer = bytearray()
+        start = -1
+
+        for chunk in response.iter_content(self.chunk_size):
+            if monotonic() > until:
+                raise TimeoutError("deadline exceeded")
+
+            scan = max(0, len(buffer) - len(beatmap_json_start))
+            buffer += chunk
+
+            if start == -1:
+                start = buffer.find(beatmap_json_start, scan)
+
+                if start == -1:
+                    continue
+                scan = start
+
+            end = buffer.find(b"\n", scan)
+
+            if end != -1:
+                return bytes(buffer[start:end])
+
+        if start != -1:
+            return bytes(buffer[start:])
+
+    def acquire(self, url: str, until: float) -> threading.BoundedSemaphore:
+        remaining = until - monotonic()
+        limit = self.host_limit(url)
+
+        if remaining <= 0 or not limit.acquire(timeout=remaining):
+            raise TimeoutError("deadline exceeded")
+
+        return limit
+
+    def attempt(self, url: str, until: float) -> dict:
+        limit = self.acquire(url, until)
+
+        try:
+            timeout = min(self.timeout, max(until - monotonic(), 0.1))
+
+            with self.session.get(url, timeout=timeout, stream=True) as response:
+                logger.info(
+                    f"~ Fetch status|code: {response.ok} | {response.status_code}"
+                )
+
+                if response.status_code in retry_status:
+                    raise RetryableError(f"status {response.status_code}")
+
+                if not response.ok:
+                    raise BeatmapError("Beatmap Not Submitted!", "NotSubmitted")
+
+                beatmap_info = self.read_beatmap_json(response, until)
+        finally:
+            limit.release()
+
+        if not beatmap_info:
+            raise BeatmapError("Beatmap details not found!")
+
+        try:
+            return json.loads(beatmap_info)
+        except json.decoder.JSONDecodeError as err:
+            logger.error(f"DEBUG: BEATMAP JSON LOAD {err}")
+            raise BeatmapError("Beatmap json parser error") from err
+
+    def send(self, method: str, url: str, until: float, **kwargs):
+        limit = self.acquire(url, until)
+
+        try:
+            timeout = min(self.timeout, max(until - monotonic(), 0.1))
+            response = self.session.request(method, url, timeout=timeout, **kwargs)
+        finally:
+            limit.release()
+
+        if response.status_code in retry_status:
+            raise RetryableError(f"status {response.status_code}")
+
+        return response
+
+    def retry(self, call, url: str, deadline: float = None):
+        until = monotonic() + (deadline or self.deadline)
+        attempt = 0
+
+        while True:
+            try:
+                return call(url, until)
+            except BeatmapError:
+                raise
+            except (RetryableError, TimeoutError, requests.RequestException) as err:
+                delay = random.uniform(0, self.backoff * 2**attempt)
+                attempt += 1
+
+                if attempt > self.retries or monotonic() + delay >= until:
+                    logger.critical(f"~ Fetch Error: {err}")
+                    raise BeatmapError("Fetching beatmap error!", "HttpError") from err
+
+                logger.warning(f"~ Fetch retry {attempt} in {delay:.2f}s | {err}")
+                sleep(delay)
+
+    def fetch_beatmapset(self, url: str, deadline: float = None) -> dict:
+        logger.info(f"~ Fetching url: {url}")
+        return self.retry(self.attempt, url, deadline)
+
+    def request(self, method: str, url: str, deadline: float = None, **kwargs):
+        # any other call, with the same host limit, retries and deadline. a
+        # response that isn't retried is the caller's to check
+        return self.retry(
+            lambda url, until: self.send(method, url, until, **kwargs), url, deadline
+        )
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
@@ -0,0 +1,304 @@
+# played and skipped maps of every room, for !stats/!top and pool curation.
+#
+# the maps players skip most, from the repo root:
+#   python history.py --skipped 20
+import argparse
+import atexit
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+from time import time
+
+logger = logging.getLogger("irc.py")
+
+
+class MatchHistory:
+    # one row per played or skipped map. rows are buffered in memory and
+    # written in batches by a background thread, the totals per map and per
+    # room are kept in memory as well, so the bot thread never waits on disk.
+    # shards share the file, every flush reads back what the others wrote.
+
+    def __init__(
+        self, path="match_history.db", batch=64, interval=5.0, timeout=10.0
+    ) -> None:
+        self.path = path
+        self.batch = batch
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.wake = threading.Event()
+        self.closed = False
+        self.thread = None
+        self.written = self.flushes = self.errors = 0
+        self.db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS matches (
+                id INTEGER PRIMARY KEY, room TEXT, beatmap_id INTEGER,
+                outcome TEXT, started REAL, finished REAL, duration REAL,
+                players INTEGER, users TEXT, skips INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS maps (
+                beatmap_id INTEGER PRIMARY KEY, plays INTEGER, skips INTEGER,
+                last REAL
+            );
+            CREATE TABLE IF NOT EXISTS rooms (
+                room TEXT PRIMARY KEY, matches INTEGER, players INTEGER
+            );
+            """)
+        self.maps = {}  # beatmap id -> [plays, skips]
+        self.rooms = {}  # room -> [matches, players]
+        self.seen = 0  # last matches row read back
+        self.top_maps = None  # cached, cleared by every change
+        self.changes = 0
+        self.refresh()
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name="osu-history", daemon=True)
+        self.thread.start()
+        # what is still buffered is written on exit
+        atexit.register(self.close)
+
+    def run(self) -> None:
+        while not self.closed:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+
+            try:
+                self.refresh()
+            except sqlite3.Error as err:
+                logger.error(f"~ Match history not read | {err}")
+
+    def record(
+        self,
+        room: str,
+        beatmap_id: int,
+        outcome: str,
+        started: float,
+        users: list,
+        skips: int,
+    ) -> None:
+        # outcome: "played" or "skipped"
+        if not beatmap_id:
+            return
+
+        finished = time()
+        row = (
+            room,
+            beatmap_id,
+            outcome,
+            started,
+            finished,
+            finished - started,
+            len(users),
+            users,
+            skips,
+        )
+
+        with self.lock:
+            self.count(row)
+            self.buffer.append(row)
+            full = len(self.buffer) >= self.batch
+
+        if full:
+            self.wake.set()
+
+    def count(self, row: tuple, maps=True, rooms=True) -> None:
+        # lock held
+        room, beatmap_id, outcome, _, _, _, players, _, _ = row
+        played = outcome == "played"
+
+        if maps:
+            totals = self.maps.setdefault(beatmap_id, [0, 0])
+            totals[0 if played else 1] += 1
+
+        if rooms and played:
+            matches = self.rooms.setdefault(room, [0, 0])
+            matches[0] += 1
+            matches[1] += players
+
+        self.top_maps = None
+        self.changes += 1
+
+    def refresh(self) -> None:
+        # the totals as written by every shard. matches rows get their ids
+        # under the write lock, so the maps of rows past `seen` are all that
+        # changed since the last read.
+        query = "SELECT beatmap_id, plays, skips FROM maps"
+        seen = self.db.execute("SELECT coalesce(max(id), 0) FROM matches").fetchone()[0]
+
+        if self.seen:
+            maps = self.db.execute(
+                f"{query} WHERE beatmap_id IN"
+                " (SELECT beatmap_id FROM matches WHERE id > ? AND id <= ?)",
+                (self.seen, seen),
+            ).fetchall()
+        else:
+            maps = self.db.execute(query).fetchall()
+
+        rooms = self.db.execute("SELECT room, matches, players FROM rooms").fetchall()
+
+        with self.lock:
+            for beatmap_id, plays, skips in maps:
+                self.maps[beatmap_id] = [plays, skips]
+
+            self.rooms = {room: [matches, players] for room, matches, players in rooms}
+            read = {beatmap_id for beatmap_id, _, _ in maps}
+
+            # recorded but not written yet, on top of what was just read
+            for row in self.buffer:
+                self.count(row, maps=row[1] in read)
+
+            self.seen = seen
+
+            if maps:
+                self.top_maps = None
+                self.changes += 1
+
+    def flush(self) -> int:
+        # return: rows written
+        with self.lock:
+            rows, self.buffer = self.buffer, []
+
+        if not rows:
+            return 0
+
+        maps = {}  # beatmap id -> [plays, skips, last]
+        rooms = {}  # room -> [matches, players]
+
+        for room, beatmap_id, outcome, _, finished, _, players, _, _ in rows:
+            played = outcome == "played"
+            totals = maps.setdefault(beatmap_id, [0, 0, finished])
+            totals[0 if played else 1] += 1
+            totals[2] = finished
+
+            if played:
+                matches = rooms.setdefault(room, [0, 0])
+                matches[0] += 1
+                matches[1] += players
+
+        try:
+            with self.db:
+                self.db.executemany(
+                    "INSERT INTO matches (room, beatmap_id, outcome, started, finished,"
+                    " duration, players, users, skips)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    # the user lists as json, encoded here off the bot thread
+                    [(*row[:7], json.dumps(row[7]), row[8]) for row in rows],
+                )
+                self.db.executemany(
+                    "INSERT INTO maps VALUES (?, ?, ?, ?) ON CONFLICT (beatmap_id)"
+                    " DO UPDATE SET plays = plays + excluded.plays,"
+                    " skips = skips + excluded.skips, last = excluded.last",
+                    [(beatmap_id, *totals) for beatmap_id, totals in maps.items()],
+                )
+                self.db.executemany(
+                    "INSERT INTO rooms VALUES (?, ?, ?) ON CONFLICT (room)"
+                    " DO UPDATE SET matches = matches + excluded.matches,"
+                    " players = players + excluded.players",
+                    [(room, *totals) for room, totals in rooms.items()],
+                )
+        except sqlite3.Error as err:
+            self.errors += 1
+            logger.error(f"~ Match history not written, {len(rows)} rows lost | {err}")
+            return 0
+
+        self.written += len(rows)
+        self.flushes += 1
+        return len(rows)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        self.closed = True
+        self.wake.set()
+
+        if self.thread:
+            self.thread.join()
+
+        self.flush()
+        self.db.close()
+
+    def room_stats(self, room: str) -> tuple:
+        # return: (matches played, average lobby size)
+        with self.lock:
+            matches, players = self.rooms.get(room, (0, 0))
+
+        return matches, players / matches if matches else 0.0
+
+    def map_stats(self, beatmap_id: int) -> tuple:
+        # return: (plays, skip rate)
+        with self.lock:
+            plays, skips = self.maps.get(beatmap_id, (0, 0))
+
+        return plays, skips / (plays + skips) if plays + skips else 0.0
+
+    def totals(self) -> list:
+        # [(beatmap id, plays, skips)], copied under the lock as the history
+        # thread adds the maps other shards wrote
+        with self.lock:
+            return [
+                (beatmap_id, plays, skips)
+                for beatmap_id, (plays, skips) in self.maps.items()
+            ]
+
+    def top(self, count=5) -> list:
+        # return: [(beatmap id, plays)] most played first
+        with self.lock:
+            top_maps, changes = self.top_maps, self.changes
+
+        if top_maps is None or len(top_maps) < count:
+            top_maps = [
+                (beatmap_id, plays)
+                for beatmap_id, plays, _ in heapq.nlargest(
+                    count, self.totals(), key=lambda item: item[1]
+                )
+                if plays
+            ]
+
+            with self.lock:
+                # not if the totals changed while ranking
+                if self.changes == changes:
+                    self.top_maps = top_maps
+
+        return top_maps[:count]
+
+    def most_skipped(self, count=20, seen=5) -> list:
+        # return: [(beatmap id, skip rate, times seen)], maps seen at least `seen` times
+        rates = (
+            (beatmap_id, skips / (plays + skips), plays + skips)
+            for beatmap_id, plays, skips in self.totals()
+            if plays + skips >= seen
+        )
+        return heapq.nlargest(count, rates, key=lambda item: item[1])
+
+    def readout(self) -> str:
+        return (
+            f"{len(self.buffer)} buffered | {self.written} written"
+            f" in {self.flushes} batches | errors {self.errors}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path", default="match_history.db")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--skipped", type=int, default=20)
+    parser.add_argument("--seen", type=int, default=5)
+    args = parser.parse_args()
+    history = MatchHistory(path=args.path)
+
+    print("most played")
+
+    for beatmap_id, plays in history.top(args.top):
+        print(f"  https://osu.ppy.sh/b/{beatmap_id} | {plays} plays")
+
+    print(f"most skipped, seen {args.seen}+ times")
+
+    for beatmap_id, rate, seen in history.most_skipped(args.skipped, args.seen):
+        print(f"  https://osu.ppy.sh/b/{beatmap_id} | {rate:.0%} of {seen}")
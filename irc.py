@@ -1,154 +1,436 @@
 from datetime import datetime
 import errno
 import json
+import logging
 import os
-import re
+import queue
+import select
 import socket
-from time import sleep
-import requests
-from beatmaps import filter_map_by_ratings
-
-logger = None
+import threading
+from time import monotonic, perf_counter, sleep, time
+from cache import BeatmapCache
+from connection import DISCONNECTED, ConnectionManager, join_lines
+from catalog import BeatmapCatalog, load_catalog, replace_catalog
+from difficulty import DifficultyCalculator, mod_key, rating_errors
+from fetcher import BeatmapError, BeatmapFetcher
+from history import MatchHistory
+import logs
+from metrics import Metrics, start_metrics
+from outbound import Cooldowns, OutboundScheduler
+from parser import (
+    BeatmapChangedTo,
+    ChangedBeatmapTo,
+    ChannelMissing,
+    HostChanged,
+    MatchFinished,
+    MatchReady,
+    AuthFailed,
+    MatchStarted,
+    Ping,
+    Players,
+    PrivateMessage,
+    RoomClosed,
+    RoomCreated,
+    RoomMessage,
+    RoomNotice,
+    Slot,
+    UserJoined,
+    UserLeft,
+    Welcome,
+    parse,
+)
+from pool import BeatmapPool, PoolCursor, load_pool, pool_path, replace_pool
+from prefetch import Prefetcher
+from providers import ProviderChain, ScrapeProvider, build_providers
+from queues import HostQueue
+from reload import ConfigWatcher
+from rooms import RoomRegistry, room_key
+from roster import Roster, RosterDiff
+from selection import WeightedCursor
+from state import RoomStateStore
+from transport import LineTransport
+
+logger = logging.getLogger("irc.py")
+protocol_logger = logging.getLogger("irc.py.protocol")
+rooms_logger = logging.getLogger("irc.py.rooms")
 team_mode = {0: "HeadToHead", 1: "TagCoop", 2: "TeamVs", 3: "TagTeamVs"}
 score_mode = {0: "Score", 1: "Accuracy", 2: "Combo", 3: "ScoreV2"}
 play_mode = {0: "osu!", 1: "Taiko", 2: "Catch the Beat", 3: "osu!Mania"}
 bot_mode = {0: "AutoHost", 1: "AutoPick"}
-valid_roles = [
-    "Host",
-    "TeamBlue",
-    "TeamRed",
-    "Hidden",
-    "HardRock",
-    "SuddenDeath",
-    "Flashlight",
-    "SpunOut",
-    "NoFail",
-    "Easy",
-    "Relax",
-    "Relax2",
-]
+# room commands answered with chat only, under the cooldowns
+chat_commands = {"!users", "!queue", "!stats", "!top", "!info"}
 
 
 class OsuIrc:
     def __init__(
-        self, username: str, password: str, rooms=[], host="irc.ppy.sh", port=6667
+        self,
+        username: str,
+        password: str,
+        rooms=[],
+        host="irc.ppy.sh",
+        port=6667,
+        rate_limit={"messages": 10, "seconds": 5},
+        cache: BeatmapCache = None,
+        fetcher: BeatmapFetcher = None,
+        admins=[],
+        state: RoomStateStore = None,
+        connection: ConnectionManager = None,
+        lookahead=3,
+        providers: ProviderChain = None,
+        difficulty: DifficultyCalculator = None,
+        history: MatchHistory = None,
     ) -> None:
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.socket = None
+        self.transport = None
         self.stop = False
-        self.rooms = rooms
+        self.rooms = RoomRegistry(rooms)
+        self.outbound = OutboundScheduler(
+            messages=rate_limit.get("messages", 10),
+            seconds=rate_limit.get("seconds", 5),
+            dedup=rate_limit.get("dedup", 10.0),
+            reserve=rate_limit.get("reserve", 2),
+        )
+        self.cooldowns = Cooldowns(
+            room=rate_limit.get("room_cooldown", 10.0),
+            user=rate_limit.get("user_cooldown", 5.0),
+        )
+        self.writer = None
+        self.cache = cache or BeatmapCache()
+        self.fetcher = fetcher or BeatmapFetcher()
+        self.providers = providers or ProviderChain(
+            remote=[ScrapeProvider(self.fetcher)]
+        )
+        self.difficulty = difficulty or DifficultyCalculator(fetcher=self.fetcher)
+        self.stats_interval = 60.0
+        self.stats_reported = monotonic()
+        self.admins = set(admins)
+        self.metrics = Metrics()
+        self.handler_seconds = self.metrics.histogram(
+            "osu_handler_seconds", "Time spent in the on_* handlers", ["handler"]
+        )
+        self.handler_errors = self.metrics.counter(
+            "osu_handler_errors_total",
+            "Exceptions raised by on_* handlers",
+            ["handler"],
+        )
+        self.inbound_lines = self.metrics.counter(
+            "osu_inbound_lines_total", "Inbound lines parsed"
+        )
+        self.fetch_seconds = self.metrics.histogram(
+            "osu_beatmap_fetch_seconds", "Beatmap page fetch latency"
+        )
+        self.fetch_errors = self.metrics.counter(
+            "osu_beatmap_fetch_errors_total", "Failed beatmap page fetches", ["error"]
+        )
+        self.reconnects = self.metrics.counter(
+            "osu_reconnects_total", "Reconnects after a lost connection"
+        )
+        self.metrics.collect(self.collect_metrics)
+        self.inbound_summary = (monotonic(), 0)
+        self.state = state
+        self.history = history
+
+        if history:
+            history.start()
+        self.connection = connection or ConnectionManager()
+        self.prefetcher = Prefetcher(self, lookahead=lookahead)
+        # callbacks from other threads, run by the bot thread between reads
+        self.calls = queue.SimpleQueue()
+        # a byte on this pair wakes the select of the receive loop
+        self.waker, self.wakeup_socket = socket.socketpair()
+        self.waker.setblocking(False)
+        self.wakeup_socket.setblocking(False)
         self.init_rooms()
 
     def init_rooms(self):
         for room in self.rooms:
-            room["name"] = room.get("name").strip()
-            room["connected"] = room["created"] = room["configured"] = False
-            room["total_users"] = 00
-            room["skip"] = []
-            room["users"] = []
-            room["check_users"] = []
-            room["current_beatmap"] = room.get("current_beatmap", None)
+            self.init_room(room=room)
 
-            if room.get("bot_mode") == 1:
-                self.load_beatmapset(room=room)
+        # names are normalized now
+        self.rooms.reindex()
 
-    def load_beatmapset(self, room: dict):
-        import random
+    def init_room(self, room: dict) -> None:
+        room["name"] = room.get("name").strip()
+        room["connected"] = room["created"] = room["configured"] = False
+        room["skip"] = set()
+        room["users"] = HostQueue()
+        room["roster"] = Roster()
+        # command replies, rebuilt when their key changes
+        room["responses"] = {}
+        room["current_beatmap"] = room.get("current_beatmap", None)
+
+        if room.get("bot_mode") == 1:
+            self.load_beatmapset(room=room)
+
+        if self.state:
+            # a lobby from before the restart is rejoined, not made again
+            self.state.restore(self.username, room)
+
+        if room.get("bot_mode") == 1:
+            self.prefetcher.refill(room)
+
+    def save_room(self, room: dict) -> None:
+        if self.state:
+            self.state.save(self.username, room)
+
+    def add_room(self, room: dict) -> None:
+        # picked up by check_rooms on the next loop
+        self.init_room(room=room)
+        self.rooms.add(room)
+
+    def remove_room(self, room: dict) -> None:
+        rooms_logger.info("~ Room removed | %s", room.get("name"))
+
+        if room.get("room_id"):
+            self.send_private(room.get("room_id"), "!mp close")
+
+        self.rooms.remove(room)
+
+    def update_room(
+        self, room: dict, changes: dict, cursor=None, snapshot: dict = None
+    ) -> None:
+        # changes: config key -> new value, None for a removed key
+        for key, value in changes.items():
+            if value is None:
+                room.pop(key, None)
+            elif key != "name":
+                room[key] = value
+
+        if changes.get("name"):
+            self.rooms.rename(room, changes.get("name").strip())
 
-        beatmaps = []
+        rooms_logger.info("~ Room updated %s | %s", room.get("name"), list(changes))
+
+        # a lobby still being made gets the new settings once created
+        if room.get("room_id"):
+            if "name" in changes:
+                self.send_private(room.get("room_id"), f"!mp name {room.get('name')}")
+
+            if "password" in changes:
+                self.send_private(
+                    room.get("room_id"), f"!mp password {room.get('password') or ''}"
+                )
+
+            if changes.keys() & {"team_mode", "score_mode", "room_size"}:
+                self.send_private(
+                    room.get("room_id"),
+                    f"!mp set {room.get('team_mode')} {room.get('score_mode')} {room.get('room_size', 16)}",
+                )
 
+        if room.get("bot_mode") != 1:
+            room.pop("beatmaps", None)
+        elif cursor is not None:
+            # built off this thread from a snapshot, picks made since then
+            # are carried over
+            if room.get("beatmaps") and snapshot is not None:
+                if room["beatmaps"].state() != snapshot:
+                    cursor.restore(**room["beatmaps"].state())
+
+            room["beatmaps"] = cursor
+            self.prefetcher.refill(room)
+
+    def apply_reload(self, reload: dict) -> None:
+        # swaps the reloaded pools in and applies the room diff, see reload.py
+        for filename, (pool, catalog) in reload.get("pools", {}).items():
+            replace_pool(filename, pool)
+            replace_catalog(filename, catalog)
+            self.providers.catalog.add(filename)
+
+        for key in reload.get("remove", []):
+            room = self.rooms.find(key)
+
+            if room:
+                self.remove_room(room)
+
+        for key, changes, cursor, snapshot in reload.get("update", []):
+            room = self.rooms.find(key)
+
+            if room:
+                self.update_room(room, changes, cursor, snapshot)
+
+        for room in reload.get("add", []):
+            self.add_room(room)
+            rooms_logger.info("~ Room added | %s", room.get("name"))
+
+        if reload.get("admins") is not None:
+            self.admins = set(reload.get("admins"))
+
+    def call_soon(self, callback, *args) -> None:
+        self.calls.put((callback, args))
+        self.wake_calls()
+
+    def wake_calls(self) -> None:
+        try:
+            self.wakeup_socket.send(b"\0")
+        except BlockingIOError:
+            # already full of wakeups, the loop is coming
+            pass
+
+    def run_calls(self) -> None:
+        while not self.calls.empty():
+            callback, args = self.calls.get()
+
+            try:
+                callback(*args)
+            except Exception as err:
+                logger.exception(f"~ Call error: {err}")
+
+    def build_cursor(
+        self,
+        room: dict,
+        pool: BeatmapPool = None,
+        catalog: BeatmapCatalog = None,
+    ) -> PoolCursor | WeightedCursor:
+        # pool and catalog are passed by a reload, which builds cursors off the
+        # bot thread before swapping them in
         if not room.get("beatmapset_filename"):
             raise ValueError("beatmapset_filename is required!")
 
-        with open("beatmapsets/" + room.get("beatmapset_filename"), "r") as f:
-            beatmaps = json.loads(f.read())
+        # the pool is shared between rooms, each room only owns its order
+        filename = pool_path(room)
+        pool = pool or load_pool(filename)
+        indices = None
+
+        if room.get("filters") is not None:
+            # pool derived from a bigger dump, star range defaults to min/max
+            filters = {"difficulty": [room.get("min"), room.get("max")]}
+            filters.update(room.get("filters"))
+            indices = (catalog or load_catalog(filename)).query(**filters)
+
+        if room.get("selection") is not None:
+            # "selection": {"weights": {"play_count": 1}, "window": {"mapper": 5}}
+            return WeightedCursor(
+                pool,
+                indices=indices,
+                stars=(room.get("min"), room.get("max")),
+                **room.get("selection"),
+            )
+
+        return PoolCursor(pool, indices=indices)
+
+    def load_beatmapset(self, room: dict):
+        room["beatmaps"] = self.build_cursor(room)
+        self.providers.catalog.add(pool_path(room))
 
         logger.info(
-            f"~ {room.get('name')} | Auto Pick Map Room | {room.get('min')} -> {room.get('max')} | {len(beatmaps)} Total Beatmaps!"
+            f"~ {room.get('name')} | Auto Pick Map Room | {room.get('min')} -> {room.get('max')} | {len(room['beatmaps'])} Total Beatmaps!"
         )
 
-        random.shuffle(beatmaps)
-        room["beatmaps"] = beatmaps
-
     def connect(self, timeout=5.0) -> bool:
+        self.connection.connecting()
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.settimeout(timeout)
 
         try:
             self.socket.connect((self.host, self.port))
+            self.transport = LineTransport(self.socket)
+            # drop lines queued for the old connection
+            self.outbound.clear()
             self.send(f"PASS {self.password}")
             self.send(f"NICK {self.username}")
             logger.info(
                 f"~ Connected to {self.host}:{self.port} | username: {self.username}"
             )
+
+            if not self.writer or not self.writer.is_alive():
+                self.writer = threading.Thread(
+                    target=self.write_loop, name="osu-writer", daemon=True
+                )
+                self.writer.start()
             return True
         except TimeoutError:
             logger.critical("~ Timeout Error!")
         except socket.gaierror:
             logger.critical("~ No Internet Connection!")
+        except OSError as err:
+            logger.critical(f"~ Connection failed! | {err}")
 
+        self.socket.close()
         return False
 
+    def close_connection(self) -> None:
+        # the receive loop sees the closed socket and reconnects
+        self.socket.close()
+
     def disconnect(self) -> None:
         self.stop = True
         self.socket.close()
 
     def send(self, message: str) -> None:
-        sleep(0.50)
-        self.socket.send(f"{message}\n".encode())
+        # paced and prioritized by the outbound scheduler, never blocks
+        self.outbound.put(message)
+
+    def write_loop(self) -> None:
+        while not self.stop:
+            message = self.outbound.get(timeout=1.0)
+
+            if not message:
+                continue
+
+            transport = self.transport
+
+            # every line the bucket allows right now goes out in one sendall
+            while message:
+                transport.write(message)
+                message, _ = self.outbound.pop()
+
+            try:
+                transport.flush()
+            except OSError as err:
+                logger.error(f"~ Send error: {err}")
+
+    def report_stats(self) -> None:
+        if monotonic() - self.stats_reported < self.stats_interval:
+            return
+
+        self.stats_reported = monotonic()
+        logger.info(f"~ Outbound | {self.outbound.readout()}")
+        logger.info(f"~ Beatmap cache | {self.cache.readout()}")
+        logger.info(f"~ Prefetch | {self.prefetcher.readout()}")
+        logger.info(f"~ Beatmap providers | {self.providers.readout()}")
+        logger.info(f"~ Star ratings | {self.difficulty.readout()}")
+
+        if self.history:
+            logger.info(f"~ Match history | {self.history.readout()}")
+
+        dropped = sum(getattr(handler, "dropped", 0) for handler in logger.handlers)
+
+        if dropped:
+            logger.warning(f"~ Log queue full, {dropped} records dropped so far")
 
     def send_private(self, recipient: str, message: str) -> None:
         self.send(f"PRIVMSG {recipient} : {message}")
 
-    def receive(self, size=2048) -> str:
-        return self.socket.recv(size).decode()
-
-    def username_parser(self, username: str) -> str:
-        return username.strip().replace(" ", "_")
-
-    def message_parser(self, message: str) -> dict:
-        # return: {type: string, sender: string, message: string, room_id: string}
-        if message.startswith(":cho.ppy.sh"):
-            return {
-                "type": "server",
-                "sender": "cho.ppy.sh",
-                "message": message,
-                "room_id": None,
-            }
-
-        if "PRIVMSG" in message:
-            split_message = message.split(" :")
-            sender = self.username_parser(
-                split_message[0][1 : split_message[0].rfind("!")]
-            )
-            sender_message = " :".join(split_message[1:])
-
-            if "PRIVMSG #mp_" in message:
-                room_id_index = split_message[0].rfind("#mp_")
-                room_id = split_message[0][room_id_index:]
-                return {
-                    "type": "room",
-                    "sender": sender,
-                    "message": sender_message,
-                    "room_id": room_id,
-                }
-            else:
-                return {
-                    "type": "private",
-                    "sender": sender,
-                    "message": sender_message,
-                    "room_id": None,
-                }
+    def receive(self) -> list:
+        return self.transport.read_lines()
+
+    def wait_readable(self, timeout=5.0) -> bool:
+        # queued calls run as soon as they are put, not after the next read
+        if self.socket.fileno() == -1:
+            raise ConnectionError("Socket closed")
+
+        readable, _, _ = select.select([self.socket, self.waker], [], [], timeout)
+
+        if self.waker in readable:
+            try:
+                while self.waker.recv(4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+            self.run_calls()
 
-        return {"type": None, "sender": None, "message": message, "room_id": None}
+        return self.socket in readable
+
+    def message_parser(self, message: str):
+        return parse(message)
 
     def get_room(self, room_name=None, room_id=None) -> dict:
-        for room in self.rooms:
-            if room.get("name") == room_name or room.get("room_id") == room_id:
-                return room
+        return self.rooms.get(room_name=room_name, room_id=room_id)
 
     def close_rooms(self):
         for room in self.rooms:
@@ -157,9 +439,10 @@ class OsuIrc:
                 room["connected"] = False
 
     def join_rooms(self):
-        for room in self.rooms:
-            if room.get("room_id"):
-                self.send(f"JOIN {room.get('room_id')}")
+        channels = [room.get("room_id") for room in self.rooms if room.get("room_id")]
+
+        for line in join_lines(channels):
+            self.send(line)
 
     def setup_room_settings(self, room: dict) -> None:
         logger.info(f"~ Setting up Room {room.get('name')} | {room.get('room_id')}")
@@ -169,7 +452,6 @@ class OsuIrc:
             self.send_private(
                 room.get("room_id"), f"!mp password {room.get('password')}"
             )
-            sleep(1)
             self.send_private(
                 room.get("room_id"),
                 f"!mp set {room.get('team_mode')} {room.get('score_mode')} {room.get('room_size', 16)}",
@@ -178,37 +460,61 @@ class OsuIrc:
 
     def on_skip_rotate(self, room: dict):
         if room.get("bot_mode") == 0 and room.get("users"):
-            room["users"] = room["users"][1:] + room["users"][0:1]
-            self.send_private(room.get("room_id"), f"!mp host {room.get('users')[0]}")
-        elif room.get("bot_mode") == 1 and room.get("beatmaps"):
+            room["users"].rotate()
             self.send_private(
-                room.get("room_id"),
-                f"!mp map {room.get('beatmaps')[0].get('beatmap_id')} {room.get('play_mode')}",
+                room.get("room_id"), f"!mp host {room.get('users').first()}"
             )
-            room["beatmaps"] = room["beatmaps"][1:] + room["beatmaps"][0:1]
+        elif room.get("bot_mode") == 1 and room.get("beatmaps"):
+            beatmap = room["beatmaps"].current()
 
-        room["skip"] = []
+            if beatmap is None:
+                logger.warning(f"~ {room.get('name')} | No beatmap left to pick")
+            else:
+                self.send_private(
+                    room.get("room_id"),
+                    f"!mp map {beatmap.get('beatmap_id')} {room.get('play_mode')}",
+                )
+                room["beatmaps"].advance()
+                self.prefetcher.refill(room)
 
-    def get_beatmap_info(self, url: str) -> dict | None:
-        logger.info(f"~ Fetching url: {url}")
-        res = None
+        room["skip"].clear()
 
-        try:
-            res = requests.get(url, timeout=(10, 10))
-            logger.info(f"~ Fetch status|code: {res.ok} | {res.status_code}")
-        except Exception as err:
-            logger.critical(f"~ Fetch beatmap info error! | {err}")
+    def fetch_beatmapset(self, url: str, local=True) -> dict:
+        # local=False skips the catalog, e.g. to find maps deleted since the dump
+        beatmap_id = url.rstrip("/").split("/")[-1]
 
-        if res.ok:
-            beatmap_info = re.search('\{"artist".+', res.text).group(0)
+        if not beatmap_id.isdigit():
+            return self.request_beatmapset(self.fetcher.fetch_beatmapset, url)
 
-            if beatmap_info:
-                try:
-                    return json.loads(beatmap_info)
-                except json.decoder.JSONDecodeError as err:
-                    logger.error(f"~Beatmap info decode error | {err}")
+        beatmap_id = int(beatmap_id)
+
+        if local:
+            beatmapset = self.providers.local(beatmap_id)
 
-        logger.error("~Beatmap failed to fetch")
+            if beatmapset:
+                return beatmapset
+
+        return self.cache.get(
+            beatmap_id,
+            lambda: self.request_beatmapset(self.providers.fetch, beatmap_id),
+        )
+
+    def request_beatmapset(self, fetch, *args) -> dict:
+        start = perf_counter()
+
+        try:
+            return fetch(*args)
+        except Exception as err:
+            self.fetch_errors.inc(getattr(err, "error", type(err).__name__))
+            raise
+        finally:
+            self.fetch_seconds.observe(perf_counter() - start)
+
+    def get_beatmap_info(self, url: str) -> dict | None:
+        try:
+            return self.fetch_beatmapset(url=url)
+        except BeatmapError as err:
+            logger.error(f"~Beatmap failed to fetch | {err}")
 
     def links(self, title: str, beatmap_id: int) -> str:
         if not beatmap_id:
@@ -216,83 +522,127 @@ class OsuIrc:
 
         return f"[https://osu.ppy.sh/beatmapsets/{beatmap_id} {title}] [https://beatconnect.io/b/{beatmap_id}/ beatconnect]"
 
+    def response(self, room: dict, name: str, key, build) -> str:
+        cached = room["responses"].get(name)
+
+        if cached and cached[0] == key:
+            return cached[1]
+
+        text = build(room)
+        room["responses"][name] = (key, text)
+        return text
+
+    def users_key(self, room: dict) -> tuple:
+        return id(room.get("users")), room.get("users").version
+
+    def queue_key(self, room: dict) -> tuple:
+        # what the next maps depend on, the users for auto host
+        if room.get("bot_mode") == 1 and room.get("beatmaps"):
+            beatmaps = room["beatmaps"]
+            return (
+                id(beatmaps),
+                beatmaps.seed,
+                beatmaps.cycle,
+                beatmaps.cursor,
+                len(beatmaps.pool.dead),
+            )
+
+        return self.users_key(room)
+
     def get_queue(self, room: dict) -> str:
+        return self.response(room, "queue", self.queue_key(room), self.build_queue)
+
+    def build_queue(self, room: dict) -> str:
         if room.get("bot_mode") == 1:
             message = []
 
-            for beatmap in room.get("beatmaps")[0:5]:
+            for beatmap in room.get("beatmaps").peek(5):
                 message.append(
                     f"[https://osu.ppy.sh/b/{beatmap.get('beatmap_id')} {beatmap.get('title')}]"
                 )
 
             return ", ".join(message)
         elif room.get("bot_mode") == 0:
-            return ", ".join(room.get("users")[0:5])
+            return ", ".join(room.get("users").peek(5))
 
     def on_room_created(self, room_name: str, room_id: str):
         if room_name and room_id:
-            logger.info(f"~ Room Created {room_id} | {room_name}")
+            rooms_logger.info("~ Room Created %s | %s", room_id, room_name)
             room = self.get_room(room_name=room_name)
 
             if room:
-                room["room_id"] = room_id
+                self.rooms.set_room_id(room, room_id)
                 self.setup_room_settings(room=room)
                 self.on_skip_rotate(room=room)
+                self.save_room(room)
 
     def on_room_closed(self, room: dict):
-        logger.warning(f"~ Room closed | {room.get('name')}")
+        rooms_logger.warning("~ Room closed | %s", room.get("name"))
         room["created"] = room["connected"] = False
-        room["users"] = []
+        room["users"].clear()
+        # the #mp_ channel is gone, check_rooms makes a new match
+        self.rooms.set_room_id(room, None)
 
     def on_user_joined(self, room: dict, user: str) -> None:
-        logger.info(f"~ {user} joined the room {room.get('room_id')}")
+        rooms_logger.info("~ %s joined the room %s", user, room.get("room_id"))
 
-        if user not in room.get("users"):
-            room["users"].append(user)
-            logger.info(f"~ {user} added to {room.get('name')} | {room.get('users')}")
+        if room["users"].add(user):
+            rooms_logger.info(
+                "~ %s added to %s | %s", user, room.get("name"), room.get("users")
+            )
 
         if room.get("bot_mode") == 0 and len(room.get("users")) == 1:
             self.on_skip_rotate(room=room)
 
     def on_user_left(self, room: dict, user: str) -> None:
-        logger.info(f"~ {user} left the room {room.get('room_id')}")
+        rooms_logger.info("~ %s left the room %s", user, room.get("room_id"))
 
         # autohost | rotate on host leave
-        if (
-            room.get("bot_mode") == 0
-            and room.get("users")
-            and room.get("users")[0] == user
-        ):
+        if room.get("bot_mode") == 0 and room.get("users").first() == user:
             self.on_skip_rotate(room=room)
 
-        if user in room.get("users"):
-            room["users"].remove(user)
+        room["users"].discard(user)
 
     def on_host_changed(self, room: dict, user: str) -> None:
-        logger.info(f"~ room {room.get('room_id')} changed host to {user}")
-        room["skip"] = []
+        rooms_logger.info("~ room %s changed host to %s", room.get("room_id"), user)
+        room["skip"].clear()
 
         if room.get("bot_mode") == 0 and room.get("users"):
             # host gave host to the second user in queue
-            if len(room.get("users")) > 1 and user == room.get("users")[1]:
-                logger.info("~ host gave host to the second user in queue")
-                room["users"] = room["users"][1:] + room["users"][0:1]
+            if user == room.get("users").second():
+                rooms_logger.info("~ host gave host to the second user in queue")
+                room["users"].rotate()
             # host gave the host to random user
-            elif user != room.get("users")[0]:
-                logger.info("~ host gave the host to random user")
+            elif user != room.get("users").first():
+                rooms_logger.info("~ host gave the host to random user")
                 self.send_private(
-                    room.get("room_id"), f"!mp host {room.get('users')[0]}"
+                    room.get("room_id"), f"!mp host {room.get('users').first()}"
                 )
 
     def on_match_started(self, room: dict) -> None:
-        logger.info(f"~ room {room.get('room_id')} Match started")
-        room["skip"] = []
+        rooms_logger.info("~ room %s Match started", room.get("room_id"))
+        # map, start, players and skip votes, recorded when it finishes
+        room["match"] = (
+            room.get("current_beatmap"),
+            time(),
+            list(room.get("users")),
+            len(room.get("skip")),
+        )
+        room["skip"].clear()
 
         if room.get("bot_mode") == 0:
             self.on_skip_rotate(room=room)
 
     def on_match_finished(self, room: dict) -> None:
-        logger.info(f"~ room {room.get('room_id')} Match finished")
+        rooms_logger.info("~ room %s Match finished", room.get("room_id"))
+        match = room.pop("match", None)
+
+        if self.history and match:
+            beatmap_id, started, users, skips = match
+            self.history.record(
+                room_key(room), beatmap_id, "played", started, users, skips
+            )
+
         self.send_private(
             room.get("room_id"), f"!mp settings | Queue: {self.get_queue(room=room)}"
         )
@@ -301,7 +651,7 @@ class OsuIrc:
             self.on_skip_rotate(room=room)
 
     def on_match_ready(self, room: dict) -> None:
-        logger.info(f"~ room {room.get('room_id')} Match ready")
+        rooms_logger.info("~ room %s Match ready", room.get("room_id"))
         self.send_private(room.get("room_id"), "!mp start")
 
     def send_beatmap_violation(self, room: dict, message: str, error: str) -> None:
@@ -310,113 +660,151 @@ class OsuIrc:
             f"!mp map {room.get('current_beatmap')} {room.get('play_mode')} | Rule Violation [{error}]: {message}",
         )
 
-    def set_room_beatmap(self, room: dict, version: str, url: str) -> None:
+    def set_room_beatmap(
+        self, room: dict, version: str, url: str, pick: int = None
+    ) -> None:
+        # runs in the http pool, the result is applied on the bot thread
+        self.call_soon(
+            self.finish_pick, room, pick, *self.check_pick(room, version, url)
+        )
+
+    def check_pick(self, room: dict, version: str, url: str) -> tuple:
+        # return: (message, error, beatmap id), error None for a valid pick
         if not version or not url:
-            self.send_beatmap_violation(
-                room,
-                "Beatmap not found!",
-                "NotFound",
-            )
-            return
+            return "Beatmap not found!", "NotFound", None
         elif url == "https://osu.ppy.sh/b/0":
-            self.send_beatmap_violation(
-                room,
-                "Beatmap Not Submitted!",
-                "NotFound",
-            )
-            return
-
-        try:
-            response = requests.get(url, timeout=(10, 10))
-        except Exception as err:
-            logger.critical(f"~ Fetch Error: {err}")
-            self.send_beatmap_violation(room, "Fetching beatmap error!", "HttpError")
-            return
-
-        if not response.ok:
-            self.send_beatmap_violation(
-                room,
-                "Beatmap Not Submitted!",
-                "NotFound",
-            )
-            return
-
-        beatmap_info = re.search('\{"artist".+', response.text).group(0)
-
-        if not beatmap_info:
-            self.send_beatmap_violation(
-                room,
-                "Beatmap details not found!",
-                "NotFound",
-            )
-            return
+            return "Beatmap Not Submitted!", "NotFound", None
 
         try:
-            beatmap_info_json = json.loads(beatmap_info)
-        except json.decoder.JSONDecodeError as err:
-            logger.error(f"DEBUG: BEATMAP JSON LOAD {err}")
-            self.send_beatmap_violation(
-                room,
-                "Beatmap json parser error",
-                "NotFound",
-            )
-            return
+            beatmap_info_json = self.fetch_beatmapset(url=url)
+        except BeatmapError as err:
+            return err.message, err.error, None
 
         if beatmap_info_json.get("availability").get("download_disabled"):
-            self.send_beatmap_violation(
-                room,
-                "Beatmap is not available!",
-                "DownloadDisabled",
-            )
-            return
+            return "Beatmap is not available!", "DownloadDisabled", None
 
         for beatmap in beatmap_info_json.get("beatmaps"):
             if beatmap.get("version") != version:
                 continue
 
-            if beatmap.get("difficulty_rating") < room.get("min"):
-                self.send_beatmap_violation(
-                    room,
-                    f"[https://osu.ppy.sh/beatmapsets/{beatmap_info_json.get('id')}#osu/{beatmap.get('id')} {beatmap.get('version')} | {beatmap.get('difficulty_rating')}*] Low Star* Beatmap",
+            ratings = self.beatmap_ratings(room, beatmap)
+            low = min(ratings, key=ratings.get)
+            high = max(ratings, key=ratings.get)
+
+            if ratings[low] < room.get("min"):
+                return (
+                    f"[https://osu.ppy.sh/beatmapsets/{beatmap_info_json.get('id')}#osu/{beatmap.get('id')} {beatmap.get('version')} | {stars_label(ratings, low)}] Low Star* Beatmap",
                     "star",
+                    None,
                 )
-            elif beatmap.get("difficulty_rating") > room.get("max"):
-                self.send_beatmap_violation(
-                    room,
-                    f"[https://osu.ppy.sh/beatmapsets/{beatmap_info_json.get('id')}#osu/{beatmap.get('id')} {beatmap.get('version')} | {beatmap.get('difficulty_rating')}*] High Star* Beatmap",
+            elif ratings[high] > room.get("max"):
+                return (
+                    f"[https://osu.ppy.sh/beatmapsets/{beatmap_info_json.get('id')}#osu/{beatmap.get('id')} {beatmap.get('version')} | {stars_label(ratings, high)}] High Star* Beatmap",
                     "star",
+                    None,
                 )
-            else:
-                self.send_private(
-                    room.get("room_id"),
-                    f'Stars: {beatmap.get("difficulty_rating")} | Status: {beatmap.get("status")} | CircleSize: {beatmap.get("cs")} | ApproachRate: {beatmap.get("ar")} | [{beatmap.get("url")} {beatmap_info_json.get("title", "link")}] [https://beatconnect.io/b/{beatmap_info_json.get("id")}/ Beatconnect]',
-                )
-                room["current_beatmap"] = beatmap.get("id", room.get("current_beatmap"))
+
+            mods = ", ".join(
+                stars_label(ratings, key) for key in ratings if key != "NM"
+            )
+            return (
+                f'Stars: {beatmap.get("difficulty_rating")}{f" ({mods})" if mods else ""} | Status: {beatmap.get("status")} | CircleSize: {beatmap.get("cs")} | ApproachRate: {beatmap.get("ar")} | [{beatmap.get("url")} {beatmap_info_json.get("title", "link")}] [https://beatconnect.io/b/{beatmap_info_json.get("id")}/ Beatconnect]',
+                None,
+                beatmap.get("id"),
+            )
+
+        return "Beatmap version not found", "NotFound", None
+
+    def finish_pick(
+        self, room: dict, pick: int, message: str, error=None, beatmap_id=None
+    ) -> None:
+        # a check that finished after a newer pick of the room is dropped
+        if pick is not None and pick != room.get("pick"):
+            rooms_logger.info(
+                "~ room %s stale pick check dropped | %s", room.get("room_id"), message
+            )
             return
 
-        self.send_beatmap_violation(
-            room,
-            f"Beatmap version not found",
-            "NotFound",
-        )
+        if error:
+            self.send_beatmap_violation(room, message, error)
+            return
+
+        self.send_private(room.get("room_id"), message)
+        room["current_beatmap"] = beatmap_id or room.get("current_beatmap")
+
+    def beatmap_ratings(self, room: dict, beatmap: dict) -> dict:
+        # stars for every mod combo the room allows, "mods": ["NM", "HR", "DT"].
+        # precomputed ratings from the catalog first, else the local calculator.
+        # the local model reads a little off the website, so mod ratings are
+        # scaled by website NM / local NM to stay comparable with NM.
+        ratings = {}
+        precomputed = beatmap.get("mod_ratings") or {}
+        stars = beatmap.get("difficulty_rating")
+        local = {}
+
+        def rate(key):
+            if key not in local:
+                if key in precomputed:
+                    local[key] = precomputed[key]
+                else:
+                    local[key] = self.difficulty.rating(beatmap.get("id"), key)
+
+            return local[key]
+
+        for key in dict.fromkeys(mod_key(mods) for mods in room.get("mods") or ["NM"]):
+            if key == "NM":
+                ratings[key] = stars
+                continue
+
+            try:
+                rating = rate(key)
+                baseline = rate("NM")
+            except rating_errors as err:
+                # not rated, the combo isn't checked
+                logger.warning(f"~ No {key} rating for {beatmap.get('id')} | {err}")
+                continue
+
+            ratings[key] = (
+                round(rating * stars / baseline, 2) if stars and baseline else rating
+            )
+
+        return ratings or {"NM": stars}
 
     def on_beatmap_changed_to(
         self, room: dict, title: str, version: str, url: str, beatmap_id: int
     ) -> None:
-        # beatmap manually pick by user
-        logger.info(f"~ Beatmap change to {title} | {url}")
-        self.set_room_beatmap(
+        # beatmap manually pick by user, validated in the http pool
+        rooms_logger.info("~ Beatmap change to %s | %s", title, url)
+        room["pick"] = room.get("pick", 0) + 1
+        self.fetcher.submit(
+            self.set_room_beatmap,
             room=room,
             url=url,
             version=version,
+            pick=room["pick"],
         )
 
     def on_changed_beatmap_to(
         self, room: dict, title: str, url: str, beatmap_id: int
     ) -> None:
-        logger.info(f"~Change beatmap to {title} | {url} | {beatmap_id}")
-        room["skip"] = []
+        if room.get("bot_mode") != 1:
+            return
+
+        rooms_logger.info("~Change beatmap to %s | %s | %s", title, url, beatmap_id)
+        room["skip"].clear()
         room["current_beatmap"] = beatmap_id
+        links = self.prefetcher.links_for(beatmap_id)
+
+        if links:
+            # validated ahead of time, no lookup on the way
+            self.send_private(room.get("room_id"), links)
+            return
+
+        self.fetcher.submit(
+            self.send_links, room=room, title=title, url=url, beatmap_id=beatmap_id
+        )
+
+    def send_links(self, room: dict, title: str, url: str, beatmap_id: int) -> None:
         beatmap = self.get_beatmap_info(url=url)
 
         if beatmap:
@@ -428,21 +816,45 @@ class OsuIrc:
     def on_error(self, error):
         logger.error(error)
 
-    def on_disconnected(self):
+    def on_disconnected(self, reason=""):
+        self.reconnects.inc()
+
         for room in self.rooms:
             room["connected"] = False
 
-        self.connect()
+        self.connection.disconnected(str(reason))
+
+        if self.socket:
+            self.socket.close()
 
     def check_rooms(self):
+        if not self.connection.ready:
+            return
+
+        channels = []
+
         for room in self.rooms:
             if room.get("room_id") and not room.get("connected"):
-                self.send(f"JOIN {room.get('room_id')}")
+                channels.append(room.get("room_id"))
                 room["connected"] = True
             elif not room.get("created"):
                 self.send_private("BanchoBot", f"mp make {room.get('name')}")
                 room["created"] = True
 
+        # one line for every lobby to rejoin
+        for line in join_lines(channels):
+            self.send(line)
+
+        self.connection.joined()
+
+    def check_keepalive(self) -> None:
+        action = self.connection.keepalive()
+
+        if action == "ping":
+            self.send(f"PING {self.host}")
+        elif action == "dead":
+            raise ConnectionError("Ping timeout")
+
     def on_slot(
         self,
         room: dict,
@@ -452,210 +864,382 @@ class OsuIrc:
         user: str,
         roles: list,
     ) -> None:
-        logger.info(
-            f"~ Room {room.get('room_id')} | Slot {slot} | status {status} | user {user} | ID {user_id} | roles {roles}"
+        rooms_logger.info(
+            "~ Room %s | Slot %s | status %s | user %s | ID %s | roles %s",
+            room.get("room_id"),
+            slot,
+            status,
+            user,
+            user_id,
+            roles,
         )
 
-        if user not in room.get("users"):
-            room["users"].append(user)
-        room["check_users"].append(user)
+        diff = room["roster"].add(slot, status, user_id, user, roles)
+
+        if diff:
+            self.apply_roster(room, diff)
+
+    def apply_roster(self, room: dict, diff: RosterDiff) -> None:
+        # one complete !mp settings reply, the queue follows it in one go
+        roster = room["roster"]
+        users = room["users"]
+
+        # also catches users whose join or leave line was missed
+        for user in list(users):
+            if user not in roster:
+                users.discard(user)
+                room["skip"].discard(user)
+
+        for user in roster.users:
+            users.add(user)
+
+        rooms_logger.info(
+            "~ Roster %s | %s players | joined %s | left %s | host %s | teams %s",
+            room.get("room_id"),
+            len(roster),
+            diff.joined,
+            diff.left,
+            diff.host,
+            diff.teams,
+        )
 
-        # remove offline users
-        if len(room["check_users"]) >= room["total_users"]:
-            for user in room["users"]:
-                if user not in room["check_users"]:
-                    room["users"].remove(user)
+    def on_room_notice(self, room: dict, message: str) -> None:
+        pass
 
     def on_players(self, room: dict, players: int) -> None:
-        logger.info(f"~ {players} players")
-        room["total_users"] = players
+        rooms_logger.info("~ %s players", players)
+        diff = room["roster"].begin(players)
+
+        if diff:
+            self.apply_roster(room, diff)
 
     def on_skip(self, room: dict, sender: str) -> None:
         if sender in room.get("skip"):
             return
 
-        room["skip"].append(sender)
-        current_votes = len(room.get("users"))
-        total = round(len(room.get("users")) / 2)
+        room["skip"].add(sender)
+        current_votes = len(room.get("skip"))
+        total = max(round(len(room.get("users")) / 2), 1)
 
         if current_votes >= total or (
-            room.get("bot_mode") == 0
-            and room.get("users")
-            and sender == room.get("users")[0]
+            room.get("bot_mode") == 0 and sender == room.get("users").first()
         ):
+            if room.get("bot_mode") == 1:
+                # the skipped map comes up less often
+                room["beatmaps"].penalize()
+
+                if self.history:
+                    self.history.record(
+                        room_key(room),
+                        room.get("current_beatmap"),
+                        "skipped",
+                        time(),
+                        list(room.get("users")),
+                        len(room.get("skip")),
+                    )
+
             self.on_skip_rotate(room=room)
             return
 
-        self.send_private(
-            room.get("room_id"), f"Skip voting: {current_votes} / {total}"
-        )
+        if self.cooldowns.allow(room_key(room), "!skip"):
+            self.send_private(
+                room.get("room_id"), f"Skip voting: {current_votes} / {total}"
+            )
 
     def on_room_message(self, room: dict, sender: str, message: str) -> None:
-        logger.info(f"~ room {room.get('room_id')} message | {sender}: {message}")
+        protocol_logger.info(
+            "~ room %s message | %s: %s", room.get("room_id"), sender, message
+        )
 
-        if message.startswith("!start"):
-            number = message.split("!start")[-1].strip()
+        if message.startswith("!start") or message == "!stop":
+            # !mp lines skip the chat limits, a player still can't repeat them
+            if self.cooldowns.allow(room_key(room), user=sender):
+                self.send_control(room=room, message=message)
+        elif message == "!skip":
+            self.on_skip(room=room, sender=sender)
+        elif message in chat_commands:
+            if self.cooldowns.allow(room_key(room), message, sender):
+                self.send_reply(room=room, command=message)
 
-            if number.isdigit():
-                self.send_private(room.get("room_id"), f"!mp start {number}")
-            elif message == "!start":
-                self.send_private(room.get("room_id"), "!mp start")
-        elif message == "!stop":
+    def send_control(self, room: dict, message: str) -> None:
+        if message == "!stop":
             self.send_private(room.get("room_id"), "!mp aborttimer")
-        elif message == "!users":
-            self.send_private(
-                room.get("room_id"), f"Users: {', '.join(room.get('users', []))}"
+            return
+
+        number = message.split("!start")[-1].strip()
+
+        if number.isdigit():
+            self.send_private(room.get("room_id"), f"!mp start {number}")
+        elif message == "!start":
+            self.send_private(room.get("room_id"), "!mp start")
+
+    def send_reply(self, room: dict, command: str) -> None:
+        if command == "!users":
+            users = self.response(
+                room,
+                "users",
+                self.users_key(room),
+                lambda room: ", ".join(room["users"]),
             )
-        elif message == "!skip":
-            self.on_skip(room=room, sender=sender)
-        elif message == "!queue":
+            self.send_private(room.get("room_id"), f"Users: {users}")
+        elif command == "!queue":
             self.send_private(
                 room.get("room_id"), f"Queue: {self.get_queue(room=room)}"
             )
-        elif message == "!info":
+        elif command == "!stats":
+            self.send_stats(room=room)
+        elif command == "!top":
+            self.send_top(room=room)
+        elif command == "!info":
             if room.get("bot_mode") == 1:
                 self.send_private(
                     room.get("room_id"),
-                    f"NoHost | {room.get('min')} -> {room.get('max')} | Commands: start <seconds>, stop, queue, skip",
+                    f"NoHost | {room.get('min')} -> {room.get('max')} | Commands: start <seconds>, stop, queue, skip, stats, top",
                 )
 
-    def on_receive(self, data: dict) -> None:
-        type, message = data.get("type"), data.get("message")
+    def send_stats(self, room: dict) -> None:
+        if not self.history:
+            return
 
-        if type == "private":
-            if data.get("sender") == "BanchoBot":
-                if message.startswith("Created the tournament match"):
-                    search_id_name = re.search(
-                        "https://osu.ppy.sh/mp/(\d*)? (.*)", message
-                    )
-                    name, id = search_id_name.group(2), "#mp_" + search_id_name.group(1)
-                    self.on_room_created(room_name=name, room_id=id)
-        elif type == "room":
-            room_id = data.get("room_id")
-            room = self.get_room(room_id=room_id)
-            sender = data.get("sender")
-
-            if not room and not data.get("sender"):
-                return
-
-            if sender == "BanchoBot":
-                logger.debug(f"{room.get('skip')}")
-                logger.info(f"{type}: {message}")
-                if message == "Closed the match":
-                    self.on_room_closed(room=room)
-                elif "joined in slot" in message:
-                    user = self.username_parser(message.split(" joined in slot")[0])
-                    self.on_user_joined(room=room, user=user)
-                elif message.endswith("left the game."):
-                    user = self.username_parser(message.split(" left the game.")[0])
-                    self.on_user_left(room=room, user=user)
-                elif message.endswith(" became the host."):
-                    user = self.username_parser(message.split(" became the host.")[0])
-                    self.on_host_changed(room=room, user=user)
-                elif message == "The match has started!":
-                    self.on_match_started(room=room)
-                elif message == "The match has finished!":
-                    self.on_match_finished(room=room)
-                elif message == "All players are ready":
-                    self.on_match_ready(room=room)
-                elif message.startswith("Beatmap changed to: "):
-                    search = re.search("Beatmap.*?: (.*)? \[(.*?)\] \((.*)?\)", message)
-                    self.on_beatmap_changed_to(
-                        room=room,
-                        version=search.group(2),
-                        title=search.group(1),
-                        url=search.group(3),
-                        beatmap_id=int(search.group(3).split("/")[-1]),
-                    )
-                elif message.startswith("Changed beatmap to "):
-                    if room.get("bot_mode") == 1:
-                        message_split = message.split(" ")
-                        url = message_split[3]
-                        url_split = url.split("/")
-                        beatmap_id = url_split[-1]
-                        title = "".join(message_split[4:])
-                        self.on_changed_beatmap_to(
-                            room=room,
-                            title=title,
-                            beatmap_id=beatmap_id,
-                            url=url,
-                        )
-                elif message.startswith("Slot "):
-                    words = message.split()
-                    slot = words[1]
-                    user_and_roles = url = username = None
-
-                    if words[2] != "Ready":
-                        status = " ".join(words[2:4])
-                        url = words[4]
-                        user_and_roles = " ".join(words[5:])
-                    else:
-                        status = words[2]
-                        url = words[3]
-                        user_and_roles = " ".join(words[4:])
-
-                    username = user_and_roles
-                    roles = None
-                    start_roles_index = user_and_roles.rfind("[")
-
-                    # 50/50 for user who have bracket in name... fvckng names | Fvck REGEX
-                    if user_and_roles[-1] == "]" and start_roles_index != -1:
-                        username = user_and_roles[0 : start_roles_index - 1]
-                        roles = (
-                            user_and_roles[start_roles_index + 1 : -1]
-                            .replace(" ", "")
-                            .split("/")
-                        )
-                        roles = roles[0:-1] + roles[-1].split(",")
-
-                        for role in roles:
-                            if role.strip() not in valid_roles:
-                                username = user_and_roles
-                                roles = None
-                                break
-
-                    username = username.strip().replace(" ", "_")
-                    user_id = url.split("/")[-1]
-
-                    self.on_slot(
-                        room=room,
-                        status=status,
-                        slot=int(slot) if slot.isdigit() else 0,
-                        user_id=int(user_id) if user_id.isdigit() else 0,
-                        user=self.username_parser(username),
-                        roles=roles,
-                    )
-                elif message.startswith("Players: "):
-                    self.on_players(room=room, players=int(message.split(" ")[-1]))
-            else:
-                self.on_room_message(room=room, sender=sender, message=message)
+        matches, players = self.history.room_stats(room_key(room))
+        message = f"Stats | {matches} matches | {players:.1f} players on average"
+        plays, skipped = self.history.map_stats(room.get("current_beatmap"))
+
+        if plays or skipped:
+            message += f" | this map: {plays} plays, {skipped:.0%} skipped"
+
+        self.send_private(room.get("room_id"), message)
+
+    def send_top(self, room: dict) -> None:
+        if not self.history:
+            return
+
+        top = self.response(room, "top", tuple(self.history.top()), self.build_top)
+        self.send_private(room.get("room_id"), f"Most played: {top}")
+
+    def build_top(self, room: dict) -> str:
+        maps = []
+
+        for beatmap_id, plays in self.history.top():
+            # titles from the pool files, when the map is in one
+            beatmapset = self.providers.catalog.lookup(beatmap_id) or {}
+            title = beatmapset.get("title", beatmap_id)
+            maps.append(f"[https://osu.ppy.sh/b/{beatmap_id} {title}] {plays}")
+
+        return ", ".join(maps) or "nothing yet"
+
+    def on_private_message(self, sender: str, message: str) -> None:
+        if message.strip() == "!stats" and sender in self.admins:
+            self.send_private(sender, self.stats_summary())
+
+    def collect_metrics(self) -> list:
+        outbound = self.outbound.stats()
+        rooms = list(self.rooms)
+        pools = [room for room in rooms if room.get("beatmaps")]
+        return [
+            (
+                "osu_outbound_depth",
+                "Lines waiting to be sent",
+                [({}, outbound["depth"])],
+            ),
+            (
+                "osu_outbound_wait_avg_seconds",
+                "Average time a line waited for a send token",
+                [({}, outbound["wait_avg"])],
+            ),
+            (
+                "osu_outbound_wait_max_seconds",
+                "Longest time a line waited for a send token",
+                [({}, outbound["wait_max"])],
+            ),
+            (
+                "osu_outbound_oldest_seconds",
+                "Age of the oldest queued line",
+                [({}, outbound["oldest"])],
+            ),
+            ("osu_outbound_sent", "Lines sent", [({}, outbound["sent"])]),
+            (
+                "osu_outbound_deduplicated",
+                "Chat lines dropped as repeats",
+                [({}, outbound["deduplicated"])],
+            ),
+            (
+                "osu_commands_blocked",
+                "Room commands refused by a cooldown",
+                [({}, self.cooldowns.blocked)],
+            ),
+            (
+                "osu_beatmap_cache",
+                "Beatmap cache counters and size",
+                [({"kind": key}, value) for key, value in self.cache.stats().items()],
+            ),
+            (
+                "osu_room_users",
+                "Users in the room queue",
+                [
+                    ({"room": room.get("name")}, len(room.get("users")))
+                    for room in rooms
+                ],
+            ),
+            (
+                "osu_room_pool_size",
+                "Maps in the room rotation",
+                [({"room": room.get("name")}, len(room["beatmaps"])) for room in pools],
+            ),
+            (
+                "osu_room_pool_position",
+                "Maps played in the current rotation cycle",
+                [
+                    ({"room": room.get("name")}, room["beatmaps"].cursor)
+                    for room in pools
+                ],
+            ),
+            (
+                "osu_room_pool_cycle",
+                "Completed rotation cycles",
+                [
+                    ({"room": room.get("name")}, room["beatmaps"].cycle)
+                    for room in pools
+                ],
+            ),
+        ]
+
+    def stats_summary(self) -> str:
+        now, lines = monotonic(), self.inbound_lines.total()
+        since, lines_before = self.inbound_summary
+        self.inbound_summary = (now, lines)
+        handlers = {
+            labels[0]: self.handler_seconds.summary(*labels)
+            for labels in list(self.handler_seconds.values)
+        }
+        calls = sum(count for count, _, _ in handlers.values())
+        spent = sum(total for _, total, _ in handlers.values())
+        slowest = max(handlers, key=lambda name: handlers[name][2], default="-")
+        fetches, fetch_time, _ = self.fetch_seconds.summary()
+        outbound = self.outbound.stats()
+        return (
+            f"Uptime {(now - self.metrics.started) / 3600:.1f}h"
+            f" | Lines {lines:.0f} ({(lines - lines_before) / max(now - since, 1e-9):.1f}/s)"
+            f" | Handlers {calls} avg {spent / calls * 1000 if calls else 0:.2f}ms"
+            f" slowest {slowest} {handlers.get(slowest, (0, 0, 0))[2] * 1000:.1f}ms"
+            f" | Outbound depth {outbound['depth']} wait max {outbound['wait_max']:.2f}s"
+            f" | Fetches {fetches} avg {fetch_time / fetches if fetches else 0:.2f}s"
+            f" errors {self.fetch_errors.total():.0f}"
+            f" | Reconnects {self.reconnects.total():.0f}"
+        )
+
+    def dispatch(self, handler: str, *args) -> None:
+        start = perf_counter()
+
+        try:
+            getattr(self, handler)(*args)
+        except Exception:
+            self.handler_errors.inc(handler)
+            raise
+
+        self.handler_seconds.observe(perf_counter() - start, handler)
+
+    def on_receive(self, event) -> None:
+        if type(event) is Ping:
+            self.send(f"PONG :{event.token}")
+            return
+
+        if type(event) is Welcome:
+            self.connection.authenticated()
+            return
+
+        if type(event) is AuthFailed:
+            logger.critical(f"~ Authentication failed! | {event.message}")
+            self.close_connection()
+            return
+
+        if type(event) is RoomCreated:
+            self.dispatch("on_room_created", event.room_name, event.room_id)
+            return
+
+        if type(event) is PrivateMessage:
+            self.dispatch("on_private_message", event.sender, event.message)
+            return
+
+        handler = room_handlers.get(type(event))
+
+        if not handler:
+            return
+
+        room = self.get_room(room_id=event.room_id)
+
+        if not room:
+            protocol_logger.warning("~ Unknown room %s | %s", event.room_id, event)
+            return
+
+        if type(event) is not RoomMessage:
+            protocol_logger.info("room: %s", event)
+
+        # event fields after room_id are the handler arguments in order
+        self.dispatch(handler, room, *event[1:])
+        self.save_room(room)
 
     def start(self):
-        buffer = ""
+        while not self.stop:
+            self.run_calls()
 
-        while True:
-            try:
-                if self.stop:
-                    logger.info("~ Program exited")
-                    return
+            if self.connection.state == DISCONNECTED:
+                sleep(self.connection.retry_in())
 
+                if not self.connect():
+                    self.connection.disconnected("connect failed")
+                    continue
+
+            try:
                 self.check_rooms()
-                message = self.receive()
+                self.report_stats()
+                self.check_keepalive()
 
-                if not message:
-                    raise TimeoutError("Disconnected from server")
+                if not self.wait_readable():
+                    continue
 
-                lines = f"{buffer}{message}".split("\n")
+                lines = self.receive()
+            except TimeoutError:
+                # nothing to read, the keepalive decides when the link is dead
+                continue
+            except OSError as err:
+                logger.error(f"~ Connection lost: {err}")
+                self.on_disconnected(err)
+                continue
 
-                for line in lines[0:-1]:
+            self.connection.on_data()
+            self.inbound_lines.inc(value=len(lines))
+
+            for line in lines:
+                # a handler bug is logged, it is not a reason to reconnect
+                try:
                     self.on_receive(self.message_parser(line))
+                except Exception as err:
+                    logger.exception(f"~ Handler error: {err} | {line}")
+
+        logger.info("~ Program exited")
 
-                # unfinished message
-                if lines:
-                    buffer = lines[-1]
-            except Exception as err:
-                logger.error(f"~ App Error error: {err}")
-                self.on_disconnected()
+
+room_handlers = {
+    RoomClosed: "on_room_closed",
+    ChannelMissing: "on_room_closed",
+    UserJoined: "on_user_joined",
+    UserLeft: "on_user_left",
+    HostChanged: "on_host_changed",
+    MatchStarted: "on_match_started",
+    MatchFinished: "on_match_finished",
+    MatchReady: "on_match_ready",
+    BeatmapChangedTo: "on_beatmap_changed_to",
+    ChangedBeatmapTo: "on_changed_beatmap_to",
+    Slot: "on_slot",
+    Players: "on_players",
+    RoomMessage: "on_room_message",
+    RoomNotice: "on_room_notice",
+}
+
+
+def stars_label(ratings: dict, key: str) -> str:
+    return f"{ratings[key]}*" if key == "NM" else f"{ratings[key]}* {key}"
 
 
 def get_config(config="config.json") -> dict:
@@ -665,8 +1249,11 @@ def get_config(config="config.json") -> dict:
     return json.loads(f.read())
 
 
-if __name__ == "__main__":
-    import logging
+def setup_logging(config: dict = None) -> None:
+    if config is not None:
+        # queued, rotated logging with per category levels, see logs.py
+        logs.setup(config)
+        return
 
     logname = f"logs{datetime.now().strftime('%d-%m-%y %H-%M-%S')}.log"
     formatter = "%(asctime)s : %(name)s : %(levelname)s = %(message)s"
@@ -677,19 +1264,44 @@ if __name__ == "__main__":
     )
     ch = logging.StreamHandler()
     ch.setLevel(logging.DEBUG)
-    logger = logging.getLogger("irc.py")
     logger.setLevel(logging.DEBUG)
     logger.addHandler(ch)
 
-    config = get_config()
-    irc = OsuIrc(
+
+def build_bot(config: dict, engine=None) -> "OsuIrc":
+    # one setup from the config keys for both engines and every shard
+    fetcher = BeatmapFetcher(**config.get("http", {}))
+    return (engine or OsuIrc)(
         username=config.get("username"),
         password=config.get("password"),
         rooms=config.get("rooms"),
+        host=config.get("host", "irc.ppy.sh"),
+        port=config.get("port", 6667),
+        rate_limit=config.get("rate_limit", {}),
+        cache=BeatmapCache(**config.get("cache", {})),
+        fetcher=fetcher,
+        admins=config.get("admins", []),
+        state=RoomStateStore(**config.get("state", {})),
+        connection=ConnectionManager(**config.get("connection", {})),
+        lookahead=config.get("lookahead", 3),
+        providers=build_providers(config.get("providers", {}), fetcher),
+        difficulty=DifficultyCalculator(
+            fetcher=fetcher, **config.get("difficulty", {})
+        ),
+        history=MatchHistory(**config.get("history", {})),
     )
 
-    # logger.info(irc.get_beatmap_info(url="https://osu.ppy.sh/b/1745634"))
-    connected = irc.connect()
 
-    if connected:
-        irc.start()
+if __name__ == "__main__":
+    config = get_config()
+    setup_logging(config.get("logging"))
+    irc = build_bot(config)
+    start_metrics(irc.metrics, config.get("metrics", {}))
+
+    if config.get("reload", {}).get("interval", 2):
+        # "reload": {"interval": 2}, 0 turns it off
+        ConfigWatcher(irc, **config.get("reload", {})).start()
+
+    # logger.info(irc.get_beatmap_info(url="https://osu.ppy.sh/b/1745634"))
+    # connects, and reconnects with backoff
+    irc.start()
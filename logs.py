@@ -0,0 +1,141 @@
+import atexit
+import gzip
+import logging
+import os
+import queue
+import shutil
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
+from outbound import TokenBucket
+
+logger = logging.getLogger("irc.py")
+# categories are children of the bot logger, their records end up in its handlers
+categories = {
+    "protocol": logging.getLogger("irc.py.protocol"),  # parsed events, room chat
+    "rooms": logging.getLogger("irc.py.rooms"),  # what the handlers do with them
+}
+formatter = "%(asctime)s : %(name)s : %(levelname)s = %(message)s"
+
+
+class DroppingQueueHandler(QueueHandler):
+    # never blocks the receive loop, a full queue drops the record instead
+
+    def __init__(self, queue) -> None:
+        super().__init__(queue)
+        self.dropped = 0
+
+    def enqueue(self, record) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # only merge the args here, timestamps and the line layout are formatted
+        # by the writer thread
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    # lets `rate` records per second through a category, bursts up to one second
+    # worth. the next record that passes tells how many were left out.
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.bucket = TokenBucket(max(rate, 1), 1.0)
+        self.sampled = 0
+
+    def filter(self, record) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        if not self.bucket.take():
+            self.sampled += 1
+            return False
+
+        if self.sampled:
+            record.msg = f"{record.msg} | {self.sampled} lines sampled out"
+            self.sampled = 0
+
+        return True
+
+
+def gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as f, gzip.open(dest, "wb") as compressed:
+        shutil.copyfileobj(f, compressed)
+
+    os.remove(source)
+
+
+def file_handler(config: dict) -> logging.Handler:
+    filename = config.get("file", "logs/bot.log")
+
+    if os.path.dirname(filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+    if config.get("when"):
+        handler = TimedRotatingFileHandler(
+            filename,
+            when=config.get("when"),
+            backupCount=config.get("backups", 10),
+            encoding="utf-8",
+        )
+    else:
+        handler = RotatingFileHandler(
+            filename,
+            maxBytes=config.get("max_bytes", 10 * 1024 * 1024),
+            backupCount=config.get("backups", 10),
+            encoding="utf-8",
+        )
+
+    if config.get("compress", True):
+        handler.namer = lambda name: name + ".gz"
+        handler.rotator = gzip_rotator
+
+    return handler
+
+
+def set_levels(config: dict) -> None:
+    # "levels": {"protocol": "WARNING", "rooms": "INFO"}, "sample": {"protocol": 50}
+    logger.setLevel(config.get("level", "INFO"))
+
+    for name, level in config.get("levels", {}).items():
+        categories[name].setLevel(level)
+
+    for name, rate in config.get("sample", {}).items():
+        categories[name].addFilter(SamplingFilter(rate))
+
+
+def setup(config: dict) -> QueueListener:
+    # records are queued by the bot threads, formatted and written by one
+    # background thread. returns the started listener.
+    set_levels(config)
+    handlers = [file_handler(config)]
+
+    if config.get("console", "INFO"):
+        console = logging.StreamHandler()
+        console.setLevel(config.get("console", "INFO"))
+        handlers.append(console)
+
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(formatter))
+
+    records = queue.Queue(config.get("queue_size", 10000))
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    logger.handlers = [DroppingQueueHandler(records)]
+    logger.propagate = False
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,254 @@
+import bisect
+import cProfile
+import logging
+import pstats
+import signal
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+
+logger = logging.getLogger("irc.py")
+
+# seconds, from a fast handler up to a slow http fetch
+default_buckets = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    10.0,
+)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def label_text(names: tuple, values: tuple, extra="") -> str:
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+
+    if extra:
+        labels.append(extra)
+
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}  # label values -> count
+
+    def inc(self, *labels, value=1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{label_text(self.labels, labels)} {value}")
+
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self, name: str, help: str, labels=(), buckets=default_buckets
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # label values -> [count per bucket..., +Inf, count, sum, max]
+        self.values = {}
+
+    def observe(self, value: float, *labels) -> None:
+        # counts are per bucket here, cumulative when rendered
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            series = self.values.get(labels)
+
+            if series is None:
+                series = self.values[labels] = [0] * (len(self.buckets) + 2) + [
+                    0.0,
+                    0.0,
+                ]
+
+            series[index] += 1
+            series[-3] += 1
+            series[-2] += value
+
+            if value > series[-1]:
+                series[-1] = value
+
+    def summary(self, *labels) -> tuple:
+        # return: (count, sum, max)
+        with self.lock:
+            series = self.values.get(labels)
+            return tuple(series[-3:]) if series else (0, 0.0, 0.0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+
+        with self.lock:
+            for labels, series in sorted(self.values.items()):
+                cumulative = 0
+
+                for bucket, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = label_text(self.labels, labels, f'le="{bucket}"')
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+
+                le = label_text(self.labels, labels, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{le} {series[-3]}")
+                text = label_text(self.labels, labels)
+                lines.append(f"{self.name}_count{text} {series[-3]}")
+                lines.append(f"{self.name}_sum{text} {series[-2]}")
+
+        return lines
+
+
+class Metrics:
+    # counters and histograms updated in place, gauges read from collectors at
+    # scrape time so the hot path never pays for them
+
+    def __init__(self) -> None:
+        self.metrics = []
+        self.collectors = []
+        self.started = monotonic()
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(
+        self, name: str, help: str, labels=(), buckets=default_buckets
+    ) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self, collector) -> None:
+        # collector() returns [(name, help, [(labels dict, value), ...]), ...] gauges
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+
+        for metric in self.metrics:
+            lines += metric.render()
+
+        for collector in self.collectors:
+            for name, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} gauge")
+
+                for labels, value in samples:
+                    text = label_text(tuple(labels), tuple(labels.values()))
+                    lines.append(f"{name}{text} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    # /metrics in the prometheus text format, meant for localhost
+
+    def __init__(self, metrics: Metrics, host="127.0.0.1", port=9100) -> None:
+        self.metrics = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler) -> None:
+                if handler.path.split("?")[0] != "/metrics":
+                    handler.send_error(404)
+                    return
+
+                body = metrics.render().encode()
+                handler.send_response(200)
+                handler.send_header("Content-Type", "text/plain; version=0.0.4")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args) -> None:
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, name="osu-metrics", daemon=True
+        )
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        logger.info(f"~ Metrics on http://{host}:{port}/metrics")
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Profiler:
+    # the first signal starts a cProfile run, the next one stops it and dumps the
+    # pstats snapshot next to the logs
+
+    def __init__(self, prefix="profile") -> None:
+        self.prefix = prefix
+        self.profile = None
+
+    def toggle(self, signum=None, frame=None) -> None:
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            logger.info("~ Profiler started")
+            return
+
+        self.profile.disable()
+        filename = (
+            f"{self.prefix}-{datetime.now().strftime('%d-%m-%y %H-%M-%S')}.pstats"
+        )
+        self.profile.dump_stats(filename)
+        stats = pstats.Stats(self.profile).sort_stats("cumulative")
+        self.profile = None
+        top = [
+            f"{func[2]} {func[0]}:{func[1]} {stat[3]:.3f}s"
+            for func, stat in sorted(
+                stats.stats.items(), key=lambda item: item[1][3], reverse=True
+            )[:10]
+        ]
+        logger.info(f"~ Profile saved to {filename} | {' | '.join(top)}")
+
+    def install(self, signal_name="SIGUSR1") -> None:
+        signal.signal(getattr(signal, signal_name), self.toggle)
+        logger.info(f"~ Profiler toggles on {signal_name}")
+
+
+def start_metrics(metrics: Metrics, config: dict) -> MetricsServer | None:
+    # "metrics": {"port": 9100, "host": "127.0.0.1", "profile_signal": "SIGUSR1"}
+    if config.get("profile_signal"):
+        Profiler().install(config.get("profile_signal"))
+
+    if not config.get("port"):
+        return None
+
+    server = MetricsServer(
+        metrics, host=config.get("host", "127.0.0.1"), port=config.get("port")
+    )
+    server.start()
+    return server
@@ -0,0 +1,284 @@
+import threading
+from collections import OrderedDict, deque
+from time import monotonic
+
+# lower value is sent first
+PRIORITY_SERVER = 0  # PASS, NICK, JOIN, PONG
+PRIORITY_CONTROL = 1  # !mp host / map / start, keeps the rooms moving
+PRIORITY_SETTINGS = 2  # other !mp commands and mp make
+PRIORITY_CHAT = 3  # queue, links, skip votes...
+
+control_commands = {"host", "map", "start", "abort", "aborttimer", "timer", "close"}
+# a newer line with the same room + key replaces the queued one. start and
+# aborttimer share one, the latest of the two is what the player asked for
+coalesce_commands = {
+    "host": "host",
+    "map": "map",
+    "start": "timer",
+    "aborttimer": "timer",
+    "settings": "settings",
+}
+
+
+class TokenBucket:
+    def __init__(self, messages: int, seconds: float, clock=monotonic) -> None:
+        self.capacity = float(messages)
+        self.rate = messages / seconds
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        self.refill()
+
+        if self.tokens >= 1:
+            return 0.0
+
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> bool:
+        if self.wait_time() > 0:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+def classify(message: str) -> tuple:
+    # return: (priority, room, coalesce key)
+    if not message.startswith("PRIVMSG "):
+        return PRIORITY_SERVER, None, None
+
+    target, _, text = message[8:].partition(" :")
+    text = text.strip()
+
+    if not text.startswith("!mp "):
+        if text.startswith("mp "):
+            return PRIORITY_SETTINGS, target, None
+        return PRIORITY_CHAT, target, None
+
+    command = text[4:].split(" ", 1)[0]
+    key = (target, coalesce_commands[command]) if command in coalesce_commands else None
+
+    if command in control_commands:
+        return PRIORITY_CONTROL, target, key
+
+    return PRIORITY_SETTINGS, target, key
+
+
+class Cooldowns:
+    # last allowed use of a command per room, and of any command per user in a
+    # room. checked before a reply is built, a refused command sends nothing.
+
+    def __init__(self, room=10.0, user=5.0, clock=monotonic) -> None:
+        self.room = room
+        self.user = user
+        self.clock = clock
+        self.used = {}  # (room, command) | (room, None, user) -> last use
+        self.blocked = 0
+
+    def allow(self, room, command: str = None, user: str = None) -> bool:
+        # without a command only the user cooldown applies
+        now = self.clock()
+        keys = [((room, command), self.room)] if command else []
+
+        if user:
+            keys.append(((room, None, user), self.user))
+
+        for key, cooldown in keys:
+            if now - self.used.get(key, -cooldown) < cooldown:
+                self.blocked += 1
+                return False
+
+        if len(self.used) > 4096:
+            # forget the expired ones
+            longest = max(self.room, self.user)
+            self.used = {
+                key: used for key, used in self.used.items() if now - used < longest
+            }
+
+        for key, _ in keys:
+            self.used[key] = now
+
+        return True
+
+
+class OutboundScheduler:
+    # token bucket shared by the connection, one fair (round robin) queue per room
+    # for every priority level. thread safe. chat never takes the last `reserve`
+    # tokens, and a chat line already sent within `dedup` seconds is dropped.
+
+    def __init__(
+        self, messages=10, seconds=5.0, dedup=10.0, reserve=2, clock=monotonic
+    ) -> None:
+        self.clock = clock
+        self.bucket = TokenBucket(messages, seconds, clock=clock)
+        self.dedup = dedup
+        self.reserve = min(reserve, messages - 1)
+        self.recent = OrderedDict()  # chat line -> time put
+        self.lock = threading.Condition()
+        self.queues = [OrderedDict() for _ in range(PRIORITY_CHAT + 1)]
+        self.pending = {}
+        self.depth = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.deduplicated = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.on_put = None
+
+    def put(self, message: str) -> None:
+        priority, room, key = classify(message)
+
+        with self.lock:
+            if priority == PRIORITY_CHAT and self.duplicate(message):
+                self.deduplicated += 1
+                return
+
+            entry = self.pending.get(key) if key else None
+
+            if entry:
+                # superseded, keep the queue position of the older line
+                entry[0] = message
+                self.coalesced += 1
+                return
+
+            entry = [message, self.clock(), key]
+            self.queues[priority].setdefault(room, deque()).append(entry)
+            self.depth += 1
+
+            if key:
+                self.pending[key] = entry
+
+            self.lock.notify()
+
+        if self.on_put:
+            self.on_put()
+
+    def duplicate(self, message: str) -> bool:
+        now = self.clock()
+
+        while self.recent:
+            line, put = next(iter(self.recent.items()))
+
+            if now - put < self.dedup:
+                break
+
+            del self.recent[line]
+
+        if message in self.recent:
+            return True
+
+        self.recent[message] = now
+        return False
+
+    def clear(self) -> None:
+        with self.lock:
+            for queue in self.queues:
+                queue.clear()
+
+            self.pending.clear()
+            self.depth = 0
+
+    def pop(self) -> tuple:
+        # return: (message, None) | (None, seconds until a token) | (None, None) if empty
+        with self.lock:
+            if not self.depth:
+                return None, None
+
+            wait = self.bucket.wait_time()
+
+            if wait > 0:
+                return None, wait
+
+            for priority, queue in enumerate(self.queues):
+                if not queue:
+                    continue
+
+                if priority == PRIORITY_CHAT and self.bucket.tokens < 1 + self.reserve:
+                    # only chat is left, the reserve stays for control lines
+                    return (
+                        None,
+                        (1 + self.reserve - self.bucket.tokens) / self.bucket.rate,
+                    )
+
+                room, messages = next(iter(queue.items()))
+                entry = messages.popleft()
+
+                if messages:
+                    queue.move_to_end(room)
+                else:
+                    del queue[room]
+
+                if entry[2]:
+                    self.pending.pop(entry[2], None)
+
+                self.bucket.take()
+                self.depth -= 1
+                self.sent += 1
+                waited = self.clock() - entry[1]
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+                return entry[0], None
+
+            return None, None
+
+    def get(self, timeout=None) -> str | None:
+        # blocking pop for the socket writer thread
+        deadline = None if timeout is None else self.clock() + timeout
+
+        with self.lock:
+            while True:
+                message, wait = self.pop()
+
+                if message:
+                    return message
+
+                if deadline is not None:
+                    remaining = deadline - self.clock()
+
+                    if remaining <= 0:
+                        return None
+
+                    wait = remaining if wait is None else min(wait, remaining)
+
+                self.lock.wait(wait)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "depth": self.depth,
+                "depth_by_priority": [
+                    sum(len(messages) for messages in queue.values())
+                    for queue in self.queues
+                ],
+                "rooms": len(set().union(*self.queues)),
+                "sent": self.sent,
+                "coalesced": self.coalesced,
+                "deduplicated": self.deduplicated,
+                "wait_avg": self.wait_total / self.sent if self.sent else 0.0,
+                "wait_max": self.wait_max,
+                "oldest": max(
+                    (
+                        self.clock() - messages[0][1]
+                        for queue in self.queues
+                        for messages in queue.values()
+                    ),
+                    default=0.0,
+                ),
+            }
+
+    def readout(self) -> str:
+        stats = self.stats()
+        return (
+            f"depth {stats['depth']} {stats['depth_by_priority']} | rooms {stats['rooms']}"
+            f" | sent {stats['sent']} | coalesced {stats['coalesced']}"
+            f" | deduplicated {stats['deduplicated']}"
+            f" | wait avg {stats['wait_avg']:.2f}s max {stats['wait_max']:.2f}s"
+            f" | oldest {stats['oldest']:.2f}s"
+        )
@@ -0,0 +1,312 @@
+import re
+from typing import NamedTuple
+
+valid_roles = frozenset(
+    [
+        "Host",
+        "TeamBlue",
+        "TeamRed",
+        "Hidden",
+        "HardRock",
+        "SuddenDeath",
+        "Perfect",
+        "Flashlight",
+        "SpunOut",
+        "NoFail",
+        "Easy",
+        "HalfTime",
+        "DoubleTime",
+        "Nightcore",
+        "FadeIn",
+        "Mirror",
+        "Relax",
+        "Relax2",
+        "ScoreV2",
+        "TouchDevice",
+    ]
+)
+
+created_pattern = re.compile(
+    r"Created the tournament match https://osu\.ppy\.sh/mp/(\d+) (.*)"
+)
+slot_pattern = re.compile(r"Slot (\d+) +(Not Ready|No Map|Ready|\S+) +\S*?(\d*) ")
+beatmap_changed_pattern = re.compile(r"Beatmap changed to: (.*) \[(.*?)\] \((.*)\)")
+
+
+# every room event starts with room_id, the other fields are passed in order to
+# the matching OsuIrc.on_* handler
+class RoomClosed(NamedTuple):
+    room_id: str
+
+
+class ChannelMissing(NamedTuple):
+    # JOIN of a #mp_ channel that is gone, "403 ... No such channel"
+    room_id: str
+
+
+class UserJoined(NamedTuple):
+    room_id: str
+    user: str
+
+
+class UserLeft(NamedTuple):
+    room_id: str
+    user: str
+
+
+class HostChanged(NamedTuple):
+    room_id: str
+    user: str
+
+
+class MatchStarted(NamedTuple):
+    room_id: str
+
+
+class MatchFinished(NamedTuple):
+    room_id: str
+
+
+class MatchReady(NamedTuple):
+    room_id: str
+
+
+class BeatmapChangedTo(NamedTuple):
+    room_id: str
+    title: str
+    version: str
+    url: str
+    beatmap_id: int
+
+
+class ChangedBeatmapTo(NamedTuple):
+    room_id: str
+    title: str
+    url: str
+    beatmap_id: int
+
+
+class Slot(NamedTuple):
+    room_id: str
+    slot: int
+    status: str
+    user_id: int
+    user: str
+    roles: list | None
+
+
+class Players(NamedTuple):
+    room_id: str
+    players: int
+
+
+class RoomMessage(NamedTuple):
+    room_id: str
+    sender: str
+    message: str
+
+
+class RoomNotice(NamedTuple):
+    # BanchoBot room line without a handler
+    room_id: str
+    message: str
+
+
+class RoomCreated(NamedTuple):
+    room_name: str
+    room_id: str
+
+
+class Welcome(NamedTuple):
+    # 001, the server accepted PASS/NICK
+    nick: str
+
+
+class AuthFailed(NamedTuple):
+    # 464, bad irc password
+    message: str
+
+
+class PrivateMessage(NamedTuple):
+    sender: str
+    message: str
+
+
+class ServerMessage(NamedTuple):
+    message: str
+
+
+class Ping(NamedTuple):
+    token: str
+
+
+def username_parser(username: str) -> str:
+    return username.strip().replace(" ", "_")
+
+
+def url_id(url: str) -> int:
+    tail = url.rsplit("/", 1)[-1]
+    return int(tail) if tail.isdigit() else 0
+
+
+def parse_slot(room_id: str, message: str):
+    match = slot_pattern.match(message)
+
+    if not match:
+        return None
+
+    slot, status, user_id = match.groups()
+    username = message[match.end() :].rstrip()
+    roles = None
+
+    # a trailing " [...]" is only roles if every entry is a known role,
+    # otherwise it is part of the username
+    if username.endswith("]"):
+        start = username.rfind("[")
+
+        if start > 0 and username[start - 1] == " ":
+            candidates = (
+                username[start + 1 : -1].replace(" ", "").replace("/", ",").split(",")
+            )
+
+            if valid_roles.issuperset(candidates):
+                username, roles = username[:start], candidates
+
+    return Slot(
+        room_id,
+        int(slot),
+        status,
+        int(user_id) if user_id else 0,
+        username_parser(username),
+        roles,
+    )
+
+
+def parse_players(room_id: str, message: str):
+    if message.startswith("Players: ") and message[9:].isdigit():
+        return Players(room_id, int(message[9:]))
+
+
+def parse_beatmap_changed(room_id: str, message: str):
+    match = beatmap_changed_pattern.fullmatch(message)
+
+    if not match:
+        return None
+
+    title, version, url = match.groups()
+    return BeatmapChangedTo(room_id, title, version, url, url_id(url))
+
+
+def parse_changed_beatmap(room_id: str, message: str):
+    if not message.startswith("Changed beatmap to "):
+        return None
+
+    url, _, title = message[19:].partition(" ")
+    return ChangedBeatmapTo(room_id, title, url, url_id(url))
+
+
+bancho_room_prefix = ":BanchoBot!cho@ppy.sh PRIVMSG #mp_"
+exact_events = {
+    "Closed the match": RoomClosed,
+    "The match has started!": MatchStarted,
+    "The match has finished!": MatchFinished,
+    "All players are ready": MatchReady,
+}
+# first word of the line -> parser, None if the line doesn't match after all
+prefix_parsers = {
+    "Slot": parse_slot,
+    "Players:": parse_players,
+    "Beatmap": parse_beatmap_changed,
+    "Changed": parse_changed_beatmap,
+}
+# username first, tried when nothing else matched
+suffix_events = (
+    (" left the game.", UserLeft),
+    (" became the host.", HostChanged),
+)
+
+
+def parse_bancho_room(room_id: str, message: str):
+    event = exact_events.get(message)
+
+    if event:
+        return event(room_id)
+
+    parser = prefix_parsers.get(message[: message.find(" ")])
+
+    if parser:
+        event = parser(room_id, message)
+
+        if event:
+            return event
+
+    for suffix, event in suffix_events:
+        if message.endswith(suffix):
+            return event(room_id, username_parser(message[: -len(suffix)]))
+
+    # "user joined in slot 3." or "user joined in slot 3 for team red."
+    joined = message.rfind(" joined in slot ")
+
+    if joined > 0:
+        return UserJoined(room_id, username_parser(message[:joined]))
+
+    return RoomNotice(room_id, message)
+
+
+def parse(line: str):
+    # ":sender!cho@ppy.sh PRIVMSG target :message", everything else is server talk
+    if line.startswith(bancho_room_prefix):
+        # most of the traffic, skip the generic envelope parsing
+        target_end = line.find(" :", len(bancho_room_prefix))
+
+        if target_end != -1:
+            return parse_bancho_room(line[30:target_end], line[target_end + 2 :])
+
+    if not line.startswith(":"):
+        if line.startswith("PING"):
+            return Ping(line[5:].lstrip(":"))
+
+        return ServerMessage(line)
+
+    space = line.find(" ")
+
+    if line.startswith(" 001 ", space):
+        return Welcome(line.split(" ", 3)[2])
+
+    if line.startswith(" 464 ", space):
+        return AuthFailed(line.partition(" :")[2])
+
+    if line.startswith(" 403 ", space):
+        # ":cho.ppy.sh 403 nick #mp_1 :No such channel #mp_1"
+        words = line.split(" ", 4)
+
+        if len(words) > 3 and words[3].startswith("#mp_"):
+            return ChannelMissing(words[3])
+
+    if space == -1 or not line.startswith("PRIVMSG ", space + 1):
+        return ServerMessage(line)
+
+    target_end = line.find(" :", space + 9)
+
+    if target_end == -1:
+        return ServerMessage(line)
+
+    bang = line.find("!", 1, space)
+    # irc nicks never contain spaces
+    sender = line[1 : space if bang == -1 else bang]
+    target = line[space + 9 : target_end]
+    message = line[target_end + 2 :]
+
+    if target.startswith("#mp_"):
+        if sender == "BanchoBot":
+            return parse_bancho_room(target, message)
+
+        return RoomMessage(target, sender, message)
+
+    if sender == "BanchoBot":
+        match = created_pattern.match(message)
+
+        if match:
+            return RoomCreated(match.group(2), "#mp_" + match.group(1))
+
+    return PrivateMessage(sender, message)
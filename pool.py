@@ -0,0 +1,239 @@
+import json
+import random
+import sys
+import threading
+from array import array
+
+# one pool per file, shared by every room that uses it
+pools = {}
+pools_lock = threading.Lock()
+
+
+def iter_json_array(f, chunk_size=64 * 1024):
+    # yield the items of a top level json array without reading the whole file
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+
+    while True:
+        chunk = f.read(chunk_size)
+        buffer += chunk
+        pos = 0
+
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+
+            if pos >= len(buffer):
+                break
+
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("beatmap pool must be a json array")
+                started = True
+                pos += 1
+                continue
+
+            if buffer[pos] == "]":
+                return
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.decoder.JSONDecodeError:
+                if not chunk:
+                    raise
+                break
+
+            if end == len(buffer) and chunk:
+                # a number may go on in the next chunk
+                break
+
+            pos = end
+            yield item
+
+        buffer = buffer[pos:]
+
+        if not chunk:
+            if buffer.strip() or started:
+                # no closing ]
+                raise ValueError("unexpected end of beatmap pool")
+            return
+
+
+class Beatmap:
+    # lightweight view of one pool row, reads like the old beatmap dicts
+    __slots__ = ("pool", "index")
+
+    def __init__(self, pool, index: int) -> None:
+        self.pool = pool
+        self.index = index
+
+    def get(self, key: str, default=None):
+        column = self.pool.columns.get(key)
+
+        if column is None:
+            return default
+
+        return column[self.index]
+
+    def __getitem__(self, key: str):
+        return self.pool.columns[key][self.index]
+
+    def to_dict(self) -> dict:
+        return {key: column[self.index] for key, column in self.pool.columns.items()}
+
+    def __repr__(self) -> str:
+        return f"Beatmap({self.get('beatmap_id')}, {self.get('title')!r})"
+
+
+class BeatmapPool:
+    # column store: numbers in typed arrays, strings interned in lists
+
+    def __init__(self, filename=None) -> None:
+        self.filename = filename
+        self.columns = {}
+        self.size = 0
+        # rows found deleted or not downloadable, skipped by every room
+        self.dead = set()
+
+    def append(self, item: dict) -> None:
+        for key in item.keys() - self.columns.keys():
+            # key missing in the previous rows
+            self.columns[key] = [None] * self.size
+
+        for key, column in self.columns.items():
+            value = item.get(key)
+            number = isinstance(value, (int, float)) and not isinstance(value, bool)
+
+            if isinstance(column, array):
+                if not number:
+                    column = self.columns[key] = list(column)
+                elif column.typecode == "q" and isinstance(value, float):
+                    column = self.columns[key] = array("d", column)
+            elif number and not self.size:
+                column = self.columns[key] = array(
+                    "d" if isinstance(value, float) else "q"
+                )
+
+            if isinstance(value, str):
+                value = sys.intern(value)
+
+            column.append(value)
+
+        self.size += 1
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index: int) -> Beatmap:
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+
+        return Beatmap(self, index)
+
+    def __iter__(self):
+        return (Beatmap(self, index) for index in range(self.size))
+
+    @classmethod
+    def load(cls, filename: str, chunk_size=64 * 1024):
+        pool = cls(filename=filename)
+
+        with open(filename, "r", encoding="utf-8") as f:
+            for item in iter_json_array(f, chunk_size=chunk_size):
+                pool.append(item)
+
+        return pool
+
+
+def pool_path(room: dict) -> str:
+    return "beatmapsets/" + room.get("beatmapset_filename")
+
+
+def replace_pool(filename: str, pool: BeatmapPool) -> None:
+    # a reloaded file, rooms keep their cursors on the old pool until swapped
+    with pools_lock:
+        pools[filename] = pool
+
+
+def load_pool(filename: str) -> BeatmapPool:
+    with pools_lock:
+        if filename not in pools:
+            pools[filename] = BeatmapPool.load(filename)
+
+        return pools[filename]
+
+
+class PoolCursor:
+    # a room's own shuffled order over a shared pool. advancing is O(1), the order
+    # is reshuffled once per full cycle instead of being rotated by copies.
+
+    def __init__(self, pool: BeatmapPool, indices=None, seed=None) -> None:
+        self.pool = pool
+        self.indices = array("I", range(len(pool)) if indices is None else indices)
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.cycle = 0
+        self.cursor = 0
+        self.shuffle()
+
+    def shuffle(self) -> None:
+        # the order of a cycle only depends on seed and cycle
+        self.order = array("I", self.indices)
+        random.Random(f"{self.seed}-{self.cycle}").shuffle(self.order)
+
+    def state(self) -> dict:
+        return {"seed": self.seed, "cycle": self.cycle, "cursor": self.cursor}
+
+    def restore(self, seed: int, cycle=0, cursor=0, **weighted) -> None:
+        self.seed = seed
+        self.cycle = cycle
+        self.shuffle()
+        # the pool may have changed size since the state was saved
+        self.cursor = cursor if cursor < len(self.order) else 0
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __bool__(self) -> bool:
+        return bool(self.order)
+
+    def penalize(self, factor: float = None) -> None:
+        # a fixed order has no weights to lower
+        pass
+
+    def current(self) -> Beatmap:
+        if self.pool.dead:
+            self.skip_dead()
+
+        return self.pool[self.order[self.cursor]]
+
+    def skip_dead(self) -> None:
+        # at most one full cycle, in case every map is dead
+        for _ in range(len(self.order)):
+            if self.order[self.cursor] not in self.pool.dead:
+                return
+
+            self.advance()
+
+    def advance(self) -> None:
+        self.cursor += 1
+
+        if self.cursor >= len(self.order):
+            self.cycle += 1
+            self.cursor = 0
+            self.shuffle()
+
+    def peek(self, count: int) -> list:
+        size = len(self.order)
+        dead = self.pool.dead
+        beatmaps = []
+
+        for offset in range(size):
+            if len(beatmaps) >= count:
+                break
+
+            index = self.order[(self.cursor + offset) % size]
+
+            if index not in dead:
+                beatmaps.append(self.pool[index])
+
+        return beatmaps
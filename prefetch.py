@@ -0,0 +1,100 @@
+import logging
+import threading
+from collections import OrderedDict
+from fetcher import BeatmapError
+
+logger = logging.getLogger("irc.py")
+
+# the page answered, the map is gone for good
+dead_errors = {"NotSubmitted"}
+
+
+class Prefetcher:
+    # checks the next maps of every auto pick room in the http pool. dead or
+    # not downloadable maps are dropped from the shared pool before their turn,
+    # the links message of the good ones is rendered so a map change never
+    # waits on the network.
+
+    def __init__(self, bot, lookahead=3, size=1024) -> None:
+        self.bot = bot
+        self.lookahead = lookahead
+        self.size = size
+        self.lock = threading.Lock()
+        self.links = OrderedDict()  # beatmap id -> "Links: ..." message
+        self.pending = set()
+        self.validated = self.evicted = self.failed = self.used = 0
+
+    def refill(self, room: dict) -> None:
+        beatmaps = room.get("beatmaps")
+
+        if not self.lookahead or not beatmaps:
+            return
+
+        # current() is the next map to be picked
+        for beatmap in beatmaps.peek(self.lookahead + 1):
+            beatmap_id = beatmap.get("beatmap_id")
+
+            with self.lock:
+                if beatmap_id in self.links or beatmap_id in self.pending:
+                    continue
+
+                self.pending.add(beatmap_id)
+
+            self.bot.fetcher.submit(self.validate, beatmap=beatmap)
+
+    def validate(self, beatmap) -> None:
+        beatmap_id = beatmap.get("beatmap_id")
+
+        try:
+            # past the catalog, it can't tell a map deleted since the dump
+            data = self.bot.fetch_beatmapset(
+                url=f"https://osu.ppy.sh/b/{beatmap_id}", local=False
+            )
+
+            if data.get("availability", {}).get("download_disabled"):
+                self.evict(beatmap, "download disabled")
+            elif not any(item.get("id") == beatmap_id for item in data.get("beatmaps")):
+                self.evict(beatmap, "not in its beatmapset")
+            else:
+                title = f"{data.get('artist')} - {data.get('title')}"
+                self.store(
+                    beatmap_id, f"Links: {self.bot.links(title, data.get('id'))}"
+                )
+        except BeatmapError as err:
+            if err.error in dead_errors:
+                self.evict(beatmap, err.message)
+            else:
+                # network trouble, tried again on the next refill
+                self.failed += 1
+        finally:
+            with self.lock:
+                self.pending.discard(beatmap_id)
+
+    def store(self, beatmap_id: int, links: str) -> None:
+        with self.lock:
+            self.links[beatmap_id] = links
+            self.links.move_to_end(beatmap_id)
+            self.validated += 1
+
+            while len(self.links) > self.size:
+                self.links.popitem(last=False)
+
+    def evict(self, beatmap, reason: str) -> None:
+        beatmap.pool.dead.add(beatmap.index)
+        self.evicted += 1
+        logger.warning(f"~ Dropped beatmap {beatmap.get('beatmap_id')} | {reason}")
+
+    def links_for(self, beatmap_id: int) -> str | None:
+        with self.lock:
+            links = self.links.get(beatmap_id)
+
+        if links:
+            self.used += 1
+
+        return links
+
+    def readout(self) -> str:
+        return (
+            f"validated {self.validated} | used {self.used} | evicted {self.evicted}"
+            f" | failed {self.failed} | pending {len(self.pending)}"
+        )
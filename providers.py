@@ -0,0 +1,252 @@
+import logging
+import threading
+from time import monotonic
+from catalog import BeatmapCatalog, load_catalog
+from fetcher import BeatmapError, BeatmapFetcher
+
+logger = logging.getLogger("irc.py")
+
+# beatmap_status of the dumps, as named by osu!
+statuses = {
+    -2: "graveyard",
+    -1: "wip",
+    0: "pending",
+    1: "ranked",
+    2: "approved",
+    3: "qualified",
+    4: "loved",
+}
+rating_prefix = "difficulty_"
+api_url = "https://osu.ppy.sh/api/v2"
+token_url = "https://osu.ppy.sh/oauth/token"
+
+
+class CatalogProvider:
+    # answers from the pool and dump files already in memory, indexed by beatmap
+    # id. the dumps don't know about download_disabled, their maps count as
+    # available.
+    remote = False
+    name = "catalog"
+
+    def __init__(self, filenames=()) -> None:
+        self.catalogs = {}  # filename -> catalog
+        self.lock = threading.Lock()
+
+        for filename in filenames:
+            self.add(filename)
+
+    def add(self, filename: str) -> None:
+        # again after a reload, the file now has a new catalog
+        catalog = load_catalog(filename)
+
+        with self.lock:
+            self.catalogs[filename] = catalog
+
+    def find(self, catalog: BeatmapCatalog, attribute: str, value: int) -> list:
+        index = catalog.index(attribute)
+
+        if not index:
+            return []
+
+        start, end = index.span(value, value)
+        return [row for row in index.rows[start:end] if row not in catalog.pool.dead]
+
+    def lookup(self, beatmap_id: int) -> dict | None:
+        for catalog in list(self.catalogs.values()):
+            rows = self.find(catalog, "beatmap_id", beatmap_id)
+
+            if rows:
+                return self.beatmapset(catalog, rows[0])
+
+        return None
+
+    def beatmapset(self, catalog: BeatmapCatalog, row: int) -> dict:
+        # same shape as the json the osu! page embeds
+        beatmap = catalog.pool[row]
+        rows = self.find(catalog, "beatmapset_id", beatmap.get("beatmapset_id")) or [
+            row
+        ]
+        return {
+            "id": beatmap.get("beatmapset_id"),
+            "artist": beatmap.get("artist"),
+            "title": beatmap.get("title"),
+            "creator": beatmap.get("mapper"),
+            "status": statuses.get(beatmap.get("beatmap_status")),
+            "availability": {"download_disabled": False, "more_information": None},
+            "beatmaps": [self.beatmap(catalog.pool[row]) for row in rows],
+        }
+
+    def beatmap(self, beatmap) -> dict:
+        beatmap_id = beatmap.get("beatmap_id")
+        return {
+            "id": beatmap_id,
+            "version": beatmap.get("difficulty_name"),
+            "difficulty_rating": round(beatmap.get("difficulty"), 2),
+            "status": statuses.get(beatmap.get("beatmap_status")),
+            "mode": beatmap.get("gamemode"),
+            "cs": beatmap.get("difficulty_cs"),
+            "ar": beatmap.get("difficulty_ar"),
+            "accuracy": beatmap.get("difficulty_od"),
+            "drain": beatmap.get("difficulty_hp"),
+            "bpm": beatmap.get("bpm"),
+            "total_length": beatmap.get("total_length"),
+            "url": f"https://osu.ppy.sh/beatmaps/{beatmap_id}",
+            "mod_ratings": self.mod_ratings(beatmap),
+        }
+
+    def mod_ratings(self, beatmap) -> dict:
+        # the difficulty_<mods> columns written by difficulty.py
+        ratings = {}
+
+        for column in beatmap.pool.columns:
+            key = column[len(rating_prefix) :]
+
+            if column.startswith(rating_prefix) and key.isupper():
+                stars = beatmap.get(column)
+
+                if stars is not None:
+                    ratings[key] = stars
+
+        return ratings
+
+
+class ScrapeProvider:
+    # the beatmapset json embedded in the osu.ppy.sh/b/<id> page
+    remote = True
+    name = "scrape"
+
+    def __init__(self, fetcher: BeatmapFetcher) -> None:
+        self.fetcher = fetcher
+
+    def lookup(self, beatmap_id: int) -> dict:
+        return self.fetcher.fetch_beatmapset(url=f"https://osu.ppy.sh/b/{beatmap_id}")
+
+
+class ApiProvider:
+    # osu! api v2 with a client credentials token, one request per lookup
+    remote = True
+    name = "api"
+
+    def __init__(
+        self, fetcher: BeatmapFetcher, client_id: int, client_secret: str
+    ) -> None:
+        self.fetcher = fetcher
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.lock = threading.Lock()
+        self.token = None
+        self.expires = 0.0
+
+    def authorize(self) -> str:
+        with self.lock:
+            if self.token and monotonic() < self.expires:
+                return self.token
+
+            response = self.fetcher.request(
+                "POST",
+                token_url,
+                data={
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                    "grant_type": "client_credentials",
+                    "scope": "public",
+                },
+            )
+
+            if not response.ok:
+                raise BeatmapError(
+                    f"Api token refused ({response.status_code})", "HttpError"
+                )
+
+            data = self.decode(response)
+            self.token = data.get("access_token")
+            # renewed a minute early
+            self.expires = monotonic() + data.get("expires_in", 3600) - 60
+            return self.token
+
+    def lookup(self, beatmap_id: int) -> dict:
+        response = self.fetcher.request(
+            "GET",
+            f"{api_url}/beatmapsets/lookup",
+            params={"beatmap_id": beatmap_id},
+            headers={"Authorization": f"Bearer {self.authorize()}"},
+        )
+
+        if response.status_code == 401:
+            self.token = None
+
+        if response.status_code == 404:
+            raise BeatmapError("Beatmap Not Submitted!", "NotSubmitted")
+
+        if not response.ok:
+            raise BeatmapError(f"Api error {response.status_code}", "HttpError")
+
+        return self.decode(response)
+
+    def decode(self, response) -> dict:
+        try:
+            return response.json()
+        except ValueError as err:
+            raise BeatmapError("Api json parser error", "HttpError") from err
+
+
+class ProviderChain:
+    # the catalog answers first, the remote providers are asked in order on a
+    # miss. a definite answer from one of them ends the lookup, only network
+    # trouble moves on to the next.
+
+    def __init__(self, catalog: CatalogProvider = None, remote=()) -> None:
+        self.catalog = catalog or CatalogProvider()
+        self.remote = list(remote)
+        self.hits = {provider.name: 0 for provider in [self.catalog, *self.remote]}
+        self.misses = 0
+
+    def local(self, beatmap_id: int) -> dict | None:
+        beatmapset = self.catalog.lookup(beatmap_id)
+
+        if beatmapset:
+            self.hits[self.catalog.name] += 1
+        else:
+            self.misses += 1
+
+        return beatmapset
+
+    def fetch(self, beatmap_id: int) -> dict:
+        error = BeatmapError("No beatmap provider!", "HttpError")
+
+        for provider in self.remote:
+            try:
+                beatmapset = provider.lookup(beatmap_id)
+            except BeatmapError as err:
+                if err.error != "HttpError":
+                    raise
+
+                logger.warning(f"~ {provider.name} lookup failed | {err}")
+                error = err
+                continue
+
+            self.hits[provider.name] += 1
+            return beatmapset
+
+        raise error
+
+    def lookup(self, beatmap_id: int) -> dict:
+        return self.local(beatmap_id) or self.fetch(beatmap_id)
+
+    def readout(self) -> str:
+        hits = " | ".join(f"{name} {count}" for name, count in self.hits.items())
+        return f"{hits} | catalog misses {self.misses}"
+
+
+def build_providers(config: dict, fetcher: BeatmapFetcher) -> ProviderChain:
+    # "providers": {"catalogs": ["beatmapsets/dump.json"], "order": ["api", "scrape"],
+    #               "api": {"client_id": 1, "client_secret": "..."}}
+    remote = []
+
+    for name in config.get("order", ["api", "scrape"]):
+        if name == "api" and config.get("api"):
+            remote.append(ApiProvider(fetcher, **config.get("api")))
+        elif name == "scrape":
+            remote.append(ScrapeProvider(fetcher))
+
+    return ProviderChain(CatalogProvider(config.get("catalogs", [])), remote)
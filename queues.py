@@ -0,0 +1,61 @@
+from collections import OrderedDict
+from itertools import islice
+
+
+class HostQueue:
+    # ordered set of usernames, the first one is the host.
+    # add, remove, membership and rotate are O(1). version counts the changes,
+    # for replies built from the queue.
+
+    def __init__(self, users=()) -> None:
+        self.users = OrderedDict.fromkeys(users)
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def __bool__(self) -> bool:
+        return bool(self.users)
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __contains__(self, user: str) -> bool:
+        return user in self.users
+
+    def __repr__(self) -> str:
+        return repr(list(self.users))
+
+    def add(self, user: str) -> bool:
+        if user in self.users:
+            return False
+
+        self.users[user] = None
+        self.version += 1
+        return True
+
+    def discard(self, user: str) -> bool:
+        if self.users.pop(user, False) is None:
+            self.version += 1
+            return True
+
+        return False
+
+    def clear(self) -> None:
+        self.users.clear()
+        self.version += 1
+
+    def first(self) -> str | None:
+        return next(iter(self.users), None)
+
+    def second(self) -> str | None:
+        return next(islice(self.users, 1, None), None)
+
+    def peek(self, count: int) -> list:
+        return list(islice(self.users, count))
+
+    def rotate(self) -> None:
+        # current host goes to the back of the queue
+        if self.users:
+            self.users.move_to_end(next(iter(self.users)))
+            self.version += 1
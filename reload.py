@@ -0,0 +1,190 @@
+import copy
+import json
+import logging
+import os
+import threading
+from time import sleep
+from catalog import BeatmapCatalog, load_catalog
+from pool import BeatmapPool, load_pool, pool_path
+from rooms import room_key
+
+logger = logging.getLogger("irc.py")
+
+# room keys that need a new map cursor when changed
+pool_fields = ("bot_mode", "beatmapset_filename", "min", "max", "filters", "selection")
+
+
+class ConfigWatcher:
+    # polls the config and the pool files of its rooms by mtime. a change is
+    # turned into a room diff here, changed pools are loaded and the new cursors
+    # built here too, the bot thread only swaps the results in (apply_reload).
+
+    def __init__(self, bot, path="config.json", interval=2.0) -> None:
+        self.bot = bot
+        self.path = path
+        self.interval = interval
+        self.config = self.read()
+        self.mtimes = {}
+        self.thread = None
+
+        for path in self.paths(self.config):
+            self.modified(path)
+
+    def read(self) -> dict:
+        with open(self.path, "r") as f:
+            return json.loads(f.read())
+
+    def paths(self, config: dict) -> set:
+        paths = {self.path}
+        paths.update(config.get("providers", {}).get("catalogs", []))
+
+        for room in config.get("rooms", []):
+            if room.get("bot_mode") == 1 and room.get("beatmapset_filename"):
+                paths.add(pool_path(room))
+
+        return paths
+
+    def mtime(self, path: str) -> tuple | None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
+
+    def modified(self, path: str) -> bool:
+        mtime = self.mtime(path)
+
+        if mtime is None or self.mtimes.get(path) == mtime:
+            return False
+
+        self.mtimes[path] = mtime
+        return True
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, name="osu-reload", daemon=True)
+        self.thread.start()
+        logger.info(f"~ Watching {self.path} every {self.interval}s")
+
+    def run(self) -> None:
+        while not self.bot.stop:
+            sleep(self.interval)
+
+            try:
+                self.check()
+            except Exception as err:
+                logger.exception(f"~ Reload failed: {err}")
+
+    def check(self) -> bool:
+        # return: True if a reload was handed to the bot
+        # saved once the reload is handed over, a failed one is tried again
+        mtimes = {path: self.mtime(path) for path in self.paths(self.config)}
+        changed = [
+            path
+            for path, mtime in mtimes.items()
+            if mtime is not None and self.mtimes.get(path) != mtime
+        ]
+
+        if not changed:
+            return False
+
+        config = self.config
+
+        if self.path in changed:
+            try:
+                config = self.read()
+            except (OSError, ValueError) as err:
+                # a half written file, read again on the next poll
+                logger.error(f"~ Config not reloaded | {err}")
+                return False
+
+            # files the new config starts using
+            for path in self.paths(config) - self.mtimes.keys() - mtimes.keys():
+                mtimes[path] = self.mtime(path)
+
+        pools = {}
+
+        for path in changed:
+            if path != self.path and path in self.paths(config):
+                try:
+                    pools[path] = self.load(path)
+                except (OSError, ValueError) as err:
+                    logger.error(f"~ Pool not reloaded {path} | {err}")
+
+        reload = self.diff(self.config, config, pools)
+        self.config = config
+        self.mtimes.update(
+            (path, mtime) for path, mtime in mtimes.items() if mtime is not None
+        )
+        self.bot.call_soon(self.bot.apply_reload, reload)
+        logger.info(
+            f"~ Reload | {len(reload['add'])} added | {len(reload['remove'])} removed"
+            f" | {len(reload['update'])} updated | {len(pools)} pools"
+        )
+        return True
+
+    def load(self, path: str) -> tuple:
+        # the shared pool is only replaced on the bot thread
+        pool = BeatmapPool.load(path)
+        logger.info(f"~ Pool reloaded {path} | {len(pool)} maps")
+        return pool, BeatmapCatalog(pool)
+
+    def diff(self, old: dict, new: dict, pools: dict) -> dict:
+        old_rooms = {room_key(room): room for room in old.get("rooms", [])}
+        new_rooms = {room_key(room): room for room in new.get("rooms", [])}
+        reload = {
+            "pools": pools,
+            "remove": [key for key in old_rooms if key not in new_rooms],
+            "update": [],
+            "add": [],
+            "admins": new.get("admins"),
+        }
+
+        for key, room in new_rooms.items():
+            if key not in old_rooms:
+                if room.get("bot_mode") == 1:
+                    # parsed here, the bot thread only shuffles
+                    load_pool(pool_path(room))
+
+                reload["add"].append(copy.deepcopy(room))
+                continue
+
+            previous = old_rooms[key]
+            changes = {
+                field: copy.deepcopy(room.get(field))
+                for field in previous.keys() | room.keys()
+                if previous.get(field) != room.get(field)
+            }
+            rebuild = any(field in changes for field in pool_fields)
+
+            if room.get("bot_mode") == 1 and pool_path(room) in pools:
+                rebuild = True
+
+            if not changes and not rebuild:
+                continue
+
+            cursor = snapshot = None
+
+            if rebuild and room.get("bot_mode") == 1:
+                cursor, snapshot = self.cursor(key, room, changes, pools)
+
+            reload["update"].append((key, changes, cursor, snapshot))
+
+        return reload
+
+    def cursor(self, key, room: dict, changes: dict, pools: dict) -> tuple:
+        # return: (new cursor, state of the live cursor it continues from)
+        filename = pool_path(room)
+        pool, catalog = pools.get(filename) or (load_pool(filename), None)
+        cursor = self.bot.build_cursor(
+            room, pool=pool, catalog=catalog or load_catalog(filename)
+        )
+        live = self.bot.rooms.find(key)
+        snapshot = None
+
+        if live and live.get("beatmaps") and "beatmapset_filename" not in changes:
+            # same file, the rotation goes on where it was
+            snapshot = live["beatmaps"].state()
+            cursor.restore(**snapshot)
+
+        return cursor, snapshot
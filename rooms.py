@@ -0,0 +1,82 @@
+import logging
+
+logger = logging.getLogger("irc.py")
+
+
+def room_key(room: dict):
+    # what identifies a room across config reloads, "id" lets it be renamed
+    return room.get("id") or room.get("name", "").strip()
+
+
+class RoomRegistry:
+    # the configured rooms, indexed by name and by #mp_ channel
+
+    def __init__(self, rooms=()) -> None:
+        self.rooms = list(rooms)
+        self.by_name = {}
+        self.by_id = {}
+        self.reindex()
+
+    def __iter__(self):
+        return iter(self.rooms)
+
+    def __len__(self) -> int:
+        return len(self.rooms)
+
+    def reindex(self) -> None:
+        self.by_name.clear()
+        self.by_id.clear()
+
+        for room in self.rooms:
+            self.index(room)
+
+    def index(self, room: dict) -> None:
+        if room.get("name") in self.by_name:
+            logger.warning(f"~ Duplicate room name {room.get('name')}")
+        else:
+            self.by_name[room.get("name")] = room
+
+        if room.get("room_id"):
+            self.by_id[room.get("room_id")] = room
+
+    def add(self, room: dict) -> None:
+        self.rooms.append(room)
+        self.index(room)
+
+    def remove(self, room: dict) -> None:
+        self.rooms.remove(room)
+
+        if self.by_name.get(room.get("name")) is room:
+            del self.by_name[room.get("name")]
+
+        if self.by_id.get(room.get("room_id")) is room:
+            del self.by_id[room.get("room_id")]
+
+    def rename(self, room: dict, name: str) -> None:
+        if self.by_name.get(room.get("name")) is room:
+            del self.by_name[room.get("name")]
+
+        room["name"] = name
+        self.index(room)
+
+    def find(self, key) -> dict | None:
+        for room in self.rooms:
+            if room_key(room) == key:
+                return room
+
+        return None
+
+    def set_room_id(self, room: dict, room_id: str | None) -> None:
+        if self.by_id.get(room.get("room_id")) is room:
+            del self.by_id[room.get("room_id")]
+
+        room["room_id"] = room_id
+
+        if room_id:
+            self.by_id[room_id] = room
+
+    def get(self, room_name=None, room_id=None) -> dict | None:
+        if room_id is not None and room_id in self.by_id:
+            return self.by_id[room_id]
+
+        return self.by_name.get(room_name) if room_name is not None else None
@@ -0,0 +1,100 @@
+from typing import NamedTuple
+
+
+class SlotState(NamedTuple):
+    slot: int
+    status: str  # "Ready", "Not Ready", "No Map"
+    user_id: int
+    user: str
+    host: bool
+    team: str | None  # "Red", "Blue" or None outside team modes
+    mods: tuple
+
+
+class RosterDiff(NamedTuple):
+    joined: list
+    left: list
+    host: str | None  # the new host, None if it didn't change
+    teams: dict  # user -> new team, for users that switched
+
+
+def slot_state(slot: int, status: str, user_id: int, user: str, roles) -> SlotState:
+    if not roles:
+        return SlotState(slot, status, user_id, user, False, None, ())
+
+    host = False
+    team = None
+    mods = []
+
+    for role in roles:
+        if role == "Host":
+            host = True
+        elif role.startswith("Team"):
+            team = role[4:]
+        else:
+            mods.append(role)
+
+    return SlotState(slot, status, user_id, user, host, team, tuple(mods))
+
+
+class Roster:
+    # the players of a room as of the last complete !mp settings reply. the
+    # "Players: N" line opens a snapshot, the N slot lines fill it and the last
+    # one swaps it in, returning what changed since the previous one.
+
+    def __init__(self) -> None:
+        self.users = {}  # user -> SlotState
+        self.host = None
+        self.pending = None
+        self.expected = 0
+        self.snapshots = 0
+
+    def __contains__(self, user: str) -> bool:
+        return user in self.users
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def begin(self, players: int) -> RosterDiff | None:
+        # an unfinished reply (lost lines) is dropped
+        self.pending = {}
+        self.expected = players
+        return self.commit() if not players else None
+
+    def add(
+        self, slot: int, status: str, user_id: int, user: str, roles
+    ) -> RosterDiff | None:
+        if self.pending is None:
+            # no Players line before it
+            return None
+
+        self.pending[user] = slot_state(slot, status, user_id, user, roles)
+
+        if len(self.pending) >= self.expected:
+            return self.commit()
+
+        return None
+
+    def commit(self) -> RosterDiff:
+        old, new = self.users, self.pending
+        host = next((user for user, state in new.items() if state.host), None)
+        diff = RosterDiff(
+            [user for user in new if user not in old],
+            [user for user in old if user not in new],
+            host if host != self.host else None,
+            {
+                user: state.team
+                for user, state in new.items()
+                if user in old and old[user].team != state.team
+            },
+        )
+        self.users, self.host, self.pending = new, host, None
+        self.snapshots += 1
+        return diff
+
+    def slots(self) -> list:
+        return sorted(self.users.values())
+
+    def mods(self, user: str) -> tuple:
+        state = self.users.get(user)
+        return state.mods if state else ()
@@ -0,0 +1,428 @@
+import math
+import random
+from array import array
+from collections import deque
+from pool import Beatmap, BeatmapPool
+
+# picks a value stays blocked for, per column. beatmap_id and beatmapset_id keep
+# maps from repeating, mapper and artist spread the picks.
+default_window = {"beatmap_id": 100, "beatmapset_id": 30, "mapper": 3, "artist": 3}
+# columns whose maps leave the tree while in the window. the others are checked
+# per sampled map, a mapper can have thousands of maps in a big pool.
+grouped_columns = ("beatmapset_id",)
+# sampled maps turned down for spread before one is taken anyway
+spread_tries = 32
+# weight factor of a map never drops below this, however often it was skipped
+min_factor = 0.05
+
+
+class FenwickTree:
+    # prefix sums over the weights, O(log n) to change one or to sample by weight
+
+    def __init__(self, weights) -> None:
+        self.weights = array("d", weights)
+        self.size = len(self.weights)
+        self.top = 1 << (self.size.bit_length() - 1) if self.size else 0
+        self.build()
+
+    def build(self) -> None:
+        # O(n), also run now and then to drop the float error of the updates
+        tree = array("d", [0.0]) * (self.size + 1)
+
+        for i, weight in enumerate(self.weights, 1):
+            tree[i] += weight
+            parent = i + (i & -i)
+
+            if parent <= self.size:
+                tree[parent] += tree[i]
+
+        self.tree = tree
+        self.updates = 0
+
+    def total(self) -> float:
+        total = 0.0
+        i = self.size
+
+        while i:
+            total += self.tree[i]
+            i -= i & -i
+
+        return total
+
+    def set(self, position: int, weight: float) -> None:
+        delta = weight - self.weights[position]
+
+        if not delta:
+            return
+
+        self.weights[position] = weight
+        self.updates += 1
+
+        if self.updates > self.size:
+            self.build()
+            return
+
+        i = position + 1
+
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def find(self, value: float) -> int:
+        # return: position whose weight covers value, 0 <= value < total()
+        position = 0
+        step = self.top
+
+        while step:
+            if position + step <= self.size and self.tree[position + step] <= value:
+                position += step
+                value -= self.tree[position]
+
+            step >>= 1
+
+        return min(position, self.size - 1)
+
+
+class WeightedCursor:
+    # samples a room's next maps by weight instead of walking a shuffled order.
+    # a pick blocks its values in the window columns for the next picks, skipped
+    # maps lose weight. reads like PoolCursor: current() is the next map.
+
+    def __init__(
+        self,
+        pool: BeatmapPool,
+        indices=None,
+        seed=None,
+        weights=None,
+        stars=None,
+        window=None,
+        skip_penalty=0.5,
+    ) -> None:
+        self.pool = pool
+        self.indices = array("I", range(len(pool)) if indices is None else indices)
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.random = random.Random(self.seed)
+        # "weights": {"play_count": 1, "favorites": 0.5, "stars": 2}, 0 ignores one
+        self.attributes = weights or {}
+        self.stars = stars
+        self.window = {**default_window, **(window or {})}
+        self.skip_penalty = skip_penalty
+        self.base = self.base_weights()
+        self.factors = {}  # position -> skip factor, only for penalized maps
+        self.blocked = array("H", bytes(2 * len(self.indices)))
+        self.tree = FenwickTree(self.base)
+        columns = [
+            column
+            for column, size in self.window.items()
+            if size and column in pool.columns
+        ]
+        # column -> value -> positions
+        self.groups = {
+            column: self.group(column)
+            for column in columns
+            if column in grouped_columns
+        }
+        self.spread = [
+            column
+            for column in columns
+            if column != "beatmap_id" and column not in self.groups
+        ]
+        self.recent = {column: deque() for column in columns}
+        self.counts = {column: {} for column in columns}
+        self.history = deque(maxlen=max(self.window.values(), default=0))
+        self.upcoming = deque()
+        self.playing = None
+        self.picks = 0
+        self.saved = None  # state() until the next pick or penalty
+
+    def base_weights(self) -> array:
+        weights = array("d", [1.0]) * len(self.indices)
+
+        for attribute, power in self.attributes.items():
+            if not power:
+                continue
+
+            scores = self.scores(attribute)
+            weights = array(
+                "d",
+                (
+                    weight * (score if score > 0.01 else 0.01) ** power
+                    for weight, score in zip(weights, scores)
+                ),
+            )
+
+        return weights
+
+    def scores(self, attribute: str) -> list:
+        # 0..1 per position
+        if attribute == "stars":
+            column = self.pool.columns.get("difficulty")
+            low, high = self.stars or (None, None)
+            values = [column[row] for row in self.indices]
+            low = min(values) if low is None else low
+            high = max(values) if high is None else high
+            middle, half = (low + high) / 2, max((high - low) / 2, 0.01)
+            return [1 - abs(value - middle) / half for value in values]
+
+        # counts like play_count or favorites, on a log scale
+        column = self.pool.columns.get(attribute)
+
+        if column is None:
+            raise ValueError(f"unknown selection weight: {attribute}")
+
+        log1p = math.log1p
+        values = [column[row] or 0 for row in self.indices]
+        top = log1p(max(max(values, default=0), 0)) or 1
+        return [log1p(value) / top if value > 0 else 0.0 for value in values]
+
+    def group(self, column: str) -> dict:
+        values = self.pool.columns[column]
+        groups = {}
+
+        for position, row in enumerate(self.indices):
+            value = values[row]
+
+            # a missing value blocks nothing
+            if value is not None:
+                if value in groups:
+                    groups[value].append(position)
+                else:
+                    groups[value] = [position]
+
+        return groups
+
+    def weight(self, position: int) -> float:
+        if self.blocked[position]:
+            return 0.0
+
+        return self.base[position] * self.factors.get(position, 1.0)
+
+    def members(self, column: str, value) -> tuple:
+        # positions taken out of the tree while value is in the window
+        if column == "beatmap_id":
+            return (value,)
+
+        if column in self.groups:
+            return self.groups[column].get(value, ())
+
+        return ()
+
+    def block(self, column: str, value) -> None:
+        counts = self.counts[column]
+        counts[value] = counts.get(value, 0) + 1
+
+        if counts[value] > 1:
+            return
+
+        for position in self.members(column, value):
+            self.blocked[position] += 1
+            self.tree.set(position, 0.0)
+
+    def unblock(self, column: str, value) -> None:
+        counts = self.counts[column]
+        counts[value] -= 1
+
+        if counts[value]:
+            return
+
+        del counts[value]
+
+        for position in self.members(column, value):
+            self.blocked[position] -= 1
+            self.tree.set(position, self.weight(position))
+
+    def pick(self, position: int) -> None:
+        row = self.indices[position]
+        self.history.append(position)
+        self.saved = None
+
+        for column, recent in self.recent.items():
+            # beatmap ids are kept as positions, one map each
+            value = (
+                position if column == "beatmap_id" else self.pool.columns[column][row]
+            )
+            recent.append(value)
+            self.block(column, value)
+
+            if len(recent) > self.window[column]:
+                self.unblock(column, recent.popleft())
+
+    def release(self) -> bool:
+        # every map is blocked, a small pool: the oldest picks go first
+        released = False
+
+        for column, recent in self.recent.items():
+            if recent:
+                self.unblock(column, recent.popleft())
+                released = True
+
+        return released
+
+    def sample(self) -> int | None:
+        dead = self.pool.dead
+        tries = 0
+
+        while True:
+            total = self.tree.total()
+
+            if total <= 0:
+                if not self.release():
+                    return None
+                continue
+
+            position = self.tree.find(self.random.random() * total)
+
+            if self.tree.weights[position] <= 0:
+                # float error left in the sums, rebuilt from the weights
+                self.tree.build()
+                continue
+
+            if self.indices[position] in dead:
+                self.base[position] = 0.0
+                self.tree.set(position, 0.0)
+                continue
+
+            if tries < spread_tries and self.crowded(position):
+                tries += 1
+                continue
+
+            self.pick(position)
+            return position
+
+    def crowded(self, position: int) -> bool:
+        # mapper or artist of one of the last picks
+        row = self.indices[position]
+
+        for column in self.spread:
+            value = self.pool.columns[column][row]
+
+            if value is not None and value in self.counts[column]:
+                return True
+
+        return False
+
+    def fill(self, count: int) -> None:
+        dead = self.pool.dead
+
+        if dead and any(self.indices[position] in dead for position in self.upcoming):
+            self.upcoming = deque(
+                position
+                for position in self.upcoming
+                if self.indices[position] not in dead
+            )
+            self.saved = None
+
+        while len(self.upcoming) < count:
+            position = self.sample()
+
+            if position is None:
+                return
+
+            self.upcoming.append(position)
+
+    def state(self) -> dict:
+        # beatmap ids, the pool may change between restarts. recent holds the
+        # maps sampled so far, upcoming the ones of them not played yet.
+        if self.saved is None:
+            beatmap_ids = self.pool.columns["beatmap_id"]
+            self.saved = {
+                "seed": self.seed,
+                "recent": [beatmap_ids[self.indices[p]] for p in self.history],
+                "upcoming": [beatmap_ids[self.indices[p]] for p in self.upcoming],
+                "playing": (
+                    None
+                    if self.playing is None
+                    else beatmap_ids[self.indices[self.playing]]
+                ),
+                "penalized": sorted(
+                    [beatmap_ids[self.indices[position]], factor]
+                    for position, factor in self.factors.items()
+                ),
+            }
+
+        return self.saved
+
+    def restore(
+        self, seed: int, recent=(), penalized=(), upcoming=(), playing=None, **legacy
+    ) -> None:
+        # a PoolCursor state only brings the seed
+        self.seed = seed
+        self.random = random.Random(seed)
+        beatmap_ids = self.pool.columns["beatmap_id"]
+        positions = {
+            beatmap_ids[row]: position for position, row in enumerate(self.indices)
+        }
+
+        for beatmap_id, factor in penalized:
+            position = positions.get(beatmap_id)
+
+            if position is not None:
+                self.factors[position] = factor
+                self.tree.set(position, self.weight(position))
+
+        for beatmap_id in recent:
+            if beatmap_id in positions:
+                self.pick(positions[beatmap_id])
+
+        # the queue players were shown goes on, these are in recent already
+        dead = self.pool.dead
+        self.upcoming = deque(
+            positions[beatmap_id]
+            for beatmap_id in upcoming
+            if beatmap_id in positions
+            and self.indices[positions[beatmap_id]] not in dead
+        )
+        self.playing = positions.get(playing)
+        self.saved = None
+
+    def penalize(self, factor: float = None) -> None:
+        # the map being played was skipped
+        position = self.playing
+
+        if position is None:
+            return
+
+        factor = self.factors.get(position, 1.0) * (factor or self.skip_penalty)
+        self.factors[position] = max(factor, min_factor)
+        self.saved = None
+        self.tree.set(position, self.weight(position))
+
+    @property
+    def cycle(self) -> int:
+        return self.picks // len(self.indices) if self.indices else 0
+
+    @property
+    def cursor(self) -> int:
+        return self.picks % len(self.indices) if self.indices else 0
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __bool__(self) -> bool:
+        return bool(self.indices)
+
+    def current(self) -> Beatmap | None:
+        # None when every map is dead or filtered out
+        self.fill(1)
+
+        if not self.upcoming:
+            return None
+
+        return self.pool[self.indices[self.upcoming[0]]]
+
+    def advance(self) -> None:
+        self.fill(1)
+
+        if not self.upcoming:
+            return
+
+        self.playing = self.upcoming.popleft()
+        self.picks += 1
+        self.saved = None
+
+    def peek(self, count: int) -> list:
+        self.fill(count)
+        return [
+            self.pool[self.indices[position]]
+            for position in list(self.upcoming)[:count]
+        ]
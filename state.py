@@ -0,0 +1,96 @@
+import json
+import logging
+import sqlite3
+import threading
+from time import time
+from queues import HostQueue
+
+logger = logging.getLogger("irc.py")
+
+
+def snapshot(room: dict) -> dict:
+    # what a restarted bot needs to pick the lobby up where it was
+    beatmaps = room.get("beatmaps")
+    return {
+        "room_id": room.get("room_id"),
+        "users": list(room.get("users") or ()),
+        "skip": sorted(room.get("skip") or ()),
+        "current_beatmap": room.get("current_beatmap"),
+        "beatmaps": beatmaps.state() if beatmaps else None,
+    }
+
+
+class RoomStateStore:
+    # one row per (account, room name) in sqlite, rewritten in its own
+    # transaction whenever the snapshot of the room changes
+
+    def __init__(self, path="rooms_state.db", timeout=10.0) -> None:
+        self.lock = threading.Lock()
+        self.saved = {}  # (account, name) -> last written snapshot
+        # shared by the shard processes, writers wait for the lock
+        self.db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS rooms (
+                account TEXT, name TEXT, updated REAL, data TEXT,
+                PRIMARY KEY (account, name)
+            );
+            """)
+
+    def load(self, account: str, name: str) -> dict | None:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT data FROM rooms WHERE account = ? AND name = ?",
+                (account, name),
+            ).fetchone()
+
+        if not row:
+            return None
+
+        data = json.loads(row[0])
+        self.saved[(account, name)] = data
+        return data
+
+    def save(self, account: str, room: dict) -> bool:
+        data = snapshot(room)
+        key = (account, room.get("name"))
+
+        if self.saved.get(key) == data:
+            return False
+
+        with self.lock, self.db:
+            self.db.execute(
+                "REPLACE INTO rooms (account, name, updated, data) VALUES (?, ?, ?, ?)",
+                (account, room.get("name"), time(), json.dumps(data)),
+            )
+
+        self.saved[key] = data
+        return True
+
+    def restore(self, account: str, room: dict) -> bool:
+        # return: True if the room has a live lobby to rejoin
+        data = self.load(account, room.get("name"))
+
+        if not data or not data.get("room_id"):
+            return False
+
+        room["room_id"] = data.get("room_id")
+        # the lobby exists and is set up, check_rooms only has to JOIN it
+        room["created"] = True
+        room["users"] = HostQueue(data.get("users"))
+        room["skip"] = set(data.get("skip"))
+        room["current_beatmap"] = data.get("current_beatmap")
+
+        if room.get("beatmaps") and data.get("beatmaps"):
+            room["beatmaps"].restore(**data.get("beatmaps"))
+
+        logger.info(
+            f"~ Restored {room.get('name')} | {room.get('room_id')}"
+            f" | {len(room['users'])} users"
+        )
+        return True
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,298 @@
+import copy
+import heapq
+import logging
+import logs
+import multiprocessing
+import queue
+import signal
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from time import monotonic, sleep, time
+from irc import OsuIrc, build_bot, get_config, setup_logging
+from metrics import start_metrics
+
+logger = logging.getLogger("irc.py")
+
+
+class ShardFilter(logging.Filter):
+    def __init__(self, shard: str) -> None:
+        super().__init__()
+        self.shard = shard
+
+    def filter(self, record) -> bool:
+        record.msg = f"[{self.shard}] {record.msg}"
+        return True
+
+
+def report_stats(irc: OsuIrc, shard: str, stats, interval: float) -> None:
+    while not irc.stop:
+        sleep(interval)
+        rooms = list(irc.rooms)
+        stats.put(
+            {
+                "shard": shard,
+                "time": time(),
+                "rooms": len(rooms),
+                "users": sum(len(room.get("users") or ()) for room in rooms),
+                "outbound": irc.outbound.stats(),
+                "cache": irc.cache.stats(),
+            }
+        )
+
+
+def read_commands(irc: OsuIrc, commands) -> None:
+    while not irc.stop:
+        command, rooms = commands.get()
+
+        if command == "add_rooms":
+            for room in rooms:
+                logger.info(f"~ Room moved to this shard | {room.get('name')}")
+                # the rooms belong to the bot thread
+                irc.call_soon(irc.add_room, room)
+
+
+def run_worker(account: dict, rooms: list, settings: dict, records, stats, commands):
+    # one connection per account, logs and stats go back to the supervisor
+    shard = account.get("username")
+    handler = QueueHandler(records)
+    # on the handler so the category loggers are prefixed too
+    handler.addFilter(ShardFilter(shard))
+    logger.handlers = [handler]
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+    if settings.get("logging"):
+        logs.set_levels(settings.get("logging"))
+
+    engine = OsuIrc
+
+    if settings.get("engine") == "async":
+        import asyncio
+        from async_irc import AsyncOsuIrc
+
+        engine = AsyncOsuIrc
+
+    irc = build_bot(
+        {
+            **settings,
+            "username": account.get("username"),
+            "password": account.get("password"),
+            "rooms": rooms,
+        },
+        engine=engine,
+    )
+    metrics = dict(settings.get("metrics", {}))
+
+    if metrics.get("port"):
+        # one endpoint per shard, counting up from the configured port
+        metrics["port"] += settings.get("index", 0)
+
+    start_metrics(irc.metrics, metrics)
+
+    for target, args in (
+        (report_stats, (irc, shard, stats, settings.get("stats_interval", 60))),
+        (read_commands, (irc, commands)),
+    ):
+        threading.Thread(target=target, args=args, daemon=True).start()
+
+    # terminate() from the supervisor unwinds like a normal exit
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        if settings.get("engine") == "async":
+            asyncio.run(irc.start())
+        else:
+            irc.start()
+    finally:
+        if irc.history:
+            # the buffered matches are written before the process ends
+            irc.history.close()
+
+
+class Shard:
+    def __init__(self, account: dict, index: int) -> None:
+        self.account = account
+        self.index = index
+        self.name = account.get("username")
+        self.rooms = []
+        self.process = None
+        self.commands = None
+        self.restarts = []  # monotonic times of recent restarts
+        self.next_start = 0.0
+        self.dead = False
+        self.stats = {}
+
+    @property
+    def load(self) -> float:
+        return sum(room.get("weight", 1) for room in self.rooms)
+
+
+class Supervisor:
+    # spreads rooms over one worker process per bot account, restarts crashed
+    # workers with backoff and moves the rooms of a shard that keeps dying
+
+    def __init__(
+        self,
+        accounts: list,
+        rooms: list,
+        settings={},
+        max_restarts=5,
+        restart_window=300.0,
+        backoff=2.0,
+        stats_interval=60.0,
+    ) -> None:
+        self.context = multiprocessing.get_context("spawn")
+        self.shards = [Shard(account, index) for index, account in enumerate(accounts)]
+        self.settings = settings
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.backoff = backoff
+        self.stats_interval = stats_interval
+        self.logs = self.context.Queue()
+        self.stats = self.context.Queue()
+        self.stop = False
+        self.assign(rooms)
+
+    def live_shards(self) -> list:
+        return [shard for shard in self.shards if not shard.dead]
+
+    def assign(self, rooms: list) -> list:
+        # heaviest room first onto the least loaded live shard
+        shards = self.live_shards()
+        heap = [(shard.load, index, shard) for index, shard in enumerate(shards)]
+        heapq.heapify(heap)
+        placed = []
+
+        for room in sorted(rooms, key=lambda room: -room.get("weight", 1)):
+            load, index, shard = heapq.heappop(heap)
+            shard.rooms.append(room)
+            placed.append((shard, room))
+            heapq.heappush(heap, (load + room.get("weight", 1), index, shard))
+
+        return placed
+
+    def start_shard(self, shard: Shard) -> None:
+        shard.commands = self.context.Queue()
+        shard.process = self.context.Process(
+            target=run_worker,
+            name=f"shard-{shard.name}",
+            args=(
+                shard.account,
+                copy.deepcopy(shard.rooms),
+                {
+                    **self.settings,
+                    "index": shard.index,
+                    "stats_interval": self.stats_interval,
+                },
+                self.logs,
+                self.stats,
+                shard.commands,
+            ),
+            daemon=True,
+        )
+        shard.process.start()
+        logger.info(f"~ Shard {shard.name} started | {len(shard.rooms)} rooms")
+
+    def on_shard_exit(self, shard: Shard) -> None:
+        now = monotonic()
+        shard.restarts = [t for t in shard.restarts if now - t < self.restart_window]
+        logger.error(
+            f"~ Shard {shard.name} exited with {shard.process.exitcode}"
+            f" | {len(shard.restarts)} recent restarts"
+        )
+        shard.process = None
+
+        if len(shard.restarts) < self.max_restarts:
+            shard.restarts.append(now)
+            shard.next_start = now + self.backoff * 2 ** (len(shard.restarts) - 1)
+            return
+
+        shard.dead = True
+        rooms, shard.rooms = shard.rooms, []
+
+        if not self.live_shards():
+            logger.critical("~ Every shard is dead, giving up")
+            self.stop = True
+            return
+
+        for target, room in self.assign(rooms):
+            logger.warning(f"~ Room {room.get('name')} moved to shard {target.name}")
+
+            if target.process:
+                target.commands.put(("add_rooms", [copy.deepcopy(room)]))
+
+    def collect_stats(self) -> None:
+        while True:
+            try:
+                stats = self.stats.get_nowait()
+            except queue.Empty:
+                return
+
+            for shard in self.shards:
+                if shard.name == stats.get("shard"):
+                    shard.stats = stats
+
+    def report(self) -> None:
+        live = [shard for shard in self.shards if shard.process]
+        outbound = [shard.stats.get("outbound", {}) for shard in live]
+        logger.info(
+            f"~ Supervisor | shards {len(live)}/{len(self.shards)}"
+            f" | rooms {sum(len(shard.rooms) for shard in live)}"
+            f" | users {sum(shard.stats.get('users', 0) for shard in live)}"
+            f" | outbound depth {sum(stats.get('depth', 0) for stats in outbound)}"
+            f" | sent {sum(stats.get('sent', 0) for stats in outbound)}"
+            f" | wait max {max((stats.get('wait_max', 0.0) for stats in outbound), default=0.0):.2f}s"
+        )
+
+    def run(self) -> None:
+        handlers = logging.getLogger().handlers + logger.handlers
+        listener = QueueListener(self.logs, *handlers, respect_handler_level=True)
+        listener.start()
+        reported = monotonic()
+
+        try:
+            while not self.stop:
+                now = monotonic()
+
+                for shard in self.live_shards():
+                    if shard.process and not shard.process.is_alive():
+                        self.on_shard_exit(shard)
+                    elif not shard.process and now >= shard.next_start:
+                        self.start_shard(shard)
+
+                self.collect_stats()
+
+                if now - reported >= self.stats_interval:
+                    reported = now
+                    self.report()
+
+                sleep(1)
+        except KeyboardInterrupt:
+            logger.info("~ Supervisor stopping")
+        finally:
+            for shard in self.shards:
+                if shard.process:
+                    shard.process.terminate()
+                    shard.process.join(5)
+
+            listener.stop()
+
+
+if __name__ == "__main__":
+    config = get_config()
+    setup_logging(config.get("logging"))
+    accounts = config.get("accounts") or [
+        {"username": config.get("username"), "password": config.get("password")}
+    ]
+    supervisor = Supervisor(
+        accounts=accounts,
+        rooms=config.get("rooms"),
+        # the same keys as a single bot, build_bot reads them per shard
+        settings={
+            key: value
+            for key, value in config.items()
+            if key not in ("accounts", "rooms", "username", "password")
+        },
+    )
+    supervisor.run()
@@ -0,0 +1,50 @@
+import socket
+
+
+class LineTransport:
+    # CRLF framed lines over a blocking socket. reads go through one reusable
+    # buffer with recv_into and are split at the byte level, so a multibyte
+    # character cut between two recv calls is only decoded once its line is
+    # complete. writes are buffered and flushed with a single sendall.
+
+    def __init__(self, sock: socket.socket, size=64 * 1024) -> None:
+        self.socket = sock
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.pending = bytearray()
+        self.outgoing = bytearray()
+        self.reads = 0
+        self.flushes = 0
+
+    def read_lines(self) -> list:
+        count = self.socket.recv_into(self.view)
+
+        if not count:
+            raise ConnectionError("Disconnected from server")
+
+        self.reads += 1
+        end = self.buffer.rfind(b"\n", 0, count)
+
+        if end == -1:
+            # no complete line yet
+            self.pending += self.view[:count]
+            return []
+
+        self.pending += self.view[:end]
+        lines = self.pending.split(b"\n")
+        self.pending = bytearray(self.view[end + 1 : count])
+        return [line.rstrip(b"\r").decode("utf-8", "replace") for line in lines]
+
+    def write(self, message: str) -> None:
+        self.outgoing += message.encode()
+        self.outgoing += b"\r\n"
+
+    def flush(self) -> None:
+        if not self.outgoing:
+            return
+
+        try:
+            self.socket.sendall(self.outgoing)
+            self.flushes += 1
+        finally:
+            self.outgoing.clear()